@@ -1,11 +1,19 @@
+import hashlib
 import os
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from collections import OrderedDict
 from timeit import default_timer as timer
 import numpy as np
 import pandas as pd
 import sys
 sys.path.append("./scripts/src/")
 import mrdmd_zscore
+from scripts.baseline_discovery import get_baseline_candidates, longest_runs
+from scripts.baseline_registry import baseline_key, get_baseline_registry
+from scripts.mrdmd_worker import TASKS, baseline_std, run_task, tree_level_zscores, tree_row_power
+from scripts.online_mrdmd import OnlineMrDMD
+from scripts.shared_pool import MAX_WORKERS, run_shared
+from scripts.tensor import MetricTensor, node_digest
 
 ml = 9
 step = 10000
@@ -13,6 +21,16 @@ std_baselines_dict = {}
 CACHE_DIR = './scripts/cache/'
 ZSC_B_CACHE_NAME = CACHE_DIR + 'mrDMDbaselineZscores.parquet'
 ZSC_CACHE_NAME = CACHE_DIR + 'mrDMDbaselineData.parquet'
+MODE_TREE_DIR = CACHE_DIR + 'mode_trees/'
+MODE_TREE_MAX_BYTES = 512 * 1024 * 1024  # .npz trees on disk; least recently used are removed past this
+MODE_TREE_MAX_ENTRIES = 64               # trees held in memory, least recently used dropped first
+SVD_BACKEND = 'qr'          # MrDMDZscore svd backend: exact, qr or randomized
+MRDMD_ENGINE = 'levels'     # MrDMDZscore engine: recursive or levels (batched per tree level)
+MRDMD_TREE_MODE = False     # selections sliced from one all-node tree per metric (approximate, see server/README.md)
+MRDMD_PROCESS_POOL = True   # one metric per task across processes
+MRDMD_MAX_WORKERS = None    # None -> one worker per core
+MRDMD_TASK_TIMEOUT = None   # seconds per metric before it is dropped
+MRDMD_ONLINE_WINDOW = 4096  # samples per online block; streaming z-scores cover the latest window
 
 def preprocess(df, col):
     return df.pivot(index="nodeId", columns="timestamp", values=col) \
@@ -36,90 +54,69 @@ def find_time_range(df, lower, upper):
     Finds the longest contiguous time period where all nodes have nonzero values and the values are within the baseline range (lower and upper).
     Returns the first and last timestamp of this period.
     """
-    longest_start, longest_end = None, None
-    max_length = 0  # Initialize as integer to represent the longest valid period in terms of indices
-    current_start = None
-
-    for i in range(len(df.columns)):
-        # Check if all values in the current column are within the baseline range
-        valid_period = (df.iloc[:, i] >= lower) & (df.iloc[:, i] <= upper)
-        
-        if valid_period.all():  # If the entire column is within the range
-            if current_start is None:  # Start a new valid period
-                current_start = i
-        else:
-            if current_start is not None:
-                length = i - current_start
-                if length > max_length:  # Update longest period
-                    max_length = length
-                    longest_start, longest_end = current_start, i - 1
-                current_start = None  # Reset for the next sequence
-
-    # If the last sequence was the longest, update it
-    if current_start is not None:
-        length = len(df.columns) - current_start
-        if length > max_length:
-            longest_start, longest_end = current_start, len(df.columns) - 1
-
-    if longest_start is not None and longest_end is not None:
-        start_timestamp = df.columns[longest_start]
-        end_timestamp = df.columns[longest_end]
-        return start_timestamp, end_timestamp
+    inside = ((df.to_numpy() >= lower) & (df.to_numpy() <= upper)).all(axis=0)
+    runs = longest_runs(inside[None, :], top_n=1)[0]
+    if runs:
+        start, end, _ = runs[0]
+        return df.columns[start], df.columns[end]
 
     print("No valid period found within the baseline range.")
     return pd.to_datetime(df.columns).min(), pd.to_datetime(df.columns).max()
 
-# Running mrdmd on a single column with configured baseline (time and value range)
-def process_baseline(df, col, bmin, bmax, sob, eob):
-    # TODO: save new baseline to cache
-    Z_final = []
-    ml = 9
-    step = 10000
-    df_col = df.pivot(index="nodeId", columns="timestamp", values=col) \
-                .apply(pd.to_numeric, errors='coerce') \
-                .ffill(axis='rows') \
-                .bfill(axis='rows')
-    
-    if sob is not None and eob is not None:
-        df_col.columns = pd.to_datetime(df_col.columns)
-        sob = pd.to_datetime(sob)
-        eob = pd.to_datetime(eob)
-        df_col = df_col.loc[:, (df_col.columns >= sob) & (df_col.columns <= eob)]
+def run_metric_tasks(name, stack, tasks):
+    """
+    One mrDMD task per metric of stack (metrics x nodes x time). Several tasks go to
+    the process pool, which shares the stack instead of pickling it; results come
+    back in task order either way, None for a task that failed.
+    """
+    if MRDMD_PROCESS_POOL and len(tasks) > 1 and MAX_WORKERS > 1:
+        return run_shared(run_task, [(name, *task) for task in tasks], {'mrdmd': stack},
+                          max_workers=MRDMD_MAX_WORKERS, timeout=MRDMD_TASK_TIMEOUT)
+    results = []
+    for m, *args in tasks:
+        try:
+            results.append(TASKS[name](stack[m], *args))
+        except Exception as e:
+            print(f"Task {name} {m} failed: {e}")
+            results.append(None)
+    return results
+
+def mrdmd_config():
+    return {"svd_backend": SVD_BACKEND, "engine": MRDMD_ENGINE}
+
+def metric_stack(tensor, cols):
+    return np.stack([tensor.metric(col, fill='ffill') for col in cols])
+
+def baseline_mask(tensor, baselines, col):
+    """Time mask of the baseline window of col, None without a usable baseline"""
+    base = baselines[baselines['feature'] == col]
+    if base.empty or base.z_score.values[0] is None:
+        print(f"[WARNING] No baseline found for column: {col}")
+        return None
+    return tensor.time_mask(pd.to_datetime(base['b_start'].values[0]), pd.to_datetime(base['b_end'].values[0]))
+
+_zsc_b_lock = threading.Lock()
+
+def save_active_baselines(Z_b):
+    """Makes the rows of Z_b the baselines of their features in ZSC_B_CACHE_NAME"""
+    if Z_b.empty:
+        return
+    with _zsc_b_lock:
+        if os.path.exists(ZSC_B_CACHE_NAME):
+            ZSC_d = pd.read_parquet(ZSC_B_CACHE_NAME)
+            Z_b = pd.concat([ZSC_d[~ZSC_d['feature'].isin(Z_b['feature'])], Z_b], ignore_index=True)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        Z_b.to_parquet(ZSC_B_CACHE_NAME)
 
-    D = df_col.iloc[:,:].to_numpy()
+def register_baseline(key, col, bmin, bmax, sob, eob, version, n_nodes, std_baselines, source):
+    z_score = std_baselines[0] if len(std_baselines) else None
+    get_baseline_registry().put(key, None if z_score is None else float(z_score),
+                                feature=col, v_min=float(bmin), v_max=float(bmax),
+                                b_start=None if sob is None else str(sob), b_end=None if eob is None else str(eob),
+                                version=version, n_nodes=n_nodes, source=source)
 
-    # run mrDMD
-    mrDMDZSC = mrdmd_zscore.MrDMDZscore()
-    nodes1 = mrDMDZSC.mrdmd(D, max_levels=ml, max_cycles=1, do_parallel=False)
-    
-    data = D.copy()
-    data1 = data
-    max_levels=ml
-    splt = mrDMDZSC.get_splt(step, max_levels)
-    nodes = nodes1
-    baselines = []
-    baseline_indx = []
-    for i in range(data.shape[0]):
-        t = data[i, :]
-        if (min(t) >= bmin and max(t) <= bmax):
-            baselines.append(t)
-            baseline_indx.append(i)
-    
-    n_baseline_indx = [nb for nb in range(data.shape[0]) if nb not in baseline_indx]
-   
-   # compute z-score
-    split_point = (data.shape[0] + 1) // 2
-    baseline_indx = np.arange(0, split_point)
-    n_baseline_indx = np.arange(split_point, data.shape[0])
-    std_baselines = mrDMDZSC.compute_zscore(data1, \
-                                            splt, \
-                                            nodes, \
-                                            baseline_indx, \
-                                            n_baseline_indx, \
-                                            for_baseline=True, \
-                                            plot=False)
-
-    std_baselines_df = pd.DataFrame({
+def baseline_frame(col, bmin, bmax, sob, eob, std_baselines):
+    return pd.DataFrame({
         "feature": col,
         "b_start": sob,
         "b_end": eob,
@@ -127,179 +124,121 @@ def process_baseline(df, col, bmin, bmax, sob, eob):
         "v_max": bmax,
         "z_score": std_baselines
     })
-    
-    Z_final.append(std_baselines_df)
-    Z_final = pd.concat(Z_final, ignore_index=True)
-    return Z_final
 
-def process_columns_baseline(df):
-    Z_final = []
-    ml = 9
-    step = 10000
-
-    def process_single_column(col):
-        # computing upper and lower baseline value range
-        bmin, bmax = compute_value_range(df[col])
-        if bmin == 0 and bmax == 0:
-            mean = df[col].mean()
-            std = df[col].std()
-            bmin = 0 if (mean - std) < 0 else mean - std
-            bmax = mean + std
-
-        df_col = df.pivot(index="nodeId", columns="timestamp", values=col) \
-                    .apply(pd.to_numeric, errors='coerce') \
-                    .ffill(axis='rows') \
-                    .bfill(axis='rows')
-        
-        # computing start and end of baseline and filter
-        sob, eob = find_time_range(df_col, bmin, bmax)
-            
-        df_col.columns = pd.to_datetime(df_col.columns)
+# Running mrdmd on a single column with configured baseline (time and value range)
+def process_baseline(df, col, bmin, bmax, sob, eob, tensor=None, version=None):
+    """
+    Baselines already in the registry for this (range, window, version, nodes) are reused without
+    running mrDMD; new ones are registered. Either way the result becomes the column's
+    baseline in ZSC_B_CACHE_NAME.
+    """
+    if sob is not None and eob is not None:
         sob = pd.to_datetime(sob)
         eob = pd.to_datetime(eob)
-        df_col = df_col.loc[:, (df_col.columns >= sob) & (df_col.columns <= eob)]
-
-        # extracting input, output matrices
-        D = df_col.iloc[:,:].to_numpy()
-
-        # run mrDMD
-        mrDMDZSC = mrdmd_zscore.MrDMDZscore()
-        nodes1 = mrDMDZSC.mrdmd(D, max_levels=ml, max_cycles=1, do_parallel=False)
-
-        data = D.copy()
-        data1 = data
-        max_levels=ml
-        splt = mrDMDZSC.get_splt(step, max_levels)
-        nodes = nodes1
-        baselines = []
-        baseline_indx = []
-        for i in range(data.shape[0]):
-            t = data[i, :]
-            if (min(t) >= bmin and max(t) <= bmax):
-                baselines.append(t)
-                baseline_indx.append(i)
-        
-        n_baseline_indx = [nb for nb in range(data.shape[0]) if nb not in baseline_indx]
-
-        # compute z-score
-        split_point = (data.shape[0] + 1) // 2
-        baseline_indx = np.arange(0, split_point)
-        n_baseline_indx = np.arange(split_point, data.shape[0])
-        std_baselines = mrDMDZSC.compute_zscore(data1, \
-                                                splt, \
-                                                nodes, \
-                                                baseline_indx, \
-                                                n_baseline_indx, \
-                                                for_baseline=True, \
-                                                plot=False)
+    if tensor is None:
+        tensor = MetricTensor.from_frame(df, metrics=[col])
+    key = baseline_key(col, bmin, bmax, sob, eob, version, node_digest(tensor))
+    entry = get_baseline_registry().get(key) if version is not None else None
+
+    if entry is not None:
+        print(f'Reusing saved baseline {key[:12]} for {col}')
+        std_baselines = [] if entry["z_score"] is None else [entry["z_score"]]
+    else:
+        M = tensor.metric(col, fill='ffill')
+        time_mask = np.ones(M.shape[1], dtype=bool)
+        if sob is not None and eob is not None:
+            time_mask = tensor.time_mask(sob, eob)
+        std_baselines = baseline_std(M, time_mask, mrdmd_config())
+        if version is not None:
+            register_baseline(key, col, bmin, bmax, sob, eob, version, len(tensor.node_ids), std_baselines,
+                              source="user")
+
+    Z_b = baseline_frame(col, bmin, bmax, sob, eob, std_baselines)
+    save_active_baselines(Z_b)
+    return Z_b
+
+def process_columns_baseline(df, tensor=None, version=None):
+    if tensor is None:
+        tensor = MetricTensor.from_frame(df)
+    cols = [c for c in df.columns if c not in ['nodeId', 'timestamp']]
+    registry = get_baseline_registry() if version is not None else None
+    nodes = node_digest(tensor)
+
+    # baseline value ranges and the longest window inside them, all metrics at once
+    candidates = get_baseline_candidates(tensor, cols, version) if cols else {}
+    tasks, ranges = [], []
+    for m, col in enumerate(cols):
+        bmin, bmax = candidates[col]["v_min"], candidates[col]["v_max"]
+        windows = candidates[col]["windows"]
+        if windows:
+            sob, eob = windows[0]["b_start"], windows[0]["b_end"]
+        else:
+            print("No valid period found within the baseline range.")
+            sob, eob = pd.to_datetime(tensor.timestamps).min(), pd.to_datetime(tensor.timestamps).max()
+        key = baseline_key(col, bmin, bmax, sob, eob, version, nodes)
+        entry = registry.get(key) if registry is not None else None
+        if entry is None:
+            tasks.append((m, tensor.time_mask(sob, eob), mrdmd_config()))
+        ranges.append((col, sob, eob, bmin, bmax, key, entry))
 
+    Z_final = []
+    computed = iter(run_metric_tasks("baseline", metric_stack(tensor, cols), tasks) if tasks else [])
+    for col, sob, eob, bmin, bmax, key, entry in ranges:
+        if entry is not None:
+            std_baselines = [entry["z_score"]]
+        else:
+            std_baselines = next(computed)
+            if std_baselines is None:
+                continue
+            if registry is not None:
+                register_baseline(key, col, bmin, bmax, sob, eob, version, len(tensor.node_ids), std_baselines,
+                                  source="auto")
         if (len(std_baselines) == 0): std_baselines = [None]
-        std_baselines_df = pd.DataFrame({
-            "feature": col,
-            "b_start": sob,
-            "b_end": eob,
-            "v_min": bmin,
-            "v_max": bmax,
-            "z_score": std_baselines
-        })
-        Z_final.append(std_baselines_df)
-
-    cols_df = df.drop(columns=['nodeId', 'timestamp'])
-    with ThreadPoolExecutor(max_workers=15) as executor:
-        executor.map(process_single_column, cols_df.columns)
-    
+        Z_final.append(baseline_frame(col, bmin, bmax, sob, eob, std_baselines))
+
     Z_final = pd.concat(Z_final, ignore_index=True) if Z_final else pd.DataFrame(columns=["feature", "b_start", "b_end", "v_min", "v_max", "z_score"])
     return Z_final
 
+def list_baselines(feature=None, version=None):
+    """Saved baselines (newest use first), optionally of one feature and/or dataset version"""
+    return get_baseline_registry().entries(feature=feature, version=version)
+
+def use_baseline(key):
+    """Makes a saved baseline its feature's baseline in ZSC_B_CACHE_NAME; None if unknown"""
+    entry = get_baseline_registry().get(key)
+    if entry is None:
+        return None
+    sob = None if entry["b_start"] is None else pd.to_datetime(entry["b_start"])
+    eob = None if entry["b_end"] is None else pd.to_datetime(entry["b_end"])
+    Z_b = baseline_frame(entry["feature"], entry["v_min"], entry["v_max"], sob, eob, [entry["z_score"]])
+    save_active_baselines(Z_b)
+    return Z_b
+
+def evict_baseline(key):
+    """Drops a saved baseline; the active baseline of its feature is kept"""
+    return get_baseline_registry().evict(key)
+
+def compute_zscores(df, baselines, tensor=None):
+    if tensor is None:
+        tensor = MetricTensor.from_frame(df)
+    if (len(baselines.columns) == 0):
+        return pd.DataFrame(columns=['nodeId'])
+    cols = [c for c in df.columns if c not in ['nodeId', 'timestamp']]
 
-def extract_baselines(df, nbase_df, baselines, col):
-    if (baselines[baselines['feature'] == col].empty or (baselines[baselines['feature'] == col].z_score.values[0] is None)):
-        print(f"[WARNING] No baseline found for column: {col}")
-        return None 
-    
-    # extracting baseline, duplicating across time series
-    b_start = pd.to_datetime(baselines.loc[baselines['feature'] == col, 'b_start'].values[0])
-    b_end = pd.to_datetime(baselines.loc[baselines['feature'] == col, 'b_end'].values[0])
-    b_diff = b_end - b_start
-
-    t_start = pd.to_datetime(nbase_df.columns[0])
-    t_end = pd.to_datetime(nbase_df.columns[-1])
-    t_diff = t_end - t_start
-
-    base_df = df[(pd.to_datetime(df['timestamp']) >= b_start) \
-               & (pd.to_datetime(df['timestamp']) <= b_end)] \
-                .pivot(index="nodeId", columns="timestamp", values=col) \
-                .apply(pd.to_numeric, errors='coerce') \
-                .ffill(axis='rows') \
-                .bfill(axis='rows')
-
-    base_ext = []
-    for _ in range((len(nbase_df.columns) // base_df.shape[1]) + 2):
-        base_ext.append(base_df)
-
-    base_ext = pd.concat(base_ext,  axis=1)
-    base_ext = base_ext.iloc[:, :len(nbase_df.columns)]
-    base_ext.columns = nbase_df.columns
-
-    D = nbase_df.to_numpy()
-    return base_ext
-
-
-def compute_zscores(df, baselines):
-    Z_final = []
-    ml = 9
-    step = 10000
-    
-    def process_single_feature(col):
-        # non-baselines
-        nbase_df = preprocess(df, col)
-        nodelist = nbase_df.index.tolist()
-
-        if (len(baselines.columns) == 0):
-             return pd.DataFrame()
-
-        base_ext = extract_baselines(df, nbase_df, baselines[baselines['feature']==col], col)
-
-        if (base_ext is None):
-            return pd.DataFrame()
-        
-        D = nbase_df.to_numpy()
-        D = np.vstack([D,base_ext])
-
-        mrDMDZSC = mrdmd_zscore.MrDMDZscore()
-        nodes1 = mrDMDZSC.mrdmd(D, max_levels=ml, max_cycles=1, do_parallel=False)
-
-        # z-score analysis
-        data = D.copy()
-        data1 = data[:,:step]
-        max_levels=ml
-        splt = mrDMDZSC.get_splt(step, max_levels)
-        nodes = nodes1
-        n_baseline_indx = np.arange(0, data.shape[0] - base_ext.shape[0])
-        baseline_indx = np.arange(len(n_baseline_indx), data.shape[0])
-
+    tasks, used = [], []
+    for m, col in enumerate(cols):
+        mask = baseline_mask(tensor, baselines, col)
+        if mask is None:
+            continue
         std_baselines = baselines[baselines['feature'] == col].z_score.values[0]
-        zsc = mrDMDZSC.compute_zscore(data1, \
-                                    splt, \
-                                    nodes1, \
-                                    baseline_indx, \
-                                    n_baseline_indx, \
-                                    std_baselines, \
-                                    for_baseline=False, \
-                                    plot=False)
-        
-        values = zsc[0][:len(nodelist)]
-        Z_df = pd.DataFrame({"nodeId": nodelist, col: values})
-        return Z_df
+        tasks.append((m, mask, std_baselines, mrdmd_config()))
+        used.append(col)
 
-    cols_df = df.drop(columns=['nodeId', 'timestamp'])
     results = []
-    with ThreadPoolExecutor(max_workers=15) as executor:
-        futures = [executor.submit(process_single_feature, col) for col in cols_df.columns]
-        for future in futures:
-            res = future.result()
-            if res is not None:
-                results.append(res)
+    if tasks:
+        nodelist = tensor.node_ids
+        zscores = run_metric_tasks("zscores", metric_stack(tensor, cols), tasks)
+        results = [pd.DataFrame({"nodeId": nodelist, col: values}) for col, values in zip(used, zscores) if values is not None]
 
     if not results:
         print("Warning: No valid z-score results to concatenate.")
@@ -311,7 +250,262 @@ def compute_zscores(df, baselines):
         Z_final = Z_final.loc[:, ~Z_final.columns.duplicated()]
     return Z_final
 
-def get_cached_or_compute_baselines(df, force_recompute):
+_mode_trees = OrderedDict()
+
+def _tree_key(baselines, col, version):
+    base = baselines[baselines['feature'] == col]
+    return (version, col, str(base['b_start'].values[0]), str(base['b_end'].values[0]))
+
+def _tree_path(key):
+    return os.path.join(MODE_TREE_DIR, f"{hashlib.sha1(repr(key).encode()).hexdigest()}.npz")
+
+def _evict_trees():
+    # least recently used first: entries in memory past MODE_TREE_MAX_ENTRIES, files past MODE_TREE_MAX_BYTES
+    while len(_mode_trees) > MODE_TREE_MAX_ENTRIES:
+        _mode_trees.popitem(last=False)
+    if not os.path.isdir(MODE_TREE_DIR):
+        return
+    files = sorted((e for e in os.scandir(MODE_TREE_DIR) if e.name.endswith('.npz')),
+                   key=lambda e: e.stat().st_mtime)
+    total = sum(e.stat().st_size for e in files)
+    for e in files:
+        if total <= MODE_TREE_MAX_BYTES:
+            break
+        total -= e.stat().st_size
+        os.remove(e.path)
+
+def build_mode_trees(full_df, baselines, cols, version):
+    """
+    ModeTree of each metric over every node stacked with the tiled baseline, cached per
+    (version, metric, baseline window) in memory and as .npz under MODE_TREE_DIR (least
+    recently used evicted); trees found on neither are built in one pool run.
+    """
+    cols = [c for c in cols if not baselines[baselines['feature'] == c].empty]
+    missing = [c for c in cols if _tree_key(baselines, c, version) not in _mode_trees]
+    for col in cols:
+        key = _tree_key(baselines, col, version)
+        if key in _mode_trees:
+            _mode_trees.move_to_end(key)
+            if os.path.exists(_tree_path(key)):
+                os.utime(_tree_path(key))
+    if not missing:
+        return
+    tensor = MetricTensor.from_frame(full_df[['timestamp', 'nodeId'] + missing], metrics=missing)
+    trees, tasks = {}, []
+    for m, col in enumerate(missing):
+        path = _tree_path(_tree_key(baselines, col, version))
+        mask = baseline_mask(tensor, baselines, col)
+        if mask is None:
+            trees[col] = None
+        elif os.path.exists(path):
+            trees[col] = mrdmd_zscore.ModeTree.load(path)
+            os.utime(path)
+        else:
+            tasks.append((m, mask, mrdmd_config()))
+    if tasks:
+        os.makedirs(MODE_TREE_DIR, exist_ok=True)
+        for (m, _, _), tree in zip(tasks, run_metric_tasks("tree", metric_stack(tensor, missing), tasks)):
+            trees[missing[m]] = tree
+            if tree is not None:
+                tree.save(_tree_path(_tree_key(baselines, missing[m], version)))
+
+    node_ids = list(tensor.node_ids)
+    node_index = {n: i for i, n in enumerate(node_ids)}
+    for col, tree in trees.items():
+        _mode_trees[_tree_key(baselines, col, version)] = {
+            "node_ids": node_ids,
+            "node_index": node_index,
+            "n_nodes": len(node_ids),
+            "timestamps": tensor.timestamps,
+            "tree": tree,
+            "row_power": None if tree is None else tree_row_power(tree, len(tensor.timestamps))
+        }
+    _evict_trees()
+
+def _tree_rows(entry, node_ids):
+    return np.sort([entry["node_index"][n] for n in node_ids if n in entry["node_index"]]).astype(np.int64)
+
+def _slice_zscores(entry, col, node_ids, baselines):
+    """z-scores of the selected nodes from an all-node row power (nodes, then their baseline rows)"""
+    rows = _tree_rows(entry, node_ids)
+    power = entry["row_power"]
+    baseline_mean = np.mean(power[entry["n_nodes"] + rows])
+    std_baselines = baselines[baselines['feature'] == col].z_score.values[0]
+    nodelist = [entry["node_ids"][i] for i in rows]
+    return pd.DataFrame({"nodeId": nodelist, col: (power[rows] - baseline_mean) / std_baselines})
+
+def _concat_zscores(results):
+    if not results:
+        print("Warning: No valid z-score results to concatenate.")
+        return pd.DataFrame(columns=['nodeId'])
+
+    Z_final = pd.concat(results, axis=1)
+    return Z_final.loc[:, ~Z_final.columns.duplicated()]
+
+def compute_zscores_tree(full_df, baselines, node_ids, version):
+    """
+    compute_zscores for a node selection answered from the all-node mode trees: the
+    selected nodes and their baseline rows are picked out of the cached decomposition.
+    """
+    if len(baselines.columns) == 0:
+        return pd.DataFrame(columns=['nodeId'])
+    cols = [c for c in full_df.columns if c not in ['nodeId', 'timestamp']]
+    build_mode_trees(full_df, baselines, cols, version)
+    results = []
+    for col in cols:
+        if baselines[baselines['feature'] == col].empty:
+            continue
+        entry = _mode_trees.get(_tree_key(baselines, col, version))
+        if entry is None or entry["row_power"] is None:
+            continue
+        results.append(_slice_zscores(entry, col, node_ids, baselines))
+    return _concat_zscores(results)
+
+def _levels_result(node_ids, timestamps, segments, Z):
+    times = pd.to_datetime(timestamps)
+    return {
+        "nodes": list(node_ids),
+        "levels": segments[:, 0],
+        "b_start": times[segments[:, 1]],
+        "b_end": times[segments[:, 2] - 1],
+        "zscores": Z
+    }
+
+def compute_zscore_levels(df, baselines, tensor=None, max_levels=None):
+    """
+    Node x time x level z-scores of the nodes in df: every dyadic segment of the timeline
+    at every mrDMD level, on the same per-selection tree compute_zscores decomposes, so the
+    level-0 segment is its z-score.
+    Returns {col: {"nodes", "levels", "b_start", "b_end", "zscores" (nodes x segments)}}.
+    """
+    if tensor is None:
+        tensor = MetricTensor.from_frame(df)
+    if len(baselines.columns) == 0:
+        return {}
+    cols = [c for c in df.columns if c not in ['nodeId', 'timestamp']]
+
+    tasks, used = [], []
+    for m, col in enumerate(cols):
+        mask = baseline_mask(tensor, baselines, col)
+        if mask is None:
+            continue
+        std_baselines = baselines[baselines['feature'] == col].z_score.values[0]
+        tasks.append((m, mask, std_baselines, mrdmd_config(), max_levels))
+        used.append(col)
+
+    results = {}
+    if tasks:
+        for col, res in zip(used, run_metric_tasks("levels", metric_stack(tensor, cols), tasks)):
+            if res is not None:
+                results[col] = _levels_result(tensor.node_ids, tensor.timestamps, *res)
+    return results
+
+def compute_zscore_levels_tree(full_df, baselines, node_ids, version, max_levels=None):
+    """compute_zscore_levels for a node selection from the all-node mode trees (as compute_zscores_tree)"""
+    if len(baselines.columns) == 0:
+        return {}
+    cols = [c for c in full_df.columns if c not in ['nodeId', 'timestamp']]
+    build_mode_trees(full_df, baselines, cols, version)
+    results = {}
+    for col in cols:
+        if baselines[baselines['feature'] == col].empty:
+            continue
+        entry = _mode_trees.get(_tree_key(baselines, col, version))
+        if entry is None or entry["tree"] is None:
+            continue
+        rows = _tree_rows(entry, node_ids)
+        std_baselines = baselines[baselines['feature'] == col].z_score.values[0]
+        segments, Z = tree_level_zscores(entry["tree"], entry["n_nodes"], rows, std_baselines,
+                                         len(entry["timestamps"]), max_levels)
+        results[col] = _levels_result([entry["node_ids"][i] for i in rows], entry["timestamps"], segments, Z)
+    return results
+
+_online = {}    # (metric, baseline window) -> online all-node tree state
+_online_lock = threading.Lock()
+
+def _online_stale(state, tensor, last, version, stream):
+    """True when samples the model has already seen (up to position last) may have changed"""
+    if stream is None:
+        return state["version"] != version
+    # an upsert since the last update rewrote or backfilled a timestamp at or before the last one fed
+    first = stream.earliest_write(state["revision"])
+    return first is not None and first <= tensor.epochs[last]
+
+def update_online_trees(full_df, baselines, cols, version=None, stream=None):
+    """
+    Feeds the samples after the last one seen to each metric's OnlineMrDMD (all nodes
+    stacked with their tiled baseline). A state is rebuilt from the whole history when
+    it is new, its node set changed, its last timestamp is no longer in the data or
+    anything at or before it changed: with a StreamBuffer (stream) any upsert writing
+    there, otherwise any change of dataset version.
+    """
+    cols = [c for c in cols if not baselines[baselines['feature'] == c].empty]
+    if not cols:
+        return
+    tensor = MetricTensor.from_frame(full_df[['timestamp', 'nodeId'] + cols], metrics=cols)
+    node_ids = list(tensor.node_ids)
+    for col in cols:
+        key = _tree_key(baselines, col, None)[1:]
+        mask = baseline_mask(tensor, baselines, col)
+        if mask is None or not mask.any():
+            _online.pop(key, None)
+            continue
+        M = tensor.metric(col, fill='ffill')
+        state = _online.get(key)
+        last = None if state is None else tensor.time_index.get(state["last_ts"])
+        if (state is None or last is None or state["node_ids"] != node_ids
+                or _online_stale(state, tensor, last, version, stream)):
+            state = {
+                "node_ids": node_ids,
+                "node_index": {n: i for i, n in enumerate(node_ids)},
+                "n_nodes": len(node_ids),
+                "base": M[:, mask],
+                "model": OnlineMrDMD(max_levels=ml, max_cycles=1, window=MRDMD_ONLINE_WINDOW, svd_backend=SVD_BACKEND)
+            }
+            _online[key] = state
+            last = -1
+        state["version"] = version
+        state["revision"] = None if stream is None else stream.revision
+        new = M[:, last + 1:]
+        if new.shape[1] == 0:
+            continue
+
+        # the tiled baseline continues from the samples the model has seen
+        model = state["model"]
+        phase = (model.n_samples + np.arange(new.shape[1])) % state["base"].shape[1]
+        up_start = timer()
+        recomputed = model.append(np.vstack([new, state["base"][:, phase]]))
+        print(f'online mrDMD {col}: {new.shape[1]} samples, {recomputed} bins in {timer() - up_start}s')
+        state["last_ts"] = tensor.timestamps[-1]
+        state["row_power"] = tree_row_power(model.tree(), model.n_samples,
+                                            t_start=max(0, model.n_samples - MRDMD_ONLINE_WINDOW))
+
+def compute_zscores_online(full_df, baselines, node_ids, version=None, stream=None):
+    """
+    compute_zscores for a node selection from the online trees, over the latest window.
+    Approximate: bins left of the new samples keep their modes (see scripts/online_mrdmd.py).
+    """
+    if len(baselines.columns) == 0:
+        return pd.DataFrame(columns=['nodeId'])
+    cols = [c for c in full_df.columns if c not in ['nodeId', 'timestamp']]
+    results = []
+    with _online_lock:
+        update_online_trees(full_df, baselines, cols, version, stream)
+        for col in cols:
+            if baselines[baselines['feature'] == col].empty:
+                continue
+            state = _online.get(_tree_key(baselines, col, None)[1:])
+            if state is None or state.get("row_power") is None:
+                continue
+            results.append(_slice_zscores(state, col, node_ids, baselines))
+    return _concat_zscores(results)
+
+def online_stats():
+    with _online_lock:
+        return {f"{key[0]}": {"samples": s["model"].n_samples, "bins": len(s["model"].nodes),
+                              "last_recomputed": s["model"].recomputed} for key, s in _online.items()}
+
+def get_cached_or_compute_baselines(df, force_recompute, tensor=None, version=None):
     if os.path.exists(ZSC_B_CACHE_NAME) and force_recompute == 0:
         print('Reading cached baseline z-scores from parquet')
         ZSC_d = pd.read_parquet(ZSC_B_CACHE_NAME)
@@ -331,7 +525,7 @@ def get_cached_or_compute_baselines(df, force_recompute):
         # print(f'Computing baselines for missing features: {missing_features}')
         missing_df = df[['nodeId', 'timestamp'] + list(missing_features)]
         bs_start = timer()
-        new_baselines = process_columns_baseline(missing_df)
+        new_baselines = process_columns_baseline(missing_df, tensor=tensor, version=version)
         bs_end = timer()
         print(f'baseline in {(bs_end - bs_start)}s')
 
@@ -345,18 +539,32 @@ def get_cached_or_compute_baselines(df, force_recompute):
 
         # Save updated baselines
         os.makedirs(CACHE_DIR, exist_ok=True)
-        ZSC_d.to_parquet(ZSC_B_CACHE_NAME)
+        with _zsc_b_lock:
+            ZSC_d.to_parquet(ZSC_B_CACHE_NAME)
         print(f'Updated cached baseline results to parquet {ZSC_B_CACHE_NAME} (missing features).')
 
     return ZSC_d
 
-def get_mrdmd(df, force_recompute):
+def selection_zscores(df, Z_b, tensor, full_df, version, online=False, stream=None):
+    """z-scores of the nodes in df: sliced from the all-node mode trees when possible"""
+    if online and full_df is not None:
+        return compute_zscores_online(full_df, Z_b, df['nodeId'].unique(), version, stream)
+    if MRDMD_TREE_MODE and full_df is not None and version is not None:
+        return compute_zscores_tree(full_df, Z_b, df['nodeId'].unique(), version)
+    return compute_zscores(df, Z_b, tensor=tensor)
+
+def get_mrdmd(df, force_recompute, tensor=None, full_df=None, version=None, online=False, stream=None):
+    """online: z-scores from the online all-node trees fed by stream (StreamBuffer), approximate"""
+    # pivot once; baselines and z-scores slice the same tensor
+    if tensor is None:
+        tensor = MetricTensor.from_frame(df)
+
     # Step 1: Compute z-scores for baselines or get them from cache
-    Z_b = get_cached_or_compute_baselines(df, force_recompute)
+    Z_b = get_cached_or_compute_baselines(df, force_recompute, tensor=tensor, version=version)
 
     # Step 2: Compute z-scores for the node selection compared to baseline z-scores
     mr_dmdstart = timer()
-    zsc_d = compute_zscores(df, Z_b)
+    zsc_d = selection_zscores(df, Z_b, tensor, full_df, version, online=online, stream=stream)
     mr_dmdend = timer()
 
     print(f'mrDMD in {(mr_dmdend - mr_dmdstart)}s')
@@ -364,15 +572,36 @@ def get_mrdmd(df, force_recompute):
     Z_b = Z_b.replace({np.nan: None, np.inf: None, -np.inf: None})
     return zsc_d, Z_b
 
-def get_mrdmd_with_new_base(df, col, bmin, bmax, sob, eob):
+def get_mrdmd_levels(df, tensor=None, full_df=None, version=None, max_levels=None):
+    """
+    Baselines as get_mrdmd, then level z-scores for the nodes in df from the tree get_mrdmd
+    would decompose (the all-node trees in MRDMD_TREE_MODE, else the selection's own)
+    """
+    if tensor is None:
+        tensor = MetricTensor.from_frame(df)
+    Z_b = get_cached_or_compute_baselines(df, 0, tensor=tensor, version=version)
+
+    mr_dmdstart = timer()
+    if MRDMD_TREE_MODE and full_df is not None and version is not None:
+        levels = compute_zscore_levels_tree(full_df, Z_b, df['nodeId'].unique(), version, max_levels)
+    else:
+        levels = compute_zscore_levels(df, Z_b, tensor=tensor, max_levels=max_levels)
+    mr_dmdend = timer()
+    print(f'mrDMD levels in {(mr_dmdend - mr_dmdstart)}s')
+    return levels
+
+def get_mrdmd_with_new_base(df, col, bmin, bmax, sob, eob, tensor=None, full_df=None, version=None):
+    if tensor is None:
+        tensor = MetricTensor.from_frame(df)
+
     # Step 1: compute z-score for given baseline 
     bs_start = timer()
-    Z_b = process_baseline(df, col, bmin, bmax, sob, eob)
+    Z_b = process_baseline(df, col, bmin, bmax, sob, eob, tensor=tensor, version=version)
     bs_end = timer()
 
     # Step 2: Compute z-scores for the node selection compared to new baseline z-score
     mr_dmdstart = timer()
-    zsc_d = compute_zscores(df, Z_b)
+    zsc_d = selection_zscores(df, Z_b, tensor, full_df, version)
     mr_dmdend = timer()
 
     print(f'baseline in {(bs_end - bs_start)}s')
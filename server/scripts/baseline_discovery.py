@@ -0,0 +1,133 @@
+"""Baseline discovery: value ranges per metric and the windows where every node stays inside them"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from scripts.tensor import node_digest
+
+TOP_N = 5           # candidate windows kept per metric
+IQR_K = 1.5
+RANGE_EXT = 0.1
+
+QUANTILE_SAMPLE = 4096  # strided sample that brackets each quartile before the exact selection
+
+def quartiles(x):
+    """
+    Exact 25th/75th percentiles (linear interpolation, as np.percentile) of a 1-d array,
+    NaNs ignored. On long inputs each quartile is first bracketed from a strided
+    sample, so the exact selection only partitions the values inside the bracket.
+    """
+    if np.isnan(x).any():
+        x = x[~np.isnan(x)]
+    n = len(x)
+    if n == 0:
+        return np.nan, np.nan
+    pos = np.array([0.25, 0.75]) * (n - 1)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, n - 1)
+    vlo, vhi = np.empty(2), np.empty(2)
+    sample = np.sort(x[::n // QUANTILE_SAMPLE]) if n > 4 * QUANTILE_SAMPLE else None
+    for q in range(2):
+        ranks = [lo[q], hi[q]]
+        if sample is not None:
+            m = len(sample)
+            margin = int(3 * np.sqrt(m)) + 1
+            a = sample[max(lo[q] * m // n - margin, 0)]
+            b = sample[min(lo[q] * m // n + margin, m - 1)]
+            above = x >= a
+            below = n - np.count_nonzero(above)
+            cand = x[above & (x <= b)]
+            k = [r - below for r in ranks]
+            if min(k) >= 0 and max(k) < len(cand):
+                vlo[q], vhi[q] = np.partition(cand, np.unique(k))[k]
+                continue
+        vlo[q], vhi[q] = np.partition(x, np.unique(ranks))[ranks]
+    q1, q3 = vlo + (vhi - vlo) * (pos - lo)
+    return q1, q3
+
+def value_range(X, k=IQR_K, ext=RANGE_EXT):
+    """
+    compute_value_range on one metric matrix (nodes x time), missing cells ignored.
+    A range that collapses to (0, 0) falls back to mean +/- std, as
+    process_columns_baseline did.
+    """
+    flat = X.ravel()
+    q1, q3 = quartiles(flat)
+    iqr = q3 - q1
+    lower_bound = max(0, q1 - k * iqr)
+    upper_bound = q3 + k * iqr
+    lower = round(lower_bound - lower_bound * ext, 2)
+    upper = round(upper_bound + upper_bound * ext, 2)
+    if lower == 0 and upper == 0:
+        mean = np.nanmean(flat)
+        std = np.nanstd(flat, ddof=1)
+        lower, upper = max(mean - std, 0), mean + std
+    return float(lower), float(upper)
+
+def longest_runs(inside, top_n=TOP_N):
+    """
+    Run-length encoding of a (metrics, time) boolean mask: per metric the top_n runs of
+    True as (start, end, length) with end inclusive, longest first and earlier first
+    on ties (find_time_range keeps the first of equally long periods).
+    """
+    M, T = inside.shape
+    padded = np.zeros((M, T + 2), dtype=np.int8)
+    padded[:, 1:-1] = inside
+    edges = np.diff(padded, axis=1)
+    run_m, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)       # row-major order pairs every start with its end
+    lengths = ends - starts
+
+    order = np.lexsort((starts, -lengths, run_m))
+    run_m, starts, lengths = run_m[order], starts[order], lengths[order]
+    rank = np.arange(len(run_m)) - np.searchsorted(run_m, run_m)
+    keep = rank < top_n
+
+    runs = [[] for _ in range(M)]
+    for m, s, n in zip(run_m[keep], starts[keep], lengths[keep]):
+        runs[m].append((int(s), int(s + n - 1), int(n)))
+    return runs
+
+def discover(tensor, cols, top_n=TOP_N):
+    """
+    Value range and candidate baseline windows of every metric in cols: per metric one
+    boolean (nodes x time) comparison reduced over nodes, then all metrics' masks
+    run-length encoded together. Metrics are handled one at a time so each matrix
+    stays in cache instead of stacking every metric up front.
+    """
+    ranges = []
+    inside = np.empty((len(cols), len(tensor.timestamps)), dtype=bool)
+    for m, col in enumerate(cols):
+        lower, upper = value_range(tensor.metric(col))
+        X = tensor.metric(col, fill='ffill')
+        inside[m] = ((X >= lower) & (X <= upper)).all(axis=0)
+        ranges.append((lower, upper))
+    times = pd.to_datetime(tensor.timestamps)
+
+    results = {}
+    for (lower, upper), col, runs in zip(ranges, cols, longest_runs(inside, top_n)):
+        windows = [{"b_start": times[s], "b_end": times[e], "length": n} for s, e, n in runs]
+        results[col] = {"v_min": lower, "v_max": upper, "windows": windows}
+    return results
+
+_cache = {}     # (version, node set, top_n, metric) -> discover() result
+_cache_lock = threading.Lock()
+
+def get_baseline_candidates(tensor, cols, version, top_n=TOP_N):
+    """discover() cached per (metric, dataset version) for the tensor's node set"""
+    if version is None:
+        return discover(tensor, cols, top_n)
+    nodes = node_digest(tensor)
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] != version]:
+            del _cache[key]
+        results = {col: _cache[(version, nodes, top_n, col)] for col in cols if (version, nodes, top_n, col) in _cache}
+    missing = [col for col in cols if col not in results]
+    if missing:
+        found = discover(tensor, missing, top_n)
+        with _cache_lock:
+            for col, result in found.items():
+                _cache[(version, nodes, top_n, col)] = result
+        results.update(found)
+    return {col: results[col] for col in cols}
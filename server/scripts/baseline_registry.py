@@ -0,0 +1,44 @@
+"""Saved mrDMD baselines: std z-score per (feature, range, window, version, node set)"""
+import hashlib
+import json
+
+import pandas as pd
+
+from scripts.lru_store import LRUStore
+
+CACHE_DIR = './scripts/cache/baselines/'
+MAX_ENTRIES = 4096
+
+def baseline_key(feature, v_min, v_max, b_start, b_end, version, nodes):
+    """
+    Hash of everything a baseline depends on; window bounds compared as timestamps,
+    nodes is the node_digest of the tensor the baseline is computed on
+    """
+    window = [None if t is None else str(pd.to_datetime(t)) for t in (b_start, b_end)]
+    spec = [feature, round(float(v_min), 6), round(float(v_max), 6), *window, version, nodes]
+    return hashlib.sha1(json.dumps(spec, default=str).encode()).hexdigest()
+
+class BaselineRegistry(LRUStore):
+    """
+    Each entry keeps the baseline std z-score and its metadata in index.json (no payload
+    file). Entries are listed, reused and evicted by key; past max_entries the least
+    recently used go first (see scripts/lru_store.py).
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+        super().__init__(cache_dir, max_entries=max_entries)
+
+    def get(self, key):
+        """Entry metadata (z_score, feature, range, window, version), None if unknown"""
+        return self.touch(key)
+
+    def put(self, key, z_score, **meta):
+        self.add(key, z_score=z_score, **meta)
+
+_registry = None
+
+def get_baseline_registry():
+    global _registry
+    if _registry is None:
+        _registry = BaselineRegistry()
+    return _registry
@@ -0,0 +1,93 @@
+"""PCA over row blocks (randomized SVD or incremental PCA) for matrices with many nodes"""
+import numpy as np
+from sklearn.decomposition import IncrementalPCA
+from sklearn.utils.extmath import svd_flip
+
+BLOCK_ROWS = 4096
+OVERSAMPLES = 10
+POWER_ITERS = 4
+
+def _blocks(n, block_rows):
+    for start in range(0, n, block_rows):
+        yield slice(start, min(start + block_rows, n))
+
+def column_stats(X, block_rows=BLOCK_ROWS):
+    """Column means and standard deviations in one pass over row blocks (Chan merge)"""
+    n, f = X.shape
+    count, mean, m2 = 0, np.zeros(f), np.zeros(f)
+    for rows in _blocks(n, block_rows):
+        B = np.asarray(X[rows], dtype=np.float64)
+        b_mean = B.mean(axis=0)
+        b_m2 = ((B - b_mean) ** 2).sum(axis=0)
+        total = count + len(B)
+        delta = b_mean - mean
+        mean = mean + delta * len(B) / total
+        m2 = m2 + b_m2 + delta ** 2 * count * len(B) / total
+        count = total
+    return mean, np.sqrt(m2 / max(count, 1))
+
+class _Scaled():
+    """(X - mean) / scale applied one row block at a time, never for the whole matrix"""
+
+    def __init__(self, X, mean, scale, block_rows):
+        self.X, self.mean, self.scale, self.block_rows = X, mean, scale, block_rows
+        self.shape = X.shape
+
+    def block(self, rows):
+        return (np.asarray(self.X[rows], dtype=np.float64) - self.mean) / self.scale
+
+    def matmul(self, W):
+        """A @ W, (n x k)"""
+        out = np.empty((self.shape[0], W.shape[1]))
+        for rows in _blocks(self.shape[0], self.block_rows):
+            out[rows] = self.block(rows) @ W
+        return out
+
+    def rmatmul(self, Y):
+        """A.T @ Y, (f x k)"""
+        out = np.zeros((self.shape[1], Y.shape[1]))
+        for rows in _blocks(self.shape[0], self.block_rows):
+            out += self.block(rows).T @ Y[rows]
+        return out
+
+def blockwise_pca(X, n_components=2, standardize=False, method="randomized", block_rows=BLOCK_ROWS,
+                  oversamples=OVERSAMPLES, n_iter=POWER_ITERS, random_state=42):
+    """
+    PCA scores of X (rows = nodes) without centered/scaled copies of the whole matrix.
+    standardize additionally divides columns by their standard deviation (StandardScaler).
+      'randomized'  -> randomized SVD (Halko et al.) with power iterations, A applied blockwise
+      'incremental' -> sklearn IncrementalPCA fed one scaled row block at a time
+    Returns (scores, explained_variance_ratio); signs follow sklearn's PCA.
+    """
+    n, f = X.shape
+    mean, std = column_stats(X, block_rows)
+    scale = np.where(std > 0, std, 1.0) if standardize else np.ones(f)
+    A = _Scaled(X, mean, scale, block_rows)
+    total_var = (((std / scale) ** 2).sum()) * n / max(n - 1, 1)
+
+    if method == "incremental":
+        ipca = IncrementalPCA(n_components=n_components)
+        for rows in _blocks(n, max(block_rows, n_components)):
+            B = A.block(rows)
+            if len(B) >= n_components:
+                ipca.partial_fit(B)
+        # partial_fit re-centers; A is already centered so the running mean is ~0
+        scores = A.matmul(ipca.components_.T)
+        return scores, ipca.explained_variance_ / total_var
+
+    if method != "randomized":
+        raise ValueError(f"Invalid blockwise PCA method: {method}")
+
+    k = min(n_components + oversamples, n, f)
+    rng = np.random.default_rng(random_state)
+    Q = A.matmul(rng.standard_normal((f, k)))
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(Q)
+        Q, _ = np.linalg.qr(A.matmul(A.rmatmul(Q)))
+    Q, _ = np.linalg.qr(Q)
+    Bt = A.rmatmul(Q)                      # (Q.T A).T, f x k
+    Ub, s, Vt = np.linalg.svd(Bt.T, full_matrices=False)
+    U, Vt = svd_flip(Q @ Ub, Vt, u_based_decision=False)
+    s, U = s[:n_components], U[:, :n_components]
+    explained_variance = s ** 2 / max(n - 1, 1)
+    return U * s, explained_variance / total_var
@@ -0,0 +1,22 @@
+"""Per-cluster ccPCA fit, kept in a small module so pool workers start without the DR stack"""
+import numpy as np
+from ccpca import CCPCA
+
+from scripts.shared_pool import shared_array
+
+def ccpca_label(X, target_rows):
+    """First cPC and scaled feature contributions of one cluster against the rest"""
+    target = np.zeros(len(X), dtype=bool)
+    target[target_rows] = True
+    ccpca = CCPCA(n_components=1)
+    ccpca.fit(
+        X[target],
+        X[~target],
+        var_thres_ratio=0.5,
+        n_alphas=40,
+        max_log_alpha=0.5)
+    return np.array(ccpca.get_first_component()), np.array(ccpca.get_scaled_feat_contribs())
+
+def ccpca_worker(target_rows):
+    # runs in a pool process; the feature matrix is shared, not pickled
+    return ccpca_label(shared_array('ccpca_X'), target_rows)
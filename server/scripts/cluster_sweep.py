@@ -0,0 +1,182 @@
+"""Background k-means sweep over a range of k for one DR2 embedding, run by a single worker thread"""
+import threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+
+K_MIN = 2
+K_MAX = 20
+SILHOUETTE_SAMPLE = 2000    # silhouette is O(n^2), larger embeddings are scored on a sample
+SWEEP_CACHE_SIZE = 4        # DR2 results whose sweeps are kept
+
+class ClusterSweep():
+    """
+    inertia/silhouette for every k in [k_min, k_max] on the E1/E2 embedding of a DR2
+    frame, computed by the sweep worker. k-means for k is warm-started from the
+    centers for k - 1 plus the point farthest from them (n_init=1), which is good
+    enough to compare k but not to serve: labels for the k that is actually requested
+    come from a full n_init fit (as id_clusters_w_kmeans), memoized per k. A result
+    seeded from the request that triggered the sweep is such a fit and is kept as is.
+    Feature contributions are computed on first use per k and memoized.
+    """
+
+    def __init__(self, dr2, contrib_func, k_min=K_MIN, k_max=K_MAX):
+        self.dr2 = dr2.drop(columns=[c for c in ['Cluster', 'nodeId'] if c in dr2.columns])
+        self.X = self.dr2[['E1', 'E2']].to_numpy(dtype=np.float64)
+        self.contrib_func = contrib_func
+        self.k_min = k_min
+        self.k_max = min(k_max, len(self.X) - 1)
+        self.results = {}           # k -> (labels, centers, inertia, silhouette), warm-started
+        self._served = {}           # k -> labels of a full n_init fit
+        self._contribs = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self.cancelled = False
+
+    def seed(self, k, labels, centers, inertia):
+        with self._lock:
+            self.results[k] = (np.asarray(labels), np.asarray(centers), float(inertia), self._silhouette(labels))
+            self._served[k] = self.results[k][0]
+
+    def _silhouette(self, labels):
+        if len(np.unique(labels)) < 2 or len(self.X) < 3:
+            return None
+        sample = min(SILHOUETTE_SAMPLE, len(self.X))
+        return float(silhouette_score(self.X, labels, sample_size=sample, random_state=42))
+
+    def _fit(self, k, prev_centers):
+        if prev_centers is None:
+            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+        else:
+            # next center: the point farthest from the current ones
+            d = ((self.X[:, None, :] - prev_centers[None]) ** 2).sum(axis=2).min(axis=1)
+            init = np.vstack([prev_centers, self.X[np.argmax(d)]])
+            kmeans = KMeans(n_clusters=k, init=init, n_init=1, random_state=42)
+        labels = kmeans.fit_predict(self.X)
+        return labels, kmeans.cluster_centers_, float(kmeans.inertia_), self._silhouette(labels)
+
+    def run(self):
+        start = timer()
+        prev = None
+        for k in range(self.k_min, self.k_max + 1):
+            if self.cancelled:
+                print(f'Cluster sweep superseded at k={k}')
+                return
+            with self._lock:
+                result = self.results.get(k)
+            if result is None:
+                result = self._fit(k, prev)
+                with self._lock:
+                    result = self.results.setdefault(k, result)
+            prev = result[1]
+        self._done.set()
+        print(f'Cluster sweep k={self.k_min}..{self.k_max} in {timer() - start}s')
+
+    def start(self):
+        _submit(self)
+        return self
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def labels(self, k):
+        """Labels for k from a full n_init fit, computed on first use"""
+        with self._lock:
+            labels = self._served.get(k)
+        if labels is None:
+            result = self._fit(k, None)
+            with self._lock:
+                self.results.setdefault(k, result)
+                labels = self._served.setdefault(k, result[0])
+        return labels
+
+    def frame(self, k):
+        """The DR2 frame with Cluster/nodeId columns as id_clusters_w_kmeans leaves it"""
+        df = self.dr2.copy()
+        df['Cluster'] = self.labels(k)
+        df['nodeId'] = df.index
+        return df
+
+    def contributions(self, k):
+        with self._lock:
+            contribs = self._contribs.get(k)
+        if contribs is None:
+            contribs = self.contrib_func(self.frame(k))
+            with self._lock:
+                contribs = self._contribs.setdefault(k, contribs)
+        return contribs
+
+    def scores(self):
+        """inertia / silhouette of every k computed so far"""
+        with self._lock:
+            return [{"k": k, "inertia": r[2], "silhouette": r[3]} for k, r in sorted(self.results.items())]
+
+_sweeps = OrderedDict()
+_sweeps_lock = threading.Lock()
+
+# one worker runs the most recently submitted sweep; a newer submission supersedes
+# (cancels) the running one and drops any still waiting, so streamed DR2 keys don't pile up
+_worker = None
+_worker_cond = threading.Condition()
+_pending = None
+_running = None
+
+def _work():
+    global _pending, _running
+    while True:
+        with _worker_cond:
+            while _pending is None:
+                _worker_cond.wait()
+            sweep, _pending = _pending, None
+            _running = sweep
+        try:
+            sweep.run()
+        except Exception as e:
+            print(f'Cluster sweep failed: {e}')
+        with _worker_cond:
+            _running = None
+
+def _submit(sweep):
+    global _worker, _pending
+    with _worker_cond:
+        for other in (_pending, _running):
+            if other is not None and other is not sweep:
+                other.cancelled = True
+        sweep.cancelled = False
+        _pending = sweep
+        if _worker is None:
+            _worker = threading.Thread(target=_work, daemon=True)
+            _worker.start()
+        _worker_cond.notify()
+
+def get_sweep(key):
+    """The sweep for key; a superseded, unfinished one is resubmitted and resumes where it stopped"""
+    with _sweeps_lock:
+        sweep = _sweeps.get(key)
+        if sweep is None:
+            return None
+        _sweeps.move_to_end(key)
+    if sweep.cancelled and not sweep.done:
+        _submit(sweep)
+    return sweep
+
+def start_sweep(key, dr2, contrib_func, seed=None):
+    """
+    Registers and starts a sweep for the DR2 result identified by key. seed is an
+    optional (k, labels, centers, inertia) already computed for this embedding.
+    """
+    sweep = ClusterSweep(dr2, contrib_func)
+    if seed is not None:
+        sweep.seed(*seed)
+    with _sweeps_lock:
+        old = _sweeps.pop(key, None)
+        if old is not None:
+            old.cancelled = True
+        _sweeps[key] = sweep
+        while len(_sweeps) > SWEEP_CACHE_SIZE:
+            _sweeps.popitem(last=False)[1].cancelled = True
+    return sweep.start()
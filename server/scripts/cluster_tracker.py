@@ -0,0 +1,125 @@
+"""Stable cluster identities across successive clusterings (streamed batches)"""
+import threading
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+SPLIT_FRACTION = 0.2    # share of a cluster that has to move for a split/merge to be reported
+
+class ClusterTracker():
+    """
+    Relabels each new clustering so clusters keep their ids over time. The contingency
+    matrix between the previous ids and the new labels is built with one bincount;
+    the Hungarian algorithm matches clusters one-to-one, unmatched new clusters get the
+    smallest free id. Splits (an old cluster spread over several new ones) and merges
+    (a new cluster drawn from several old ones) are recorded as events. The per-node
+    ids of every step are kept as one int16 row per step (-1: node absent).
+    """
+
+    def __init__(self, split_fraction=SPLIT_FRACTION):
+        self.split_fraction = split_fraction
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.node_ids = []
+            self.node_index = {}
+            self.steps = []
+            self.events = []
+            self._history = []
+
+    def __len__(self):
+        return len(self.steps)
+
+    def _codes(self, node_ids):
+        for n in node_ids:
+            if n not in self.node_index:
+                self.node_index[n] = len(self.node_ids)
+                self.node_ids.append(n)
+        return np.fromiter((self.node_index[n] for n in node_ids), dtype=np.int64, count=len(node_ids))
+
+    def _previous(self):
+        prev = np.full(len(self.node_ids), -1, dtype=np.int64)
+        if self._history:
+            prev[:len(self._history[-1])] = self._history[-1]
+        return prev
+
+    def _match(self, old, new_codes, n_new, step):
+        """
+        Stable id per new label (-1: unmatched) and the split/merge/death events;
+        "to" of splits and merges holds new label positions at this point.
+        """
+        stable = np.full(n_new, -1, dtype=np.int64)
+        events = []
+        both = old >= 0
+        old_ids, old_codes = np.unique(old[both], return_inverse=True)
+        if len(old_ids) == 0:
+            return stable, events
+
+        C = np.bincount(old_codes * n_new + new_codes[both], minlength=len(old_ids) * n_new).reshape(len(old_ids), n_new)
+        rows, cols = linear_sum_assignment(-C)
+        matched = C[rows, cols] > 0
+        stable[cols[matched]] = old_ids[rows[matched]]
+
+        # significant flows: a large enough share of the old (split) or the new (merge) cluster
+        from_old = C >= np.maximum(1, self.split_fraction * C.sum(axis=1, keepdims=True))
+        from_new = C >= np.maximum(1, self.split_fraction * C.sum(axis=0, keepdims=True))
+        for i in np.flatnonzero(from_old.sum(axis=1) > 1):
+            events.append({"step": step, "type": "split", "from": [int(old_ids[i])],
+                           "to": np.flatnonzero(from_old[i]).tolist()})
+        for j in np.flatnonzero(from_new.sum(axis=0) > 1):
+            events.append({"step": step, "type": "merge", "from": old_ids[from_new[:, j]].tolist(),
+                           "to": [int(j)]})
+        for i in np.setdiff1d(np.arange(len(old_ids)), rows[matched]):
+            events.append({"step": step, "type": "death", "from": [int(old_ids[i])], "to": []})
+        return stable, events
+
+    def update(self, node_ids, labels, version=None):
+        """Records one clustering and returns its labels mapped onto the tracked ids"""
+        node_ids = list(node_ids)
+        labels = np.asarray(labels)
+        with self._lock:
+            codes = self._codes(node_ids)
+            step = len(self.steps)
+            new_labels, new_codes = np.unique(labels, return_inverse=True)
+
+            if step == 0:
+                stable = new_labels.astype(np.int64)
+            else:
+                old = self._previous()[codes]
+                stable, events = self._match(old, new_codes, len(new_labels), step)
+                births = np.flatnonzero(stable < 0)
+                free = np.setdiff1d(np.arange(len(new_labels) + len(np.unique(old)) + 1), stable)
+                stable[births] = free[:len(births)]
+                for e in events:
+                    if e["type"] in ("split", "merge"):
+                        e["to"] = sorted(int(stable[j]) for j in e["to"])
+                events += [{"step": step, "type": "birth", "from": [], "to": [int(stable[j])]} for j in births]
+                self.events.extend(events)
+
+            mapped = stable[new_codes]
+            row = np.full(len(self.node_ids), -1, dtype=np.int16)
+            row[codes] = mapped
+            self._history.append(row)
+            self.steps.append({"step": step, "version": version, "clusters": len(new_labels)})
+        return mapped
+
+    def history(self, node_ids=None):
+        """(steps x nodes) ids, -1 where a node was absent; node_ids defaults to every tracked node"""
+        with self._lock:
+            H = np.full((len(self._history), len(self.node_ids)), -1, dtype=np.int16)
+            for s, row in enumerate(self._history):
+                H[s, :len(row)] = row
+            nodes = list(self.node_ids) if node_ids is None else [n for n in node_ids if n in self.node_index]
+            return nodes, H[:, [self.node_index[n] for n in nodes]]
+
+    def transitions(self, node_ids=None):
+        """Every (node, step) where a present node changed cluster id"""
+        nodes, H = self.history(node_ids)
+        if len(H) < 2:
+            return []
+        prev, cur = H[:-1], H[1:]
+        steps, cols = np.nonzero((prev != cur) & (prev >= 0) & (cur >= 0))
+        return [{"nodeId": nodes[c], "step": int(s) + 1, "from": int(prev[s, c]), "to": int(cur[s, c])}
+                for s, c in zip(steps, cols)]
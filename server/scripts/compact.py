@@ -0,0 +1,55 @@
+"""Compact in-memory form of the long-format frame: categorical keys, epoch timestamps, optional float32"""
+import numpy as np
+import pandas as pd
+
+KEY_COLS = ['timestamp', 'nodeId']
+EPOCHS_ATTR = 'timestamp_epochs'
+
+def to_epoch_ns(values):
+    """Parses timestamps (strings or env log seconds) into int64 epoch nanoseconds (UTC)"""
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_datetime(values, unit='s').to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    return pd.to_datetime(values, utc=True).dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+def is_compact(df):
+    return isinstance(df['timestamp'].dtype, pd.CategoricalDtype) and EPOCHS_ATTR in df.attrs
+
+def compact_frame(df, float32=False):
+    """
+    nodeId -> dictionary-encoded categorical, timestamp -> categorical ordered by time
+    whose epochs (parsed once, one per unique timestamp) are kept in df.attrs,
+    metrics -> float32 when float32=True. JSON output is unchanged.
+    """
+    out = df.copy(deep=False)
+    if not is_compact(df):
+        out['nodeId'] = df['nodeId'].astype('category')
+
+        codes, uniques = pd.factorize(df['timestamp'])
+        epochs = to_epoch_ns(uniques)
+        order = np.argsort(epochs, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        out['timestamp'] = pd.Categorical.from_codes(rank[codes], categories=pd.Index(uniques)[order])
+        out.attrs[EPOCHS_ATTR] = epochs[order]
+
+    if float32:
+        metric_cols = [c for c in df.columns if c not in KEY_COLS]
+        out[metric_cols] = df[metric_cols].astype(np.float32)
+    return out
+
+def timestamp_epochs(df):
+    """Epochs aligned with df['timestamp'].cat.categories, or None for a non-compact frame"""
+    if not isinstance(df['timestamp'].dtype, pd.CategoricalDtype):
+        return None
+    epochs = df.attrs.get(EPOCHS_ATTR)
+    if epochs is None or len(epochs) != len(df['timestamp'].cat.categories):
+        epochs = to_epoch_ns(df['timestamp'].cat.categories)
+    return epochs
+
+def row_epochs(df):
+    """Epoch of every row; a compact frame only looks its codes up"""
+    epochs = timestamp_epochs(df)
+    if epochs is None:
+        return to_epoch_ns(df['timestamp'])
+    return epochs[df['timestamp'].cat.codes.to_numpy()]
@@ -0,0 +1,244 @@
+"""Columnar dataset store: converts an input CSV once into memory-mapped Arrow files"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from scripts.compact import compact_frame
+
+STORE_DIR = './data/store/'
+MANIFEST_NAME = 'manifest.json'
+KEYS_NAME = 'keys.arrow'
+GROUP_SIZE = 16         # metrics per partition file
+CHUNK_ROWS = 200000     # rows read from the CSV per pass
+KEY_COLS = ['timestamp', 'nodeId']
+# key columns (and their env log names) are read as text, so every chunk has this key schema
+KEY_DTYPES = {c: str for c in KEY_COLS + ['time_secs', 'cname_processed']}
+KEY_SCHEMA = pa.schema([(c, pa.string()) for c in KEY_COLS])
+
+_convert_locks = {}
+_convert_locks_guard = threading.Lock()
+
+def _convert_lock(path):
+    """One lock per store directory, so threads converting the same CSV run one at a time"""
+    with _convert_locks_guard:
+        return _convert_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+def normalize_columns(df):
+    """Renames env log columns to the timestamp/nodeId schema used everywhere else"""
+    if ('time_secs' in df.columns):
+        df['timestamp'] = df['time_secs']
+        df.drop(columns=['time_secs'], inplace=True)
+    if ('cname_processed' in df.columns):
+        df['nodeId'] = df['cname_processed']
+        df.drop(columns=[c for c in ['cname_id', 'cname_processed'] if c in df.columns], inplace=True)
+    return df
+
+def source_fingerprint(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def numeric_dictionary(dictionary):
+    """The dictionary of a text key column as numbers when every value parses as one, else None"""
+    values = pd.to_numeric(pd.Series(dictionary.to_pandas()), errors='coerce')
+    if values.isna().any() or not values.is_unique:
+        return None
+    return pa.array(values.to_numpy())
+
+class DatasetStore():
+    """
+    Partitioned on-disk copy of a long-format CSV (one row per timestamp x nodeId).
+    Key columns live in keys.arrow, metrics are split into groups of GROUP_SIZE
+    columns (group_000.arrow, ...). Files are uncompressed Arrow IPC so reads are
+    memory-mapped and only the groups holding the requested columns are touched.
+    The key columns are decoded once per store version and stay dictionary-encoded.
+    Each version is written to a temporary directory and renamed into <path>/<version>,
+    then manifest.json is replaced, so readers never see a half-written store.
+    """
+
+    def __init__(self, source_path, store_dir=STORE_DIR, group_size=GROUP_SIZE):
+        self.source_path = source_path
+        self.group_size = group_size
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        self.path = os.path.join(store_dir, name)
+        self.manifest = self._read_manifest()
+        self._keys = None       # (version, decoded key frame)
+        if not self._is_current():
+            self.convert()
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    @property
+    def metrics(self):
+        return list(self.manifest['groups'].keys())
+
+    @property
+    def num_rows(self):
+        return self.manifest['num_rows']
+
+    def _read_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _is_current(self):
+        if self.manifest is None or not os.path.exists(self.source_path):
+            return self.manifest is not None
+        return self.manifest['source'] == source_fingerprint(self.source_path)
+
+    def convert(self):
+        """Converts the CSV unless another thread or process just wrote the current version"""
+        with _convert_lock(self.path):
+            self.manifest = self._read_manifest()
+            if self._is_current():
+                return
+            fingerprint = source_fingerprint(self.source_path)
+            digest = hashlib.sha1(json.dumps([os.path.abspath(self.source_path), fingerprint]).encode()).hexdigest()
+            version = digest[:16]
+            print(f'Converting {self.source_path} to columnar store {self.path}')
+
+            tmp_dir = os.path.join(self.path, f'.{version}-{uuid.uuid4().hex}.tmp')
+            os.makedirs(tmp_dir)
+            try:
+                num_rows, groups = self._write_files(tmp_dir)
+                version_dir = os.path.join(self.path, version)
+                try:
+                    os.replace(tmp_dir, version_dir)
+                except OSError:
+                    # another process renamed the same version into place first
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+
+            manifest = {
+                "source": fingerprint,
+                "version": version,
+                "dir": version,
+                "num_rows": num_rows,
+                "groups": groups,
+            }
+            tmp_manifest = os.path.join(self.path, f'.{MANIFEST_NAME}-{uuid.uuid4().hex}.tmp')
+            with open(tmp_manifest, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_manifest, os.path.join(self.path, MANIFEST_NAME))
+            self.manifest = manifest
+            self._remove_stale(version)
+
+    def _write_files(self, out_dir):
+        """Streams the CSV in chunks into the key file and per-group metric files, returns (num_rows, groups)"""
+        writers = {}
+        groups = {}
+        num_rows = 0
+
+        try:
+            for chunk in pd.read_csv(self.source_path, chunksize=CHUNK_ROWS, dtype=KEY_DTYPES):
+                chunk = normalize_columns(chunk)
+                metric_cols = [c for c in chunk.columns if c not in KEY_COLS]
+                if not groups:
+                    groups = {col: i // self.group_size for i, col in enumerate(metric_cols)}
+
+                keys = pa.Table.from_pandas(chunk[KEY_COLS], schema=KEY_SCHEMA, preserve_index=False)
+                if 'keys' not in writers:
+                    writers['keys'] = pa.ipc.new_file(os.path.join(out_dir, KEYS_NAME), KEY_SCHEMA)
+                writers['keys'].write_table(keys)
+
+                for g in sorted(set(groups.values())):
+                    cols = [c for c in groups if groups[c] == g]
+                    values = chunk[cols].apply(pd.to_numeric, errors='coerce').fillna(0.0).astype(np.float64)
+                    table = pa.Table.from_pandas(values, preserve_index=False)
+                    if g not in writers:
+                        writers[g] = pa.ipc.new_file(os.path.join(out_dir, self._group_file(g)), table.schema)
+                    writers[g].write_table(table)
+                num_rows += len(chunk)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return num_rows, groups
+
+    def _remove_stale(self, version):
+        """Drops older version directories and files of the pre-versioned layout"""
+        for name in os.listdir(self.path):
+            full = os.path.join(self.path, name)
+            if name in (version, MANIFEST_NAME) or name.endswith('.tmp'):
+                continue
+            if os.path.isdir(full):
+                shutil.rmtree(full, ignore_errors=True)
+            elif name.endswith('.arrow'):
+                os.remove(full)
+
+    def _group_file(self, group):
+        return f'group_{group:03d}.arrow'
+
+    def _read_arrow(self, fname):
+        # memory-mapped, zero-copy read of an uncompressed IPC file
+        source = pa.memory_map(os.path.join(self.path, self.manifest.get('dir', ''), fname), 'r')
+        return pa.ipc.open_file(source).read_all()
+
+    def _key_frame(self):
+        """
+        timestamp/nodeId as categoricals built from the Arrow dictionaries (each distinct
+        key string decoded once), timestamp ordered by time with its epochs in attrs
+        """
+        if self._keys is None or self._keys[0] != self.version:
+            table = self._read_arrow(KEYS_NAME)
+            encoded = [self._encode_key(table.column(c)) for c in KEY_COLS]
+            keys = pa.table(encoded, names=KEY_COLS).to_pandas()
+            if isinstance(keys['nodeId'].dtype, pd.CategoricalDtype):
+                # same category order as astype('category')
+                keys['nodeId'] = keys['nodeId'].cat.reorder_categories(keys['nodeId'].cat.categories.sort_values())
+            self._keys = (self.version, compact_frame(keys))
+        return self._keys[1]
+
+    @staticmethod
+    def _encode_key(column):
+        """Dictionary-encodes a text key column; all-numeric keys (env log seconds) are decoded back to numbers"""
+        if not pa.types.is_string(column.type):
+            return column
+        column = column.combine_chunks().dictionary_encode()
+        numbers = numeric_dictionary(column.dictionary)
+        if numbers is None:
+            return column
+        return numbers.take(column.indices)
+
+    def load(self, columns=None):
+        """
+        Returns a DataFrame with timestamp, nodeId (shared, cached categoricals) and the
+        requested metric columns. columns=None loads every metric. Unknown columns are ignored.
+        """
+        groups = self.manifest['groups']
+        if columns is None:
+            columns = self.metrics
+        columns = [c for c in columns if c in groups]
+
+        keys = self._key_frame()
+        data = {c: keys[c] for c in KEY_COLS}
+        for g in sorted({groups[c] for c in columns}):
+            table = self._read_arrow(self._group_file(g))
+            wanted = [c for c in columns if groups[c] == g]
+            data.update(table.select(wanted).to_pandas(split_blocks=True).items())
+
+        df = pd.DataFrame({c: data[c] for c in KEY_COLS + columns}, copy=False)
+        df.attrs.update(keys.attrs)
+        return df
+
+_stores = {}
+
+def get_dataset_store(source_path, store_dir=STORE_DIR):
+    """Returns the (process-wide) store for a CSV, converting it on first use"""
+    key = os.path.abspath(source_path)
+    store = _stores.get(key)
+    if store is None or not store._is_current():
+        store = DatasetStore(source_path, store_dir=store_dir)
+        _stores[key] = store
+    return store
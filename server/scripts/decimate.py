@@ -0,0 +1,108 @@
+"""Time-window slicing and per-node decimation (LTTB / min-max) of tensor series"""
+import numpy as np
+import pandas as pd
+
+from scripts.compact import compact_frame, timestamp_epochs, to_epoch_ns
+
+def _bounds(epochs, start, end):
+    lo = 0 if start is None else int(np.searchsorted(epochs, to_epoch_ns([start])[0], side='left'))
+    hi = len(epochs) if end is None else int(np.searchsorted(epochs, to_epoch_ns([end])[0], side='right'))
+    return lo, max(lo, hi)
+
+def time_window(tensor, start=None, end=None):
+    """[lo, hi) column range of the (sorted) time axis; binary search, no scan"""
+    return _bounds(tensor.epochs, start, end)
+
+def window_frame(df, start=None, end=None):
+    """
+    Rows of a long-format frame inside [start, end]. On a compact frame the timestamp
+    categories are in time order, so the window is a range of codes and nothing is parsed.
+    """
+    epochs = timestamp_epochs(df)
+    if epochs is None:
+        df = compact_frame(df)
+        epochs = timestamp_epochs(df)
+    lo, hi = _bounds(epochs, start, end)
+    codes = df['timestamp'].cat.codes.to_numpy()
+    return df[(codes >= lo) & (codes < hi)]
+
+def lttb_indices(x, Y, n):
+    """
+    Largest-Triangle-Three-Buckets over every row of Y (nodes x time) at once.
+    Returns (nodes x n) column indices, first and last point always kept
+    (n < 3 keeps only those two).
+    """
+    N, T = Y.shape
+    if n >= T:
+        return np.tile(np.arange(T), (N, 1))
+    if n < 3:
+        return np.tile([0, T - 1], (N, 1))
+
+    edges = np.linspace(1, T - 1, n - 1).astype(int)
+    idx = np.empty((N, n), dtype=np.int64)
+    idx[:, 0] = 0
+    idx[:, -1] = T - 1
+    rows = np.arange(N)
+    a = np.zeros(N, dtype=np.int64)
+    for b in range(n - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nlo, nhi = edges[b + 1], (edges[b + 2] if b + 2 < len(edges) else T)
+        avg_x = x[nlo:nhi].mean()
+        avg_y = Y[:, nlo:nhi].mean(axis=1)
+        ax, ay = x[a][:, None], Y[rows, a][:, None]
+        area = np.abs((ax - avg_x) * (Y[:, lo:hi] - ay) - (ax - x[None, lo:hi]) * (avg_y[:, None] - ay))
+        a = lo + np.argmax(area, axis=1)
+        idx[:, b + 1] = a
+    return idx
+
+def minmax_indices(Y, n):
+    """Keeps the min and the max of every one of n // 2 buckets per row"""
+    N, T = Y.shape
+    buckets = max(1, n // 2)
+    if 2 * buckets >= T:
+        return np.tile(np.arange(T), (N, 1))
+
+    edges = np.linspace(0, T, buckets + 1).astype(int)
+    idx = np.empty((N, 2 * buckets), dtype=np.int64)
+    for b in range(buckets):
+        lo, hi = edges[b], edges[b + 1]
+        idx[:, 2 * b] = lo + np.argmin(Y[:, lo:hi], axis=1)
+        idx[:, 2 * b + 1] = lo + np.argmax(Y[:, lo:hi], axis=1)
+    return np.sort(idx, axis=1)
+
+def decimate(tensor, cols, start=None, end=None, points=None, method='lttb'):
+    """
+    Long-format frame (timestamp, nodeId, cols..., downtime) of the requested window
+    with at most ~points samples per node and column. Points chosen for any column
+    are kept for all columns of that node so rows stay complete.
+    """
+    if points is not None and points < 1:
+        raise ValueError(f"Invalid number of points: {points}")
+    lo, hi = time_window(tensor, start, end)
+    cols = [c for c in cols if c in tensor.metric_index]
+    series = [tensor.metric(c, fill='zero')[:, lo:hi] for c in cols]
+    n_nodes, T = len(tensor.node_ids), hi - lo
+
+    if points is None or T == 0 or not series:
+        keep = [np.arange(T)] * n_nodes
+    else:
+        x = (tensor.epochs[lo:hi] - (tensor.epochs[lo] if T else 0)) / 1e9
+        if method == 'lttb':
+            picked = [lttb_indices(x, Y, points) for Y in series]
+        elif method == 'minmax':
+            picked = [minmax_indices(Y, points) for Y in series]
+        else:
+            raise ValueError(f"Invalid decimation method: {method}")
+        stacked = np.hstack(picked)
+        keep = [np.unique(row) for row in stacked]
+
+    rows = np.repeat(np.arange(n_nodes), [len(k) for k in keep])
+    times = np.concatenate(keep) if keep else np.empty(0, dtype=np.int64)
+    df = pd.DataFrame({
+        "timestamp": tensor.timestamps[lo + times],
+        "nodeId": tensor.node_ids[rows],
+    })
+    for c, Y in zip(cols, series):
+        df[c] = Y[rows, times]
+    df['downtime'] = (df[cols] == 0).all(axis=1).astype(int)
+    return df
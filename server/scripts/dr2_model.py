@@ -0,0 +1,261 @@
+"""Fitted DR2 UMAP reducers kept per parameter set, reused across requests and streamed batches"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+import joblib
+import numpy as np
+from sklearn.utils import check_random_state
+from umap import UMAP
+from umap.umap_ import nearest_neighbors
+
+from scripts.dr_cache import cache_key
+from scripts.lru_store import LRUStore
+
+MODEL_DIR = './scripts/cache/dr2_models/'
+CHANGE_TOL = 1e-2       # a node is re-projected once its DR1 row moved by more than this share of a column's spread
+KNN_CACHE_SIZE = 4      # DR1 matrices whose neighbor graphs are kept
+FIT_CACHE_SIZE = 4      # fitted models kept in memory
+MAX_MODELS = 16         # joblib files kept on disk
+
+class KNNCache():
+    """
+    k-NN graphs (indices, distances, NNDescent index) keyed by a hash of the DR1
+    matrix. Only the graph for the largest k asked so far is kept; smaller
+    n_neighbors are served by slicing its columns.
+    """
+
+    def __init__(self, size=KNN_CACHE_SIZE):
+        self.size = size
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(X):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        return hashlib.sha1(str(X.shape).encode() + X.tobytes()).hexdigest()
+
+    def get(self, X, k):
+        """precomputed_knn tuple for UMAP(n_neighbors=k) on X"""
+        key = self.content_hash(X)
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is not None:
+                self._graphs.move_to_end(key)
+        if graph is None or graph[0].shape[1] < k:
+            start = timer()
+            # same random state UMAP(random_state=42) would use for its own search
+            graph = nearest_neighbors(X, k, "euclidean", {}, False, check_random_state(42))
+            print(f'DR2 k-NN graph (k={k}) in {timer() - start}s')
+            with self._lock:
+                self._graphs[key] = graph
+                self._graphs.move_to_end(key)
+                while len(self._graphs) > self.size:
+                    self._graphs.popitem(last=False)
+        indices, dists, index = graph
+        # UMAP edits the graph in place when disconnecting vertices, hand out copies
+        return indices[:, :k].copy(), dists[:, :k].copy(), index
+
+def procrustes(emb, ref):
+    """(R, scale, shift) mapping emb onto ref with a rotation/reflection, uniform scale and translation (least squares)"""
+    mu_emb, mu_ref = emb.mean(axis=0), ref.mean(axis=0)
+    A, B = emb - mu_emb, ref - mu_ref
+    U, S, Vt = np.linalg.svd(A.T @ B)
+    R = U @ Vt
+    norm = (A ** 2).sum()
+    scale = S.sum() / norm if norm > 0 else 1.0
+    return R, scale, mu_ref - scale * mu_emb @ R
+
+def apply_alignment(align, emb):
+    if align is None:
+        return emb
+    R, scale, shift = align
+    return scale * emb @ R + shift
+
+class _Fit():
+    __slots__ = ('model', 'columns', 'node_ids', 'X', 'emb', 'align')
+
+    def __init__(self, model, columns, node_ids, X, emb, align=None):
+        self.model = model
+        self.columns = list(columns)
+        self.node_ids = np.asarray(node_ids)
+        self.X = X
+        self.emb = emb          # aligned
+        self.align = align      # applied to model.transform output as well
+
+    def transform(self, X):
+        return apply_alignment(self.align, self.model.transform(X))
+
+class ModelStore(LRUStore):
+    """One joblib file per fitted model, LRU-evicted past max_entries (see scripts/lru_store.py)"""
+    SUFFIX = '.joblib'
+
+def model_key(n_neighbors, min_dist, version, columns):
+    """Same hash as the DR2 results cache: dataset version, column set, method and parameters"""
+    return cache_key(version, columns, "UMAP", {"n_neighbors": int(n_neighbors), "min_dist": float(min_dist)})
+
+class DR2Models():
+    """
+    Fitted UMAPs keyed by model_key (dataset version, columns, n_neighbors, min_dist), in
+    memory and as joblib files under MODEL_DIR. embed() returns the stored embedding when
+    the DR1 matrix is unchanged. Otherwise it refits (incremental=False), or for streaming
+    (incremental=True) it transforms only the nodes that are new or moved past CHANGE_TOL
+    with the latest model for the same parameters and columns, and schedules a full refit
+    under the new version in a background thread. Every fit is Procrustes-aligned onto
+    the last embedding returned for its parameters and columns, so a refit doesn't
+    rotate, flip or shift the points the user is looking at.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self.files = ModelStore(model_dir, max_entries=MAX_MODELS)
+        self._fits = OrderedDict()
+        self._latest = {}       # (n_neighbors, min_dist, columns) -> key of the last fit stored
+        self._published = {}    # (n_neighbors, min_dist, columns) -> (node_ids, embedding) last returned
+        self._refitting = set()
+        self._lock = threading.Lock()
+        self.knn = KNNCache()
+
+    def _get(self, key):
+        with self._lock:
+            fit = self._fits.get(key)
+            if fit is not None:
+                self._fits.move_to_end(key)
+                return fit
+        if self.files.touch(key) is None:
+            return None
+        try:
+            fit = joblib.load(self.files._path(key))
+        except Exception as e:
+            print(f"Could not load DR2 model {self.files._path(key)}: {e}")
+            return None
+        with self._lock:
+            self._keep(key, fit)
+        return fit
+
+    def _keep(self, key, fit):
+        self._fits[key] = fit
+        self._fits.move_to_end(key)
+        while len(self._fits) > FIT_CACHE_SIZE:
+            self._fits.popitem(last=False)
+
+    def _store(self, key, params, version, fit):
+        with self._lock:
+            self._keep(key, fit)
+            self._latest[(*params, tuple(fit.columns))] = key
+        path = self.files._path(key)
+        joblib.dump(fit, path)
+        self.files.add(key, size=os.path.getsize(path), n_neighbors=params[0], min_dist=params[1], version=version)
+
+    def _fit(self, key, params, version, columns, node_ids, X):
+        start = timer()
+        n_neighbors, min_dist = params
+        lineage = (*params, tuple(columns))
+        # a refit starts from the layout last shown, so clusters keep their places
+        init = self._published_layout(lineage, node_ids)
+        kwargs = {} if init is None else {"init": init}
+        if n_neighbors < len(X):
+            # neighbor search is shared across n_neighbors/min_dist settings of the same DR1 matrix
+            model = UMAP(n_components=2, n_neighbors=n_neighbors, min_dist=min_dist, random_state=42,
+                         precomputed_knn=self.knn.get(X, n_neighbors), **kwargs)
+        else:
+            model = UMAP(n_components=2, n_neighbors=n_neighbors, min_dist=min_dist, random_state=42, **kwargs)
+        emb = model.fit_transform(X)
+        align = self._alignment(lineage, node_ids, emb)
+        print(f'DR2 UMAP fit in {timer() - start}s')
+        fit = _Fit(model, columns, node_ids, X.copy(), apply_alignment(align, emb), align)
+        self._store(key, params, version, fit)
+        return fit
+
+    def _alignment(self, lineage, node_ids, emb):
+        """Procrustes fit of emb onto the last published embedding over their shared nodes, None without one"""
+        with self._lock:
+            published = self._published.get(lineage)
+        if published is None:
+            return None
+        ref_index = {n: i for i, n in enumerate(published[0])}
+        pairs = [(i, ref_index[n]) for i, n in enumerate(node_ids) if n in ref_index]
+        if len(pairs) < 3:
+            return None
+        rows, ref_rows = np.array(pairs).T
+        return procrustes(emb[rows], published[1][ref_rows])
+
+    def _published_layout(self, lineage, node_ids):
+        """Last published position of every node, None unless all of them were published"""
+        with self._lock:
+            published = self._published.get(lineage)
+        if published is None:
+            return None
+        ref_index = {n: i for i, n in enumerate(published[0])}
+        if any(n not in ref_index for n in node_ids):
+            return None
+        return published[1][[ref_index[n] for n in node_ids]]
+
+    def _publish(self, lineage, node_ids, emb):
+        with self._lock:
+            self._published[lineage] = (node_ids, emb)
+        return emb
+
+    def _refit_background(self, key, params, version, columns, node_ids, X):
+        with self._lock:
+            if key in self._refitting:
+                return
+            self._refitting.add(key)
+
+        def run():
+            try:
+                self._fit(key, params, version, columns, node_ids, X)
+            except Exception as e:
+                print(f"Background DR2 refit failed: {e}")
+            finally:
+                with self._lock:
+                    self._refitting.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def embed(self, df_pivot, n_neighbors, min_dist, incremental=False, version=None):
+        """(nodes x 2) embedding for the rows of df_pivot (Measurement x Col DR1 values)"""
+        params = (int(n_neighbors), float(min_dist))
+        columns, node_ids, X = list(df_pivot.columns), df_pivot.index.to_numpy(), df_pivot.to_numpy(dtype=np.float64)
+        key = model_key(*params, version, columns)
+        fit = self._get(key)
+        if fit is None and incremental:
+            # a streamed batch is a new version: start from the model of the previous one
+            with self._lock:
+                latest = self._latest.get((*params, tuple(columns)))
+            fit = self._get(latest) if latest is not None else None
+
+        lineage = (*params, tuple(columns))
+        if fit is None or fit.columns != columns:
+            return self._publish(lineage, node_ids, self._fit(key, params, version, columns, node_ids, X).emb)
+
+        # rows of the fitted matrix for the current nodes (-1: node not in the fit)
+        fit_index = {n: i for i, n in enumerate(fit.node_ids)}
+        rows = np.array([fit_index.get(n, -1) for n in node_ids], dtype=np.int64)
+        known = rows >= 0
+        changed = ~known
+        # streamed DR1 scores move a little for almost every node each batch; only real moves count
+        tol = CHANGE_TOL * X.std(axis=0)
+        changed[known] = (np.abs(fit.X[rows[known]] - X[known]) > tol).any(axis=1)
+        if not changed.any():
+            return self._publish(lineage, node_ids, fit.emb[rows])
+        if not incremental:
+            return self._publish(lineage, node_ids, self._fit(key, params, version, columns, node_ids, X).emb)
+
+        start = timer()
+        emb = np.empty((len(node_ids), 2))
+        emb[~changed] = fit.emb[rows[~changed]]
+        emb[changed] = fit.transform(X[changed])
+        print(f'DR2 UMAP transform of {int(changed.sum())} nodes in {timer() - start}s')
+        self._refit_background(key, params, version, columns, node_ids, X)
+        return self._publish(lineage, node_ids, emb)
+
+_models = None
+
+def get_dr2_models():
+    global _models
+    if _models is None:
+        _models = DR2Models()
+    return _models
@@ -0,0 +1,49 @@
+"""Content-addressed cache of DR results: many parquet entries, LRU-evicted under a size budget"""
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from scripts.lru_store import LRUStore
+
+CACHE_DIR = './scripts/cache/dr/'
+MAX_BYTES = 512 * 1024 * 1024
+
+def cache_key(dataset_version, columns, method, params=None):
+    """Hash of everything a DR result depends on"""
+    spec = [dataset_version, sorted(columns), method, params or {}]
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+class DRCache(LRUStore):
+    """
+    Each entry is one parquet file named by its key, LRU-evicted under max_bytes
+    (see scripts/lru_store.py).
+    """
+    SUFFIX = '.parquet'
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        super().__init__(cache_dir, max_bytes=max_bytes)
+
+    def get(self, key):
+        if self.touch(key) is None:
+            return None
+        try:
+            return pd.read_parquet(self._path(key))
+        except (OSError, ValueError) as e:
+            print(f"Dropping unreadable DR cache entry {key}: {e}")
+            self.evict(key)
+            return None
+
+    def put(self, key, df, **meta):
+        path = self._path(key)
+        df.to_parquet(path)
+        self.add(key, size=os.path.getsize(path), **meta)
+
+_cache = None
+
+def get_dr_cache():
+    global _cache
+    if _cache is None:
+        _cache = DRCache()
+    return _cache
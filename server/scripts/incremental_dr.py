@@ -0,0 +1,130 @@
+"""Incremental PCA DR1 for streaming: per-batch updates instead of refitting the whole history"""
+import numpy as np
+import pandas as pd
+
+from scripts.pipeline import batched_first_pc, standardize_stack
+
+SKETCH_RANK = 16
+DRIFT_THRESHOLD = 0.5
+
+class IncrementalDR1():
+    """
+    PCA DR1 of every metric kept up to date as new timestamps arrive.
+
+    DR1 standardizes each timestamp column across nodes and takes the first principal
+    component of the nodes x time matrix Z, i.e. the top eigenvector of Z Z^T, which is
+    a sum over timestamps. A rank-`rank` sketch B (B^T B ~= Z Z^T) per metric is
+    updated with the standardized columns of each batch, so an update costs
+    O((rank + batch) * nodes) per metric no matter how long the history is.
+    Running per-metric means/variances of the raw values are tracked; once they
+    drift more than drift_threshold from the values at the last full refit (or
+    when nodes / past timestamps change), needs_refit is set.
+    """
+
+    def __init__(self, rank=SKETCH_RANK, drift_threshold=DRIFT_THRESHOLD):
+        self.rank = rank
+        self.drift_threshold = drift_threshold
+        self.metrics = []
+        self.node_ids = np.array([])
+        self.sketch = None          # (metrics, rank, nodes)
+        self.scores = None          # (metrics, nodes)
+        self.last_epoch = None
+        self.stats = None           # count, mean, M2 per metric
+        self.fit_stats = None
+        self.needs_refit = True
+
+    @property
+    def fitted(self):
+        return self.sketch is not None
+
+    def fit(self, tensor):
+        """Full refit over the whole history: exact scores plus a fresh sketch"""
+        self.metrics = list(tensor.metrics)
+        self.node_ids = np.asarray(tensor.node_ids)
+        self.node_index = {n: i for i, n in enumerate(self.node_ids)}
+        M, N = len(self.metrics), len(self.node_ids)
+        self.sketch = np.zeros((M, self.rank, N))
+        self.scores = np.zeros((M, N))
+        self.stats = np.zeros((3, M))
+
+        for m, col in enumerate(self.metrics):
+            X = tensor.metric(col, fill='zero').astype(np.float64, copy=False)
+            Z = standardize_stack(X[None])
+            if N >= 2 and np.isfinite(Z).all() and (Z != 0).any():
+                self.scores[m] = batched_first_pc(Z)[0]
+                U, s, _ = np.linalg.svd(Z[0], full_matrices=False)
+                k = min(self.rank, len(s))
+                self.sketch[m, :k] = s[:k, None] * U[:, :k].T
+            self.stats[:, m] = (X.size, X.mean() if X.size else 0.0, X.var() * X.size if X.size else 0.0)
+
+        self.last_epoch = int(tensor.epochs.max()) if len(tensor.epochs) else None
+        self.fit_stats = self.stats.copy()
+        self.needs_refit = False
+
+    def _merge_stats(self, X):
+        # Chan et al. parallel mean/variance merge, one column per metric
+        n_b = X.shape[1] * X.shape[2]
+        mean_b = X.mean(axis=(1, 2))
+        m2_b = X.var(axis=(1, 2)) * n_b
+        n_a, mean_a, m2_a = self.stats
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        self.stats = np.vstack([n, mean_a + delta * n_b / n, m2_a + m2_b + delta ** 2 * n_a * n_b / n])
+
+    def drift(self):
+        """Largest standardized change of a metric's mean/std since the last full refit"""
+        n0, mean0, m20 = self.fit_stats
+        n1, mean1, m21 = self.stats
+        std0 = np.sqrt(m20 / np.maximum(n0, 1))
+        std1 = np.sqrt(m21 / np.maximum(n1, 1))
+        scale = np.where(std0 > 0, std0, 1.0)
+        d = np.abs(mean1 - mean0) / scale + np.abs(std1 - std0) / scale
+        return float(d.max()) if d.size else 0.0
+
+    def update(self, batch_tensor):
+        """
+        Folds the new timestamps of a batch into the model. Returns False (and sets
+        needs_refit) when the batch can't be applied incrementally: unknown nodes,
+        new metrics or timestamps at/before ones already absorbed.
+        """
+        if not self.fitted or self.needs_refit:
+            return False
+        if (any(n not in self.node_index for n in batch_tensor.node_ids)
+                or any(m not in batch_tensor.metric_index for m in self.metrics)
+                or (self.last_epoch is not None and batch_tensor.epochs.min() <= self.last_epoch)):
+            self.needs_refit = True
+            return False
+
+        # align the batch on the fitted node order, missing cells are 0 as in DR1
+        rows = np.array([self.node_index[n] for n in batch_tensor.node_ids], dtype=np.int64)
+        X = np.zeros((len(self.metrics), len(self.node_ids), len(batch_tensor.timestamps)))
+        for m, col in enumerate(self.metrics):
+            X[m, rows] = batch_tensor.metric(col, fill='zero')
+        self._merge_stats(X)
+
+        Z = standardize_stack(X)
+        Z[~np.isfinite(Z)] = 0.0
+        _, s, Vt = np.linalg.svd(np.concatenate([self.sketch, Z.transpose(0, 2, 1)], axis=1), full_matrices=False)
+        k = min(self.rank, s.shape[1])
+        self.sketch[:] = 0.0
+        self.sketch[:, :k] = s[:, :k, None] * Vt[:, :k]
+
+        # first component scores; keep the orientation of the previous projection
+        scores = Vt[:, 0] * s[:, :1]
+        flip = np.einsum('mn,mn->m', scores, self.scores) < 0
+        scores[flip] *= -1
+        self.scores = scores
+
+        self.last_epoch = int(batch_tensor.epochs.max())
+        if self.drift() > self.drift_threshold:
+            self.needs_refit = True
+        return True
+
+    def frame(self):
+        """DR1 results in the same long format as apply_dr_parallel"""
+        valid = np.abs(self.scores).sum(axis=1) > 0
+        return pd.DataFrame({
+            "Col": np.repeat(np.asarray(self.metrics, dtype=object)[valid], len(self.node_ids)),
+            "Measurement": np.tile(self.node_ids, int(valid.sum())),
+            "DR1": self.scores[valid].ravel()
+        })
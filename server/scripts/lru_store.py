@@ -0,0 +1,106 @@
+"""Keyed on-disk entries with an index.json of metadata, evicted least recently used first"""
+import json
+import os
+import threading
+import time
+
+INDEX_NAME = 'index.json'
+
+class LRUStore():
+    """
+    index.json maps each key to its metadata, payload size and last access time, so the
+    LRU order survives restarts. Stores with a payload file per key (<key><SUFFIX>)
+    write it themselves and pass its size to add(); once the sizes exceed max_bytes or
+    the entries max_entries, the least recently used entries and their files are deleted.
+    """
+    SUFFIX = None
+
+    def __init__(self, cache_dir, max_bytes=None, max_entries=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._read_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.SUFFIX}")
+
+    def _read_index(self):
+        path = os.path.join(self.cache_dir, INDEX_NAME)
+        index = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+        if self.SUFFIX is None:
+            return index
+        # drop entries whose files are gone
+        return {k: v for k, v in index.items() if os.path.exists(self._path(k))}
+
+    def _write_index(self):
+        path = os.path.join(self.cache_dir, INDEX_NAME)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, path)
+
+    def _remove(self, key):
+        if self.SUFFIX is not None and os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def touch(self, key):
+        """Entry metadata, marked as used; None if unknown"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            entry['last_used'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+            self._write_index()
+            return {"key": key, **entry}
+
+    def add(self, key, size=0, **meta):
+        now = time.time()
+        with self._lock:
+            self._index[key] = {"size": size, "created": now, "last_used": now, "hits": 0, **meta}
+            self._evict(keep=key)
+            self._write_index()
+
+    def entries(self, **filters):
+        """Metadata of the entries matching every non-None filter, most recently used first"""
+        with self._lock:
+            found = [{"key": k, **e} for k, e in self._index.items()
+                     if all(v is None or e.get(f) == v for f, v in filters.items())]
+        return sorted(found, key=lambda e: e['last_used'], reverse=True)
+
+    def evict(self, key):
+        with self._lock:
+            entry = self._index.pop(key, None)
+            if entry is not None:
+                self._write_index()
+        self._remove(key)
+        return entry is not None
+
+    def _over_budget(self, total, count):
+        return ((self.max_bytes is not None and total > self.max_bytes)
+                or (self.max_entries is not None and count > self.max_entries))
+
+    def _evict(self, keep=None):
+        total = sum(e['size'] for e in self._index.values())
+        count = len(self._index)
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_used']):
+            if not self._over_budget(total, count):
+                break
+            if key == keep:
+                continue
+            total -= self._index.pop(key)['size']
+            count -= 1
+            self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._index), "bytes": sum(e['size'] for e in self._index.values()),
+                    "max_bytes": self.max_bytes, "max_entries": self.max_entries}
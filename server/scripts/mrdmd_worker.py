@@ -0,0 +1,103 @@
+"""mrDMD tasks on one metric matrix (nodes x time), kept light so pool workers start quickly"""
+import sys
+
+import numpy as np
+
+sys.path.append("./scripts/src/")
+import mrdmd_zscore
+
+from scripts.shared_pool import shared_array
+
+ml = 9
+step = 10000
+
+def tile_baseline(M, base_mask):
+    """The baseline window of every node repeated along the whole timeline (extract_baselines)"""
+    base = M[:, base_mask]
+    reps = M.shape[1] // base.shape[1] + 2
+    return np.tile(base, (1, reps))[:, :M.shape[1]]
+
+def baseline_std(M, time_mask, config):
+    """Baseline z-score spread of the nodes over the baseline window"""
+    D = M[:, time_mask]
+    mrDMDZSC = mrdmd_zscore.MrDMDZscore(**config)
+    nodes = mrDMDZSC.mode_tree(D, max_levels=ml, max_cycles=1)
+    splt = mrDMDZSC.get_splt(step, ml)
+
+    # compute z-score
+    split_point = (D.shape[0] + 1) // 2
+    baseline_indx = np.arange(0, split_point)
+    n_baseline_indx = np.arange(split_point, D.shape[0])
+    return mrDMDZSC.compute_zscore(D, splt, nodes, baseline_indx, n_baseline_indx,
+                                   for_baseline=True, plot=False)
+
+def selection_zscores(M, base_mask, std_baselines, config):
+    """z-score of every node against its own tiled baseline, None without modes in range"""
+    if not base_mask.any():
+        return None
+    D = np.vstack([M, tile_baseline(M, base_mask)])
+    mrDMDZSC = mrdmd_zscore.MrDMDZscore(**config)
+    nodes = mrDMDZSC.mode_tree(D, max_levels=ml, max_cycles=1)
+    splt = mrDMDZSC.get_splt(step, ml)
+    n_baseline_indx = np.arange(0, M.shape[0])
+    baseline_indx = np.arange(M.shape[0], D.shape[0])
+    zsc = mrDMDZSC.compute_zscore(D[:, :step], splt, nodes, baseline_indx, n_baseline_indx,
+                                  std_baselines, for_baseline=False, plot=False)
+    return zsc[0][:M.shape[0]] if zsc else None
+
+def tree_row_power(tree, n_timestamps, t_start=0):
+    """
+    Per-row mean |Phi| over the modes compute_zscore keeps for the whole timeline
+    (0 <= f < 80), i.e. its dmd_freqs_mean for every row of the decomposed matrix.
+    t_start moves the start of the (at most `step` samples long) range it looks at.
+    """
+    t_end = min(n_timestamps, t_start + step)
+    modes = tree.mode_mask((tree.start <= t_end) & (tree.stop >= t_start))
+    if not modes.any():
+        return None
+    omega = np.log(tree.mu[modes]) * 100 / tree.mode_steps()[modes]
+    f = abs(omega.imag / 2 * np.pi)
+    keep = (f >= 0) & (f < 80)
+    if not keep.any():
+        return None
+    return np.mean(abs(tree.Phi[:, np.flatnonzero(modes)[keep]]), axis=1)
+
+def tree_level_zscores(tree, n_nodes, rows, std_baselines, n_timestamps, max_levels=None):
+    """
+    z-scores of the given node rows for every dyadic segment of the whole timeline at
+    every level (segment_zscores), against the mean of their baseline rows n_nodes + rows.
+    Returns (segments, Z): (level, start, stop) per segment, rows x segments.
+    """
+    segments, Z, _ = mrdmd_zscore.MrDMDZscore().segment_zscores(tree, n_nodes + rows, rows, std_baselines,
+                                                                 n_time=n_timestamps, max_levels=max_levels)
+    return segments, Z
+
+def selection_level_zscores(M, base_mask, std_baselines, config, max_levels=None):
+    """
+    tree_level_zscores on the tree selection_zscores decomposes (nodes stacked with their
+    tiled baseline), so the whole-timeline segment is the selection_zscores z-score
+    (for timelines up to `step` samples, the range compute_zscore looks at)
+    """
+    if not base_mask.any():
+        return None
+    D = np.vstack([M, tile_baseline(M, base_mask)])
+    tree = mrdmd_zscore.MrDMDZscore(**config).mode_tree(D, max_levels=ml, max_cycles=1)
+    return tree_level_zscores(tree, M.shape[0], np.arange(M.shape[0]), std_baselines, M.shape[1], max_levels)
+
+def mode_tree(M, base_mask, config):
+    """ModeTree of all nodes stacked with their tiled baselines (no time evolution)"""
+    if not base_mask.any():
+        return None
+    D = np.vstack([M, tile_baseline(M, base_mask)])
+    return mrdmd_zscore.MrDMDZscore(**config).mode_tree(D, max_levels=ml, max_cycles=1)
+
+TASKS = {
+    "baseline": baseline_std,
+    "zscores": selection_zscores,
+    "levels": selection_level_zscores,
+    "tree": mode_tree
+}
+
+def run_task(name, m, *args):
+    # runs in a pool process; the metric stack is shared, not pickled
+    return TASKS[name](shared_array('mrdmd')[m], *args)
@@ -0,0 +1,108 @@
+"""mrDMD over a growing timeline that only recomputes the bins new samples fall into"""
+import sys
+from math import ceil
+
+import numpy as np
+
+sys.path.append("./scripts/src/")
+import mrdmd_zscore
+
+MAX_WINDOW = 4096   # samples per top-level block
+
+def dyadic_grid(window, max_levels):
+    """(bin_num, start, stop) of every level of one block, split like mrdmd()"""
+    levels = [[(0, 0, window)]]
+    for _ in range(max_levels):
+        bins = []
+        for bin_num, start, stop in levels[-1]:
+            split = start + ceil((stop - start) / 2)
+            bins += [(2*bin_num, start, split), (2*bin_num+1, split, stop)]
+        levels.append(bins)
+    return levels
+
+class OnlineMrDMD():
+    """
+    The timeline is cut into blocks of `window` samples, each with the bin tree
+    mrdmd() would build over a full block; the last block may be partly filled and
+    its bins are clipped to the samples it has. Appending samples recomputes, top-down,
+    only the bins whose (clipped) range contains new samples: the open block's top
+    level and the rightmost bins below it, each from its recomputed parent's residual.
+    Bins left of the new samples keep their modes, so results differ from a full
+    mrdmd() over the same data, but the cost of an append is bounded by the window,
+    not by the length of the stream. Blocks that ended before the latest window are
+    dropped.
+    """
+
+    def __init__(self, max_levels=9, max_cycles=1, window=MAX_WINDOW, svd_backend='exact', do_svht=True):
+        self.mrDMDZSC = mrdmd_zscore.MrDMDZscore(svd_backend=svd_backend)
+        self.max_cycles = max_cycles
+        self.window = window
+        self.do_svht = do_svht
+        self.grid = dyadic_grid(window, max_levels)
+        self.nyq = 8 * max_cycles
+        self.block = None           # samples of the open block (rows x window), `filled` of them used
+        self.filled = 0
+        self.block_start = 0
+        self.n_samples = 0
+        self.nodes = {}             # (block_start, level, bin_num) -> ModeNode
+        self.recomputed = 0         # bins decomposed by the last append
+
+    def append(self, X):
+        """Adds samples (rows x new time steps); returns the number of bins recomputed"""
+        X = np.asarray(X, dtype=float)
+        self.recomputed = 0
+        while X.shape[1]:
+            if self.block is None:
+                self.block = np.empty((X.shape[0], self.window))
+            elif self.filled == self.window:
+                self.block_start += self.window
+                self.filled = 0
+            take = min(self.window - self.filled, X.shape[1])
+            first_new = self.filled
+            self.block[:, self.filled:self.filled + take] = X[:, :take]
+            self.filled += take
+            self.n_samples += take
+            X = X[:, take:]
+            self._update_block(first_new)
+        self._drop_old_blocks()
+        return self.recomputed
+
+    def _update_block(self, first_new):
+        # recompute the bins of the open block that overlap [first_new, filled)
+        L = self.filled
+        residuals = {0: self.block[:, :L]}     # bin_num -> residual of a recomputed bin of the previous level
+        for level, bins in enumerate(self.grid):
+            touched = [(b, s, min(e, L)) for b, s, e in bins if s < L and e > first_new]
+            inputs = {}
+            for b, s, e in touched:
+                key = (self.block_start, level, b)
+                self.nodes.pop(key, None)
+                parent = b if level == 0 else b // 2
+                if e - s < self.nyq or parent not in residuals:
+                    continue
+                p_start = 0 if level == 0 else self.grid[level - 1][parent][1]
+                inputs[b] = (s, e, residuals[parent][:, s - p_start:e - p_start])
+            residuals = {}
+            for size in sorted({e - s for s, e, _ in inputs.values()}):
+                group = [(b, self.block_start + s, size) for b, (s, e, _) in inputs.items() if e - s == size]
+                Dbin = np.stack([inputs[b][2] for b, _, _ in group])
+                for node, D in zip(self.mrDMDZSC.batch_bins(Dbin, level, group, self.max_cycles, self.do_svht), Dbin):
+                    if node.n > 0:
+                        D = D - np.dot(node.Phi, node.Psi)
+                    node.Psi = None
+                    residuals[node.bin_num] = D
+                    self.nodes[(self.block_start, level, node.bin_num)] = node
+                    self.recomputed += 1
+            if not residuals:
+                break
+
+    def _drop_old_blocks(self):
+        oldest = self.n_samples - self.window
+        for key in [k for k in self.nodes if k[0] + self.window <= oldest]:
+            del self.nodes[key]
+
+    def tree(self):
+        """Current bins as a ModeTree (no time evolution), sample positions since the first append"""
+        nodes = sorted(self.nodes.values(), key=lambda n: (n.start, n.level))
+        rows = 0 if self.block is None else self.block.shape[0]
+        return mrdmd_zscore.ModeTree.from_nodes(nodes, rows, keep_psi=False)
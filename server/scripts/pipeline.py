@@ -1,11 +1,11 @@
 """2-stage dimension reduction across time domain then feature domain"""
-import os
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+from collections import OrderedDict
 from timeit import default_timer as timer
 
 import numpy as np
 import pandas as pd
-from ccpca import CCPCA
 from mat_reorder import MatReorder
 from opt_sign_flip import OptSignFlip
 from sklearn.cluster import KMeans
@@ -14,109 +14,229 @@ from sklearn.manifold import TSNE
 from sklearn.preprocessing import StandardScaler
 from umap import UMAP
 
-CACHE_DIR = './scripts/cache/'
-DR1_CACHE_NAME = CACHE_DIR + 'drTimeDataDR1.parquet'
-DR2_CACHE_NAME = CACHE_DIR + 'drTimeDataDR2.parquet'
+from scripts.blockwise_pca import blockwise_pca
+from scripts.ccpca_worker import ccpca_label, ccpca_worker
+from scripts.cluster_sweep import get_sweep, start_sweep
+from scripts.dr2_model import get_dr2_models
+from scripts.dr_cache import cache_key, get_dr_cache
+from scripts.shared_pool import MAX_WORKERS, run_shared, shared_array
+from scripts.tensor import MetricTensor
+
+DR1_BATCH_BYTES = 256 * 2**20   # memory budget per block of stacked metrics in batched DR1
+DR1_PROCESS_POOL = True         # UMAP/TSNE DR1 across processes instead of a serial loop
+DR1_MAX_WORKERS = None          # None -> one worker per core
+DR1_TASK_TIMEOUT = 600          # seconds per metric before it is dropped
+DR2_PCA_MODE = "auto"           # exact, randomized or incremental; auto -> randomized from PCA_BLOCKWISE_MIN_ROWS nodes
+PCA_BLOCKWISE_MIN_ROWS = 10000
+CCPCA_PROCESS_POOL = True       # per-cluster ccPCA fits across processes
+CCPCA_MAX_WORKERS = None
+CCPCA_TASK_TIMEOUT = 120        # seconds per cluster fit in the pool before it is refit in-process
+CCPCA_POOL_MIN_WORK = 5 * 10**7 # rows x features^2 of one fit below which the pool does not repay itself
+CCPCA_MEMO_SIZE = 256           # (feature matrix, cluster rows) results kept
+
+_ccpca_memo = OrderedDict()
+_ccpca_lock = threading.Lock()
 
 def preprocess(df, value_column):
     return df.loc[:, ['timestamp', 'nodeId', value_column]] \
              .pivot_table(index='timestamp', columns='nodeId', values=value_column) \
              .apply(lambda row: row.fillna(0.0), axis=0).T
 
-def apply_first_dr(df, col_name, method='PCA', clamp_time_window=False):
+def first_dr_scores(baseline, method='PCA'):
+    """1-D embedding of the rows (nodes) of a nodes x time matrix, None if degenerate"""
+    # normalizing the data (demean)
+    mean_hat = baseline.mean(axis=0)
+    demeaned = baseline - mean_hat
+
+    # standardize
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(demeaned)
+
+    if (X_scaled.shape[0] < 2 or np.all(np.isnan(X_scaled)) or np.all(X_scaled == 0)):
+        return None
+
+    # apply PCA
+    if (method == 'PCA'):
+        pca = PCA(n_components=1) # look into n_components in PCA sklearn implementation
+        scores = pca.fit_transform(X_scaled)
+    
+    elif (method == 'UMAP'):
+        umap = UMAP(n_components=1, n_neighbors=15, min_dist=0.1, random_state=42, n_jobs=1)
+        scores = umap.fit_transform(X_scaled)
+    
+    elif (method == "TSNE"):
+        tsne = TSNE(n_components=1, random_state=42, perplexity=min(30, X_scaled.shape[0] - 1))
+        scores = tsne.fit_transform(X_scaled)
+
+    else:
+        raise ValueError(f"Invalid DR1 method: {method}")
+
+    return scores[:, 0]
+
+def apply_first_dr(df, col_name, method='PCA', clamp_time_window=False, tensor=None):
     try:
-        # pivot: rows -> timestamps, columns -> nodeId
-        X = preprocess(df, col_name)
-        X.columns = pd.to_datetime(X.columns)
+        # pivot: rows -> nodeId, columns -> timestamps
+        if tensor is not None:
+            X = tensor.frame(col_name, fill='zero')
+            X.columns = tensor.datetimes
+        else:
+            X = preprocess(df, col_name)
+            X.columns = pd.to_datetime(X.columns)
 
         start_index = int(len(X.columns) * 0.3)
         end_index = int(len(X.columns) * 0.45)
         X_filtered = X.iloc[:, start_index:end_index]
 
         baseline = X_filtered.values if clamp_time_window else X.values
-
-        # normalizing the data (demean)
-        mean_hat = baseline.mean(axis=0)
-        demeaned = baseline - mean_hat
-
-        # standardize
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(demeaned)
-
-        if (X_scaled.shape[0] < 2 or np.all(np.isnan(X_scaled)) or np.all(X_scaled == 0)):
+        scores = first_dr_scores(baseline, method)
+        if scores is None:
             return None
-
-        # apply PCA
-        if (method == 'PCA'):
-            pca = PCA(n_components=1) # look into n_components in PCA sklearn implementation
-            scores = pca.fit_transform(X_scaled)
-        
-        elif (method == 'UMAP'):
-            umap = UMAP(n_components=1, n_neighbors=15, min_dist=0.1, random_state=42, n_jobs=1)
-            scores = umap.fit_transform(X_scaled)
-        
-        elif (method == "TSNE"):
-            tsne = TSNE(n_components=1, random_state=42, perplexity=min(30, X_scaled.shape[0] - 1))
-            scores = tsne.fit_transform(X_scaled)
-
-        else:
-            raise ValueError(f"Invalid DR1 method: {method}")
         
         return pd.DataFrame({
             "Col": col_name,
             "Measurement": X.index,
-            "DR1": scores[:, 0]
+            "DR1": scores
         })
     
     except Exception as e:
         print(f"Error processing {col_name}: {e}")
         return None
 
+def _first_dr_worker(m, method):
+    # runs in a pool process; the metric stack is shared, not pickled
+    return first_dr_scores(shared_array('dr1')[m], method)
+
+def apply_first_dr_pool(tensor, method, max_workers=None, timeout=None):
+    """Non-linear DR1 with one metric per task spread across a process pool"""
+    X = np.stack([tensor.metric(c, fill='zero') for c in tensor.metrics])
+    scores = run_shared(_first_dr_worker, [(m, method) for m in range(len(tensor.metrics))],
+                        {'dr1': X}, max_workers=max_workers, timeout=timeout)
+
+    P_final = [pd.DataFrame({"Col": col, "Measurement": tensor.node_ids, "DR1": s})
+               for col, s in zip(tensor.metrics, scores) if s is not None]
+    return pd.concat(P_final, ignore_index=True) if P_final else pd.DataFrame()
+
+def standardize_stack(X):
+    """The demean + StandardScaler steps of apply_first_dr on a (metrics, nodes, time) stack"""
+    Z = X - X.mean(axis=1, keepdims=True)
+    Z -= Z.mean(axis=1, keepdims=True)
+    std = Z.std(axis=1, keepdims=True)
+    std[std == 0] = 1.0
+    Z /= std
+    return Z
+
+def batched_first_pc(Z):
+    """
+    First principal component scores of every (nodes x time) matrix in a (metrics, nodes, time)
+    stack. One batched eigh of the Gram (or covariance) matrices, whichever side is smaller.
+    """
+    M, N, T = Z.shape
+    if N <= T:
+        w, U = np.linalg.eigh(Z @ Z.transpose(0, 2, 1))
+        u = U[:, :, -1]
+        scores = u * np.sqrt(np.clip(w[:, -1], 0, None))[:, None]
+        v = np.einsum('mnt,mn->mt', Z, u)
+    else:
+        w, V = np.linalg.eigh(Z.transpose(0, 2, 1) @ Z)
+        v = V[:, :, -1]
+        scores = np.einsum('mnt,mt->mn', Z, v)
+
+    # same sign convention as sklearn's PCA: largest absolute loading is positive
+    sign = np.sign(v[np.arange(M), np.argmax(np.abs(v), axis=1)])
+    sign[sign == 0] = 1
+    return scores * sign[:, None]
+
+def apply_first_dr_batched(tensor, clamp_time_window=False):
+    """PCA DR1 for all metrics of the tensor in blocks of stacked matrices instead of one fit per metric"""
+    n_nodes, n_times = len(tensor.node_ids), len(tensor.timestamps)
+    if n_nodes < 2:
+        return pd.DataFrame()
+    t_lo, t_hi = (int(n_times * 0.3), int(n_times * 0.45)) if clamp_time_window else (0, n_times)
+
+    per_metric = 8 * (n_nodes * (t_hi - t_lo) + min(n_nodes, t_hi - t_lo) ** 2)
+    block = max(1, DR1_BATCH_BYTES // max(per_metric, 1))
+    P_final = []
+    for b in range(0, len(tensor.metrics), block):
+        cols = tensor.metrics[b:b + block]
+        X = np.stack([tensor.metric(c, fill='zero')[:, t_lo:t_hi] for c in cols]).astype(np.float64, copy=False)
+        Z = standardize_stack(X)
+
+        # same checks as apply_first_dr: skip all-zero / non-finite metrics
+        valid = np.isfinite(Z).all(axis=(1, 2)) & (Z != 0).any(axis=(1, 2))
+        if not valid.any():
+            continue
+        scores = batched_first_pc(Z[valid])
+        for col, s in zip([c for c, ok in zip(cols, valid) if ok], scores):
+            P_final.append(pd.DataFrame({
+                "Col": col,
+                "Measurement": tensor.node_ids,
+                "DR1": s
+            }))
+
+    return pd.concat(P_final, ignore_index=True) if P_final else pd.DataFrame()
+
 def get_numeric_columns(df):
     return df.drop(columns=['timestamp', 'nodeId']).columns
 
-def apply_dr_parallel(df, method="PCA"):
+def apply_dr_parallel(df, method="PCA", tensor=None):
     print(f"Applying DR1 using {method}")
     P_final = []
 
-    numeric_cols = get_numeric_columns(df)
+    # one pivot for all metrics instead of one per metric
+    if tensor is None:
+        tensor = MetricTensor.from_frame(df)
+    numeric_cols = tensor.metrics
+
+    if method == "PCA":
+        return apply_first_dr_batched(tensor)
+    if DR1_PROCESS_POOL:
+        return apply_first_dr_pool(tensor, method, max_workers=DR1_MAX_WORKERS, timeout=DR1_TASK_TIMEOUT)
 
     def process_single_column(col_name):
-        r_df = apply_first_dr(df, col_name, method=method)
+        r_df = apply_first_dr(df, col_name, method=method, tensor=tensor)
         if r_df is not None:
             P_final.append(r_df)
 
-    if method in ("UMAP", "TSNE"):
-        for col in numeric_cols:
-            process_single_column(col)
-    else:
-        with ThreadPoolExecutor() as executor:
-            executor.map(process_single_column, numeric_cols)
+    for col in numeric_cols:
+        process_single_column(col)
 
     return pd.concat(P_final, ignore_index=True) if P_final else pd.DataFrame()
 
+def dr2_pca_mode(n_rows):
+    if DR2_PCA_MODE == "auto":
+        return "randomized" if n_rows >= PCA_BLOCKWISE_MIN_ROWS else "exact"
+    return DR2_PCA_MODE
+
 def apply_pca(df, n_components=2):
     print('Applying DR2 PCA')
-    X = df.copy(deep=True)
+    mode = dr2_pca_mode(len(df))
 
     try:
-        baseline = X.values
-
-        # normalizing the data (demean)
-        mean_hat = baseline.mean(axis=0)
-        demeaned = baseline - mean_hat
-
-        # standardize
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(demeaned)
-
-        # apply PCA
-        pca = PCA(n_components=n_components)
-        scores = pca.fit_transform(X_scaled)  
+        if mode == "exact":
+            X = df.copy(deep=True)
+            baseline = X.values
+
+            # normalizing the data (demean)
+            mean_hat = baseline.mean(axis=0)
+            demeaned = baseline - mean_hat
+
+            # standardize
+            scaler = StandardScaler()
+            X_scaled = scaler.fit_transform(demeaned)
+
+            # apply PCA
+            pca = PCA(n_components=n_components)
+            scores = pca.fit_transform(X_scaled)  
+            explained = pca.explained_variance_ratio_
+        else:
+            # standardized PCA over row blocks, no full-size temporaries
+            scores, explained = blockwise_pca(df.values, n_components, standardize=True, method=mode)
+        print(f'DR2 PCA ({mode}) explained variance ratio: {np.round(explained, 4).tolist()}')
 
         P_fin = pd.DataFrame({f"PC{k+1}": scores[:, k] if k < n_components else np.nan for k in range(n_components)})
-        P_fin['Measurement'] = X.index
+        P_fin['Measurement'] = df.index
         P_fin.set_index('Measurement', inplace=True)
+        P_fin.attrs['explained_variance_ratio'] = [float(r) for r in explained]
 
         return P_fin # return df with rows = node IDs, cols PC1, PC2, nodeId, measurement index
 
@@ -138,26 +258,32 @@ def apply_tsne(df):
     embedding = tsne.fit_transform(df_tsne)
     return embedding[:, 0], embedding[:, 1] # columns 'tSNE1', 'tSNE2'
 
-def apply_second_dr(df, method, n_neighbors=15, min_dist=0.1):
+def apply_second_dr(df, method, n_neighbors=15, min_dist=0.1, incremental=False, version=None):
+    """
+    incremental: streaming update, UMAP only transforms changed nodes (see scripts/dr2_model.py)
+    version: dataset version the fitted UMAP is kept under
+    """
     print('Applying DR2 using:', method)
     df_pivot = df.pivot(index="Measurement", columns="Col", values="DR1")
     X = df_pivot.values
 
+    explained = None
     if (method == "PCA"):
-        pca = PCA(n_components=2, random_state=42)
-        emb = pca.fit_transform(X)
+        mode = dr2_pca_mode(len(X))
+        if mode == "exact":
+            pca = PCA(n_components=2, random_state=42)
+            emb = pca.fit_transform(X)
+            explained = pca.explained_variance_ratio_
+        else:
+            emb, explained = blockwise_pca(X, 2, method=mode)
+        print(f'DR2 PCA ({mode}) explained variance ratio: {np.round(explained, 4).tolist()}')
         
     elif (method == "UMAP"): 
         # old
         # umap1, umap2 = apply_umap(df_pivot, n_neighbors=n_neighbors, min_dist=min_dist)
         
-        umap = UMAP(
-            n_components=2,
-            n_neighbors=n_neighbors,
-            min_dist=min_dist,
-            random_state=42
-        )
-        emb = umap.fit_transform(X)
+        # fitted reducers are kept per parameter set
+        emb = get_dr2_models().embed(df_pivot, n_neighbors, min_dist, incremental=incremental, version=version)
 
     elif (method == "TSNE"):
         tsne = TSNE(
@@ -171,16 +297,20 @@ def apply_second_dr(df, method, n_neighbors=15, min_dist=0.1):
         raise ValueError(f"Invalid DR2 method: {method}")
 
     # append DR results to df
-    return df_pivot.assign(
+    out = df_pivot.assign(
         E1=emb[:, 0],
         E2=emb[:, 1]
     )
+    if explained is not None:
+        out.attrs['explained_variance_ratio'] = [float(r) for r in explained]
+    return out
 
 def id_clusters_w_kmeans(df_pivot, k):
     X = df_pivot[['E1', 'E2']]
     kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
     df_pivot['Cluster'] = kmeans.fit_predict(X)
     df_pivot['nodeId'] = df_pivot.index
+    return kmeans
 
 def get_feat_contributions(df):
     excluded_columns = ["E1", "E2", "nodeId", "Cluster"]
@@ -199,17 +329,41 @@ def get_feat_contributions(df):
     feat_contrib_mat = np.zeros((n_feats, n_labels))
 
     # 1. get the scaled feature contributions and first cPC for each label
-    ccpca = CCPCA(n_components=1)
+    # (memoized per feature matrix and target rows, only changed clusters are refit)
+    X = np.ascontiguousarray(X)
+    x_hash = hashlib.sha1(str(X.shape).encode() + X.tobytes()).hexdigest()
+    keys, missing, found = [], [], {}
     for i, target_label in enumerate(unique_labels):
-        ccpca.fit(
-            X[y == target_label],
-            X[y != target_label],
-            var_thres_ratio=0.5,
-            n_alphas=40,
-            max_log_alpha=0.5)
-
-        first_cpc_mat[:, i] = ccpca.get_first_component()
-        feat_contrib_mat[:, i] = ccpca.get_scaled_feat_contribs()
+        rows = np.flatnonzero(y == target_label)
+        key = (x_hash, hashlib.sha1(rows.tobytes()).hexdigest())
+        keys.append(key)
+        with _ccpca_lock:
+            cached = _ccpca_memo.get(key)
+        if cached is None:
+            missing.append((i, rows))
+        else:
+            found[key] = cached
+
+    if missing:
+        # every fit contrasts one cluster against all other rows
+        fit_work = X.shape[0] * n_feats ** 2
+        if CCPCA_PROCESS_POOL and len(missing) > 1 and MAX_WORKERS > 1 and fit_work >= CCPCA_POOL_MIN_WORK:
+            results = run_shared(ccpca_worker, [(rows,) for _, rows in missing], {'ccpca_X': X},
+                                 max_workers=CCPCA_MAX_WORKERS, timeout=CCPCA_TASK_TIMEOUT)
+        else:
+            results = [None] * len(missing)
+        for (i, rows), result in zip(missing, results):
+            # fits the pool did not return (timed out or failed) are done here
+            found[keys[i]] = ccpca_label(X, rows) if result is None else result
+
+    with _ccpca_lock:
+        for i, key in enumerate(keys):
+            result = found[key]
+            _ccpca_memo[key] = result
+            _ccpca_memo.move_to_end(key)
+            first_cpc_mat[:, i], feat_contrib_mat[:, i] = result
+        while len(_ccpca_memo) > CCPCA_MEMO_SIZE:
+            _ccpca_memo.popitem(last=False)
 
     # 2. apply optimal sign flipping
     OptSignFlip().opt_sign_flip(first_cpc_mat, feat_contrib_mat)
@@ -226,44 +380,80 @@ def get_feat_contributions(df):
                                                                             agg_method='abs_max')
     return agg_feat_contrib_mat, label_to_rows, label_to_rep_row, order_col
 
-def get_cached_or_compute_dr1(df, method="PCA", force_recompute=False):
-    if os.path.exists(DR1_CACHE_NAME) and not force_recompute:
-        # Read cached DR1 results
-        # print('Reading cached DR1 results from parquet')
-        return pd.read_parquet(DR1_CACHE_NAME)
+def _dr_columns(df, tensor=None):
+    if tensor is not None:
+        return list(tensor.metrics)
+    return [c for c in df.columns if c not in ['timestamp', 'nodeId']]
+
+def get_cached_or_compute_dr1(df, method="PCA", force_recompute=False, tensor=None, version=None):
+    """DR1 results cached per (dataset version, columns, method); version=None skips the cache"""
+    key = None if version is None else cache_key(version, _dr_columns(df, tensor), method)
+    if key is not None and not force_recompute:
+        DR1_d = get_dr_cache().get(key)
+        if DR1_d is not None:
+            return DR1_d
     
-    DR1_d = apply_dr_parallel(df, method)
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    DR1_d.to_parquet(DR1_CACHE_NAME)
-    # print(f'Cached DR1 results to parquet {DR1_CACHE_NAME}.')
+    DR1_d = apply_dr_parallel(df, method, tensor=tensor)
+    if key is not None:
+        get_dr_cache().put(key, DR1_d, kind="DR1", version=version, method=method)
     return DR1_d
 
-def get_cached_or_compute_dr2(df, n_neighbors, min_dist, method="UMAP", force_recompute=False):
-    if os.path.exists(DR2_CACHE_NAME) and not force_recompute:
-        # Read cached DR2 results
-        print('Reading cached DR2 results from parquet')
-        return pd.read_parquet(DR2_CACHE_NAME)
+def _dr2_key(df, n_neighbors, min_dist, method="UMAP", incremental=False, version=None, dr1_method="PCA"):
+    if version is None:
+        return None
+    params = {"n_neighbors": n_neighbors, "min_dist": min_dist, "dr1": dr1_method, "incremental": incremental}
+    return cache_key(version, df['Col'].unique().tolist(), method, params)
+
+def get_cached_or_compute_dr2(df, n_neighbors, min_dist, method="UMAP", force_recompute=False, incremental=False,
+                              version=None, dr1_method="PCA"):
+    """DR2 results cached per (dataset version, columns, method, parameters, DR1 source)"""
+    key = _dr2_key(df, n_neighbors, min_dist, method, incremental, version, dr1_method)
+    if key is not None and not force_recompute:
+        DR2_d = get_dr_cache().get(key)
+        if DR2_d is not None:
+            print('Reading cached DR2 results from parquet')
+            return DR2_d
     
-    DR2_d = apply_second_dr(df, method, n_neighbors=n_neighbors, min_dist=min_dist)
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    DR2_d.to_parquet(DR2_CACHE_NAME)
-    # print(f'Cached DR2 results to parquet {DR2_CACHE_NAME}.')
+    DR2_d = apply_second_dr(df, method, n_neighbors=n_neighbors, min_dist=min_dist, incremental=incremental,
+                            version=version)
+    if key is not None:
+        get_dr_cache().put(key, DR2_d, kind="DR2", version=version, method=method)
     return DR2_d
 
-def get_dr_time(df, n_neighbors, min_dist, num_clusters, force_recompute_dr1=1):
+def get_dr_time(df, n_neighbors, min_dist, num_clusters, force_recompute_dr1=1, tensor=None, dr1=None, incremental=False,
+                version=None):
+    """
+    dr1: DR1 results computed elsewhere (e.g. the incremental streaming model), skips the DR1 fit
+    incremental: streaming update, DR2 reuses the fitted reducer for changed nodes
+    version: dataset version the results are cached under (see scripts/dr_cache.py)
+    """
     recompute_dr1 = True if force_recompute_dr1 == 1 else False
     recompute_dr2 = True if force_recompute_dr1 == 1 else False
     # First pass DR across Timestamps
     dr1start = timer()
-    DR1_d = get_cached_or_compute_dr1(df, method="PCA", force_recompute=recompute_dr1)
+    if dr1 is None:
+        DR1_d = get_cached_or_compute_dr1(df, method="PCA", force_recompute=recompute_dr1, tensor=tensor, version=version)
+    else:
+        DR1_d = dr1
     dr1end = timer()
     # Second pass DR across Features
     dr2start = timer()
-    DR2_d = get_cached_or_compute_dr2(DR1_d, n_neighbors, min_dist, method="UMAP", force_recompute=recompute_dr2)
+    dr1_method = "PCA" if dr1 is None else "PCA-incremental"
+    DR2_d = get_cached_or_compute_dr2(DR1_d, n_neighbors, min_dist, method="UMAP", force_recompute=recompute_dr2,
+                                      incremental=incremental, version=version, dr1_method=dr1_method)
     dr2end = timer()
     # Use kMeans to get cluster IDs
     kmeansStart = timer()
-    id_clusters_w_kmeans(DR2_d, num_clusters)
+    key = _dr2_key(DR1_d, n_neighbors, min_dist, "UMAP", incremental, version, dr1_method)
+    sweep = None if key is None or recompute_dr2 else get_sweep(key)
+    if sweep is not None:
+        DR2_d = sweep.frame(num_clusters)
+    else:
+        kmeans = id_clusters_w_kmeans(DR2_d, num_clusters)
+        if key is not None:
+            # clusterings for the other k are prepared in the background (scripts/cluster_sweep.py)
+            start_sweep(key, DR2_d, get_feat_contributions,
+                        seed=(num_clusters, DR2_d['Cluster'].to_numpy(), kmeans.cluster_centers_, kmeans.inertia_))
     kmeansEnd = timer()
     print(f'DR1 in {(dr1end - dr1start)}s')
     print(f'DR2 in {(dr2end - dr2start)}s')
@@ -271,26 +461,38 @@ def get_dr_time(df, n_neighbors, min_dist, num_clusters, force_recompute_dr1=1):
     print(f'Returning {len(DR2_d)} rows')
     return DR2_d
 
-def recompute_clusters(df, num_clusters, n_neighbors, min_dist, force_recompute=0):
-    if (force_recompute == 1):
-        DR1_d = get_cached_or_compute_dr1(df)
-        DR2_d = apply_second_dr(DR1_d, "UMAP", n_neighbors, min_dist)
-        DR2_d.to_parquet(CACHE_DIR + DR2_CACHE_NAME)
-    else:
-        DR2_d = pd.read_parquet(CACHE_DIR + DR2_CACHE_NAME)
+def _get_or_start_sweep(df, n_neighbors, min_dist, force_recompute=0, tensor=None, version=None):
+    """Clustering sweep of the DR2 result for these parameters; None without a dataset version"""
+    # a cache miss computes DR2 (and DR1 if needed) for these parameters
+    DR1_d = get_cached_or_compute_dr1(df, tensor=tensor, version=version)
+    key = _dr2_key(DR1_d, n_neighbors, min_dist, version=version)
+    sweep = None if key is None or force_recompute == 1 else get_sweep(key)
+    if sweep is None:
+        DR2_d = get_cached_or_compute_dr2(DR1_d, n_neighbors, min_dist, method="UMAP", force_recompute=force_recompute == 1,
+                                          version=version)
+        if key is None:
+            return DR2_d, None
+        sweep = start_sweep(key, DR2_d, get_feat_contributions)
+    return None, sweep
+
+def recompute_clusters(df, num_clusters, n_neighbors, min_dist, force_recompute=0, tensor=None, version=None):
+    DR2_d, sweep = _get_or_start_sweep(df, n_neighbors, min_dist, force_recompute, tensor, version)
 
     kmeans_start = timer()
-    if not os.path.exists(CACHE_DIR + DR2_CACHE_NAME):
-        print("No cached DR2 results.")
-        return None
-    
-    id_clusters_w_kmeans(DR2_d, num_clusters)
+    if sweep is not None:
+        # lookup into the precomputed sweep
+        DR2_d = sweep.frame(num_clusters)
+    else:
+        id_clusters_w_kmeans(DR2_d, num_clusters)
     kmeans_end = timer()
     print(f'Recomputed cluster IDs for new k={num_clusters} with cached DR2 results in {kmeans_end - kmeans_start}')
 
     print(f'Recomputing feature contributions for new k={num_clusters} clusters.')
     fc_start = timer()
-    agg_feat_contrib_mat, label_to_rows, label_to_rep_row, order_col, = get_feat_contributions(DR2_d)
+    if sweep is not None:
+        agg_feat_contrib_mat, label_to_rows, label_to_rep_row, order_col = sweep.contributions(num_clusters)
+    else:
+        agg_feat_contrib_mat, label_to_rows, label_to_rep_row, order_col, = get_feat_contributions(DR2_d)
     fc_end = timer()
     print(f'Recomputed feature contributions for new k={num_clusters} clusters with cached DR2 results in {fc_end - fc_start}')
 
@@ -303,4 +505,12 @@ def recompute_clusters(df, num_clusters, n_neighbors, min_dist, force_recompute=
             "label_to_rep_row": label_to_rep_row,
             "order_col": order_col
         },
+        "sweep": sweep.scores() if sweep is not None else [],
     }
+
+def cluster_sweep_scores(df, n_neighbors, min_dist, tensor=None, version=None):
+    """inertia/silhouette per k for the DR2 result of these parameters (as far as the sweep got)"""
+    _, sweep = _get_or_start_sweep(df, n_neighbors, min_dist, tensor=tensor, version=version)
+    if sweep is None:
+        return {"done": False, "scores": []}
+    return {"done": sweep.done, "scores": sweep.scores()}
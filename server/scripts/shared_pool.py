@@ -0,0 +1,175 @@
+"""Process pool kept for the process lifetime whose workers read their input arrays from shared memory"""
+import atexit
+import importlib
+import multiprocessing as mp
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+MAX_WORKERS = os.cpu_count() or 1
+POLL_SECS = 0.05
+POOL_MIN_TASKS = 3  # fewer tasks run in the calling process, the pool would not repay the round trips
+WORKER_MODULES = ('scripts.mrdmd_worker', 'scripts.ccpca_worker')  # task modules imported when a worker starts
+
+_attached = {}  # worker side: name -> (SharedMemory, ndarray view)
+_local = threading.local()  # calling side: name -> ndarray while tasks run in-process
+
+def _init(modules):
+    # one BLAS thread per worker, the pool itself provides the parallelism
+    threadpool_limits(1)
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            # its tasks fail (and are reported) when they run, the worker stays usable for the others
+            print(f"Pool worker could not import {name}: {e}")
+
+def _attach(specs):
+    for name, (shm_name, shape, dtype) in specs.items():
+        if name in _attached and _attached[name][0].name == shm_name:
+            continue
+        if name in _attached:
+            # block of an earlier run_shared call, already unlinked by the parent
+            old, _ = _attached.pop(name)
+            try:
+                old.close()
+            except BufferError:
+                pass
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _attached[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+def _call(specs, func, args):
+    _attach(specs)
+    return func(*args)
+
+def shared_array(name):
+    """Read-only view of an array published by run_shared, in a worker or in-process"""
+    arrays = getattr(_local, 'arrays', None)
+    if arrays is not None and name in arrays:
+        return arrays[name]
+    return _attached[name][1]
+
+class SharedArrays():
+    """Copies arrays into shared memory once; unlinked on exit"""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.blocks = []
+        self.specs = {}
+
+    def __enter__(self):
+        for name, arr in self.arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            self.blocks.append(shm)
+            self.specs[name] = (shm.name, arr.shape, arr.dtype.str)
+        return self.specs
+
+    def __exit__(self, *exc):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = mp.get_context('spawn').Pool(MAX_WORKERS, initializer=_init, initargs=(WORKER_MODULES,))
+        return _pool
+
+def start_pool():
+    """Starts the pool ahead of the first run_shared call; workers boot in the background"""
+    if MAX_WORKERS > 1:
+        _get_pool()
+
+def _discard_pool(pool):
+    # a hung task cannot be interrupted on its own: the pool is replaced, other callers
+    # notice it is gone and resubmit what they had in flight
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    pool.terminate()
+    pool.join()
+
+@atexit.register
+def _shutdown():
+    if _pool is not None:
+        _discard_pool(_pool)
+
+def _run_local(func, tasks, arrays):
+    _local.arrays = arrays
+    try:
+        results = []
+        for task in tasks:
+            try:
+                results.append(func(*task))
+            except Exception as e:
+                print(f"Task {task} failed: {e}")
+                results.append(None)
+        return results
+    finally:
+        _local.arrays = None
+
+def run_shared(func, tasks, arrays, max_workers=None, timeout=None, min_tasks=POOL_MIN_TASKS):
+    """
+    Runs func(*task) for every task in the process-wide spawn pool. Workers attach
+    `arrays` (name -> ndarray) from shared memory instead of receiving pickled copies
+    and look them up with shared_array(name). At most max_workers tasks of this call are
+    in flight. Results are returned in task order; a task that raises or runs longer than
+    timeout seconds yields None, and the pool is replaced for the tasks still pending.
+    With fewer than min_tasks tasks, or a single worker, everything runs in the calling
+    process (no timeout applies there).
+    The pool is started once. As in any spawn pool, its workers import the parent's
+    __main__ as __mp_main__ (server.py keeps its startup under `if __name__ == '__main__'`),
+    then the initializer imports WORKER_MODULES; other task modules are imported the
+    first time a worker runs one of their functions.
+    """
+    results = [None] * len(tasks)
+    if not tasks:
+        return results
+    n_workers = max(1, min(max_workers or MAX_WORKERS, MAX_WORKERS, len(tasks)))
+    if n_workers < 2 or len(tasks) < min_tasks:
+        return _run_local(func, tasks, arrays)
+    pending = list(range(len(tasks)))
+
+    with SharedArrays(arrays) as specs:
+        while pending:
+            pool = _get_pool()
+            inflight = {}
+            lost = False
+            while (pending or inflight) and not lost:
+                while pending and len(inflight) < n_workers:
+                    i = pending.pop(0)
+                    try:
+                        inflight[i] = (pool.apply_async(_call, (specs, func, tasks[i])), time.monotonic())
+                    except ValueError:      # pool replaced by another caller meanwhile
+                        pending.insert(0, i)
+                        lost = True
+                        break
+                time.sleep(POLL_SECS)
+                for i, (res, started) in list(inflight.items()):
+                    if res.ready():
+                        del inflight[i]
+                        try:
+                            results[i] = res.get()
+                        except Exception as e:
+                            print(f"Task {tasks[i]} failed: {e}")
+                    elif timeout is not None and time.monotonic() - started > timeout:
+                        del inflight[i]
+                        print(f"Task {tasks[i]} timed out after {timeout}s")
+                        _discard_pool(pool)
+                        lost = True
+                lost = lost or _pool is not pool
+            # tasks still running when the pool went away are retried
+            pending = list(inflight) + pending
+    return results
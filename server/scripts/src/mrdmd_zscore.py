@@ -3,16 +3,202 @@ import numpy as np
 import matplotlib.pyplot as plt
 from numpy import dot, multiply, diag, power
 from numpy import pi, exp, sin, cos
-from numpy.linalg import inv, eig, pinv, solve
+from numpy.linalg import inv, eig, pinv, solve, qr
 from scipy.linalg import svd, svdvals
 from math import floor, ceil # python 3.x
+from functools import lru_cache
 from joblib import Parallel, delayed
 import itertools
 
+class ModeNode():
+    '''One time bin of the mrDMD tree'''
+    __slots__ = ('level', 'bin_num', 'bin_size', 'start', 'stop', 'step', 'rho', 'r', 'n',
+                 'mu', 'Phi', 'Psi', 'b_opt')
+
+
+class ModeTree():
+    '''
+    Compact mrDMD tree: one array entry per bin (level, bin_num, bin_size, start, stop,
+    step, rho, r, n) and the modes of bin i in columns offsets[i]:offsets[i+1] of one
+    contiguous mu / Phi / b_opt. Psi is optional (compute_zscore only needs mu, Phi and
+    step); when kept it is stored flat, bin i at psi_offsets[i]:psi_offsets[i+1].
+    Saved to / loaded from a single .npz.
+    '''
+    INT_FIELDS = ('level', 'bin_num', 'bin_size', 'start', 'stop', 'step', 'r', 'n')
+    __slots__ = INT_FIELDS + ('rho', 'offsets', 'mu', 'Phi', 'b_opt', 'Psi', 'psi_offsets')
+
+    def __init__(self, arrays):
+        for name in self.__slots__:
+            setattr(self, name, arrays.get(name))
+
+    @classmethod
+    def from_nodes(cls, nodes, n_rows, keep_psi=True):
+        arrays = {f: np.array([getattr(nd, f) for nd in nodes], dtype=np.int64) for f in cls.INT_FIELDS}
+        arrays['rho'] = np.array([nd.rho for nd in nodes], dtype=float)
+        arrays['offsets'] = np.concatenate([[0], np.cumsum(arrays['n'])]).astype(np.int64)
+        arrays['mu'] = np.concatenate([np.asarray(nd.mu, dtype=complex) for nd in nodes]) if nodes else np.zeros(0, dtype=complex)
+        arrays['b_opt'] = np.concatenate([np.asarray(nd.b_opt, dtype=complex).ravel() for nd in nodes]) if nodes else np.zeros(0, dtype=complex)
+        arrays['Phi'] = np.ascontiguousarray(np.hstack([nd.Phi for nd in nodes]), dtype=complex) if nodes \
+                            else np.zeros([n_rows, 0], dtype=complex)
+        if keep_psi:
+            arrays['Psi'] = np.concatenate([np.asarray(nd.Psi, dtype=complex).ravel() for nd in nodes]) if nodes \
+                                else np.zeros(0, dtype=complex)
+            arrays['psi_offsets'] = np.concatenate([[0], np.cumsum(arrays['n'] * arrays['bin_size'])]).astype(np.int64)
+        return cls(arrays)
+
+    def __len__(self):
+        return len(self.level)
+
+    @property
+    def n_modes(self):
+        return len(self.mu)
+
+    def mode_mask(self, bins):
+        # boolean mask over the modes of the selected bins (boolean mask over bins)
+        return np.repeat(bins, self.n)
+
+    def mode_steps(self):
+        return np.repeat(self.step, self.n)
+
+    def node(self, i):
+        nd = ModeNode()
+        for f in self.INT_FIELDS:
+            setattr(nd, f, int(getattr(self, f)[i]))
+        nd.rho = float(self.rho[i])
+        modes = slice(self.offsets[i], self.offsets[i+1])
+        nd.mu, nd.Phi, nd.b_opt = self.mu[modes], self.Phi[:, modes], self.b_opt[modes]
+        nd.Psi = None if self.Psi is None else \
+            self.Psi[self.psi_offsets[i]:self.psi_offsets[i+1]].reshape(nd.n, nd.bin_size)
+        return nd
+
+    def nodes(self):
+        return [self.node(i) for i in range(len(self))]
+
+    def save(self, path):
+        np.savez(path, **{name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls({name: f[name] for name in f.files})
+
+
+@lru_cache(maxsize=32)
+def segment_grid(n_time, max_levels):
+    '''(level, start, stop) of every dyadic segment of [0, n_time), levels 0..max_levels, split like mrdmd()'''
+    segments = [np.array([[0, 0, n_time]], dtype=np.int64)]
+    for level in range(1, max_levels + 1):
+        start, stop = segments[-1][:, 1], segments[-1][:, 2]
+        split = start + (stop - start + 1) // 2
+        segments.append(np.stack([np.full(2*len(start), level), np.column_stack([start, split]).ravel(),
+                                  np.column_stack([split, stop]).ravel()], axis=1))
+    grid = np.concatenate(segments)
+    grid = grid[grid[:, 2] > grid[:, 1]]    # bins too short to split leave an empty half
+    grid.flags.writeable = False
+    return grid
+
+
 class MrDMDZscore():
     '''
     Code modified from https://humaticlabs.com/blog/mrdmd-python/
+
+    svd_backend selects how each recursion node decomposes its snapshots:
+      'exact'      -> svdvals of the subsampled bin for SVHT, then a full svd of X (original)
+      'qr'         -> one QR of the subsampled bin: the svd of its R factor gives the SVHT
+                      threshold, the svd of R without its last column gives the svd of X
+      'randomized' -> SVHT as for 'qr', then a rank-r randomized svd of X with oversampling
+
+    engine selects how mrdmd() walks the tree:
+      'recursive' -> depth-first, one bin at a time (original)
+      'levels'    -> one level at a time, equally sized bins decomposed as one stack
     '''
+    SVD_BACKENDS = ('exact', 'qr', 'randomized')
+    ENGINES = ('recursive', 'levels')
+
+    def __init__(self, svd_backend='exact', engine='recursive', oversamples=10, power_iters=2, random_state=42):
+        if svd_backend not in self.SVD_BACKENDS:
+            raise ValueError(f"Invalid SVD backend: {svd_backend}")
+        if engine not in self.ENGINES:
+            raise ValueError(f"Invalid mrDMD engine: {engine}")
+        self.svd_backend = svd_backend
+        self.engine = engine
+        self.oversamples = oversamples
+        self.power_iters = power_iters
+        self.random_state = random_state
+
+    def qr_factor(self, _D):
+        # R factor of _D = Q R (stacks too); X = _D[...,:-1] = Q R[...,:-1], so the svds of
+        # _D and of X are taken on the small R instead of the bin, without squaring it
+        if _D.shape[-2] <= _D.shape[-1]:
+            return None, _D
+        return np.linalg.qr(_D)
+
+    def qr_svd(self, Q, R):
+        # X = U S Vh from the svd of its R factor
+        U, sv, Vh = np.linalg.svd(R[..., :-1], full_matrices=False)
+        return (U if Q is None else Q @ U), sv, Vh
+
+    def randomized_svd(self, X, rank):
+        # Halko et al. range finder with oversampling and power iterations
+        k = min(rank + self.oversamples, *X.shape)
+        rng = np.random.default_rng(self.random_state)
+        Q, _ = qr(dot(X, rng.standard_normal((X.shape[1], k))))
+        for _ in range(self.power_iters):
+            Q, _ = qr(dot(X.conj().T, Q))
+            Q, _ = qr(dot(X, Q))
+        Ub, sv, Vh = svd(dot(Q.conj().T, X), False)
+        return dot(Q, Ub)[:, :rank], sv[:rank], Vh[:rank]
+
+    def decompose(self, _D, do_svht=True):
+        # rank r and the (U, S, Vh) of X = _D[:,:-1] truncated to it
+        X = _D[:, :-1]
+        Q, R = self.qr_factor(_D)
+        if do_svht:
+            _sv = svdvals(R)
+            r = sum(_sv > self.svht(_D, sv=_sv))
+        else:
+            r = min(X.shape)
+        if r == 0:
+            return 0, None
+        if self.svd_backend == 'randomized':
+            return r, self.randomized_svd(X, r)
+        U, sv, Vh = self.qr_svd(Q, R)
+        r = min(r, len(sv))
+        return r, (U[:, :r], sv[:r], Vh[:r])
+
+    def batch_decompose(self, _D, do_svht=True):
+        # decompose() for a stack of equally sized bins (bins x rows x cols): the svht rank
+        # of each bin, the rank usable for its X and the zero-padded (U, S, Vh) of X
+        B = len(_D)
+        X = _D[:, :, :-1]
+        if self.svd_backend == 'randomized':
+            parts = [self.decompose(d, do_svht) for d in _D]
+            r = np.array([p[0] for p in parts], dtype=int)
+            usable = np.array([0 if p[1] is None else len(p[1][1]) for p in parts], dtype=int)
+            k = int(usable.max())
+            U = np.zeros((B, X.shape[1], k), dtype=X.dtype)
+            sv = np.zeros((B, k))
+            Vh = np.zeros((B, k, X.shape[2]), dtype=X.dtype)
+            for b, (_, usv) in enumerate(parts):
+                if usv is not None:
+                    U[b, :, :usable[b]], sv[b, :usable[b]], Vh[b, :usable[b]] = usv
+            return r, usable, (U, sv, Vh)
+
+        if self.svd_backend == 'exact':
+            _sv = np.linalg.svd(_D, compute_uv=False) if do_svht else None
+            U, sv, Vh = np.linalg.svd(X, full_matrices=False)
+            usable = np.full(B, sv.shape[1])
+        else:
+            Q, R = self.qr_factor(_D)
+            _sv = np.linalg.svd(R, compute_uv=False) if do_svht else None
+            U, sv, Vh = self.qr_svd(Q, R)
+            usable = np.full(B, sv.shape[1])
+
+        if do_svht:
+            r = (_sv > np.atleast_1d(self.svht(_D[0], sv=_sv))[:, None]).sum(axis=1)
+        else:
+            r = np.full(B, min(X.shape[1:]))
+        return r, np.minimum(r, usable), (U, sv, Vh)
 
     def svht(self, X, sv=None):
         # svht for sigma unknown
@@ -22,15 +208,15 @@ class MrDMDZscore():
             sv = svdvals(X)
         sv = np.squeeze(sv)
         omega_approx = 0.56 * beta**3 - 0.95 * beta**2 + 1.82 * beta + 1.43
-        return np.median(sv) * omega_approx
+        return np.median(sv, axis=-1) * omega_approx
     
-    def dmd(self, X, Y, truncate=None):
+    def dmd(self, X, Y, truncate=None, usv=None):
         if truncate == 0:
             # return empty vectors
             mu = np.array([], dtype='complex')
             Phi = np.zeros([X.shape[0], 0], dtype='complex')
         else:
-            U2,Sig2,Vh2 = svd(X, False) # SVD of input matrix
+            U2,Sig2,Vh2 = svd(X, False) if usv is None else usv # SVD of input matrix
             r = len(Sig2) if truncate is None else truncate # rank truncation
             U = U2[:,:r]
             Sig = diag(Sig2)[:r,:r]
@@ -41,6 +227,8 @@ class MrDMDZscore():
         return mu, Phi
     
     def mrdmd(self, D, level=0, bin_num=0, offset=0, max_levels=7, max_cycles=2, do_svht=True, do_parallel=False):
+        if self.engine == 'levels' and level == 0:
+            return self.mrdmd_levels(D, max_levels=max_levels, max_cycles=max_cycles, do_svht=do_svht)
        
         # 4 times nyquist limit to capture cycles
         nyq = 8 * max_cycles
@@ -56,16 +244,21 @@ class MrDMDZscore():
         X = _D[:,:-1]
         Y = _D[:,1:]
     
-        # determine rank-reduction
-        if do_svht:
-            _sv = svdvals(_D)
-            tau = self.svht(_D, sv=_sv)
-            r = sum(_sv > tau)
+        if self.svd_backend == 'exact':
+            # determine rank-reduction
+            if do_svht:
+                _sv = svdvals(_D)
+                tau = self.svht(_D, sv=_sv)
+                r = sum(_sv > tau)
+            else:
+                r = min(X.shape)
+        
+            # compute dmd
+            mu,Phi = self.dmd(X, Y, r)
         else:
-            r = min(X.shape)
-    
-        # compute dmd
-        mu,Phi = self.dmd(X, Y, r)
+            # one decomposition for the threshold and the dmd
+            r, usv = self.decompose(_D, do_svht)
+            mu,Phi = self.dmd(X, Y, r, usv=usv)
     
         # frequency cutoff (oscillations per timestep)
         rho = max_cycles / bin_size
@@ -104,7 +297,7 @@ class MrDMDZscore():
         D = D - D_dmd
     
         # record keeping
-        node = type('Node', (object,), {})()
+        node = ModeNode()
         node.level = level            # level of recursion
         node.bin_num = bin_num        # time bin number
         node.bin_size = bin_size      # time bin size
@@ -163,6 +356,124 @@ class MrDMDZscore():
         return nodes
     
     
+    def mrdmd_levels(self, D, max_levels=7, max_cycles=2, do_svht=True):
+        '''
+        mrdmd() one level at a time. The bins of a level are cut from the residual left
+        by the level above; bins of equal size are stacked and go through batched
+        svd/eig/solve, with ranks and mode counts that differ between bins zero-padded.
+        Returns the same nodes as the recursive version, in the same (depth-first) order.
+        '''
+        nyq = 8 * max_cycles
+        R = np.array(D)
+        nodes = []
+        bins = [(0, 0, D.shape[1])] # (bin_num, offset, bin_size)
+        for level in range(max_levels + 1):
+            bins = [b for b in bins if b[2] >= nyq]
+            for bin_size in sorted({b[2] for b in bins}):
+                group = [b for b in bins if b[2] == bin_size]
+                Dbin = np.stack([R[:, offset:offset+bin_size] for _, offset, _ in group])
+                level_nodes = self.batch_bins(Dbin, level, group, max_cycles, do_svht)
+                nodes += level_nodes
+                for node in level_nodes:
+                    if node.n > 0:
+                        # remove influence of slow modes
+                        D_dmd = dot(node.Phi, node.Psi)
+                        if np.iscomplexobj(D_dmd) and not np.iscomplexobj(R):
+                            R = R.astype(complex)
+                        R[:, node.start:node.stop] -= D_dmd
+            if level == max_levels:
+                break
+            # split every bin into two for the next level
+            bins = [child for bin_num, offset, bin_size in bins
+                    for child in ((2*bin_num, offset, ceil(bin_size / 2)),
+                                  (2*bin_num+1, offset + ceil(bin_size / 2), bin_size - ceil(bin_size / 2)))]
+        nodes.sort(key=lambda n: (n.start, n.level))
+        return nodes
+
+    def batch_bins(self, Dbin, level, group, max_cycles, do_svht):
+        # nodes holding the slow modes of a stack of equally sized bins (bins x rows x bin_size)
+        B, rows, bin_size = Dbin.shape
+        nyq = 8 * max_cycles
+        step = floor(bin_size / nyq)
+        _D = np.ascontiguousarray(Dbin[:, :, ::step]) # batched matmul only reaches BLAS on contiguous stacks
+        X = _D[:, :, :-1]
+        Y = _D[:, :, 1:]
+
+        # rank-reduced dmd, padded to the largest rank of the stack
+        r, r_use, (U, sv, Vh) = self.batch_decompose(_D, do_svht)
+        k = int(r_use.max())
+        rho = max_cycles / bin_size
+        m = 0
+        if k > 0:
+            live = np.arange(k)[None, :] < r_use[:, None]
+            U = U[:, :, :k] * live[:, None, :]
+            V = np.swapaxes(Vh[:, :k, :], 1, 2).conj() * live[:, None, :]
+            inv_sig = np.where(live, 1 / np.where(live, sv[:, :k], 1), 0)
+            YV = (Y @ V) * inv_sig[:, None, :]
+            Atil = np.swapaxes(U, 1, 2).conj() @ YV # build A tilde
+            mu, W = eig(Atil) # padded ranks give zero eigenvalues, never slow
+            Phi = YV @ W # build DMD modes
+
+            # consolidate slow eigenvalues (as boolean mask)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                slow = (np.abs(np.log(mu) / ((2 * pi * step) + 1e-20 ))) <= rho
+            n = slow.sum(axis=1)
+            m = int(n.max())
+        else:
+            n = np.zeros(B, dtype=int)
+
+        if m > 0:
+            # slow modes first, padded to the largest count of the stack
+            order = np.argsort(~slow, axis=1, kind='stable')[:, :m]
+            live = np.arange(m)[None, :] < n[:, None]
+            mu = np.where(live, np.take_along_axis(mu, order, axis=1), 0)
+            Phi = np.take_along_axis(Phi, order[:, None, :], axis=2) * live[:, None, :]
+
+            # vars for the objective function for D (before subsampling)
+            Vand = np.empty((B, m, bin_size), dtype=np.result_type(mu, float))
+            Vand[:, :, 0] = 1
+            Vand[:, :, 1:] = power(mu, 1/step)[:, :, None]
+            np.multiply.accumulate(Vand, axis=2, out=Vand)
+            P = multiply(np.swapaxes(Phi, 1, 2).conj() @ Phi, np.conj(Vand @ np.swapaxes(Vand, 1, 2).conj()))
+            P[:, np.arange(m), np.arange(m)] += ~live # padded modes: identity rows, b = 0
+            q = (np.conj(Dbin @ np.swapaxes(Vand, 1, 2).conj()) * Phi).sum(axis=1).conj()
+
+            # find optimal b solution
+            b_opt = solve(P, q[:, :, None])[:, :, 0]
+
+            # time evolution
+            Psi = Vand * b_opt[:, :, None]
+
+        nodes = []
+        for b, (bin_num, offset, _) in enumerate(group):
+            node = ModeNode()
+            node.level = level
+            node.bin_num = bin_num
+            node.bin_size = bin_size
+            node.start = offset
+            node.stop = offset + bin_size
+            node.step = step
+            node.rho = rho
+            node.r = r[b]
+            node.n = n[b]
+            if n[b] > 0:
+                node.mu = mu[b, :n[b]]
+                node.Phi = Phi[b, :, :n[b]]
+                node.Psi = Psi[b, :n[b]]
+                node.b_opt = b_opt[b, :n[b]]
+            else:
+                node.mu = np.array([], dtype='complex')
+                node.Phi = np.zeros([rows, 0], dtype='complex')
+                node.Psi = np.zeros([0, bin_size], dtype='complex')
+                node.b_opt = np.array([], dtype='complex')
+            nodes.append(node)
+        return nodes
+
+    def mode_tree(self, D, max_levels=7, max_cycles=2, do_svht=True, keep_psi=False):
+        # mrdmd() of D as a compact ModeTree, without the time evolution unless keep_psi
+        nodes = self.mrdmd(D, max_levels=max_levels, max_cycles=max_cycles, do_svht=do_svht)
+        return ModeTree.from_nodes(nodes, D.shape[0], keep_psi=keep_psi)
+
     def stitch(self, nodes, level):
         
         # get length of time dimension
@@ -220,23 +531,21 @@ class MrDMDZscore():
         
                 t = np.arange(0,np.diff(tsID)[0],1)
                 
-                sorted_nodes = [n for l in range(level) 
-                        for n in self.get_sorted_nodes_in_level(nodes,l)[0] if n.start <= tsID[1] and 
-                        n.stop >= tsID[0]]
-        
-                mu = np.hstack([n.mu for n in sorted_nodes])
-        
-                dt = None
-                if len(t) == 1:
-                    dt = 1
+                if isinstance(nodes, ModeTree):
+                    # bins overlapping the range, straight from the tree arrays
+                    modes = nodes.mode_mask((nodes.level < level) & (nodes.start <= tsID[1]) & (nodes.stop >= tsID[0]))
+                    omega = np.log(nodes.mu[modes])*100/nodes.mode_steps()[modes]
+                    phi = nodes.Phi[:, modes]
                 else:
-                    dt = 1/len(t)
+                    sorted_nodes = [n for l in range(level) 
+                            for n in self.get_sorted_nodes_in_level(nodes,l)[0] if n.start <= tsID[1] and 
+                            n.stop >= tsID[0]]
         
-                omega = np.hstack([np.log(n.mu)*100/(n.step) for n in sorted_nodes])
-                phi = np.hstack([n.Phi for n in sorted_nodes])
+                    omega = np.hstack([np.log(n.mu)*100/(n.step) for n in sorted_nodes])
+                    phi = np.hstack([n.Phi for n in sorted_nodes])
         
                 f = abs(omega.imag/2*np.pi)
-                P = diag(np.matmul(phi.conj().T, phi))
+                P = np.einsum('ij,ij->j', phi.conj(), phi) # diag(phi^H phi)
         
                 #mrdmd power spectrum
                 if plot:
@@ -248,12 +557,8 @@ class MrDMDZscore():
         
                 Xaug_small = D__[:, tsID[0]:tsID[1]]
         
-                indxs = []
-        
                 #choose the appropriate frequency range 
-                for ind, (fr, ph) in enumerate(zip(f, P)):
-                    if fr >= 0 and fr < 80:
-                        indxs.append(ind)
+                indxs = np.flatnonzero((f >= 0) & (f < 80))
                 if len(indxs) == 0:
                     continue
                     indxs = [i for i in range(len(P))]
@@ -267,8 +572,7 @@ class MrDMDZscore():
                 # subtract baseline mode with the current readings (curr) 
                 baseline_mean = np.mean(dmd_freqs_mean[baseline_indx])
                 n_baseline_dmd_modes = dmd_freqs_mean[n_baseline_indx] - baseline_mean
-                val = [np.power(dmd_freqs_mean[i]-baseline_mean, 2) for i in n_baseline_indx]
-                std_curr = np.sqrt(np.mean(val))
+                std_curr = np.sqrt(np.mean(np.power(n_baseline_dmd_modes, 2)))
                 std_currs.append(std_curr)
 
                 if not for_baseline:
@@ -294,6 +598,66 @@ class MrDMDZscore():
             return std_currs
 
 
+    def segment_power(self, tree, rows=None, baseline_rows=None, n_time=None, max_levels=None):
+        '''
+        compute_zscore's dmd_freqs_mean for every segment of segment_grid() at once: per row,
+        the mean |Phi| over the modes (0 <= f < 80) of all bins with start <= stop_s and
+        stop >= start_s. As start < stop, the bins left out (start > stop_s, stop < start_s)
+        are disjoint, so a segment's sum is the prefix sum of |Phi| with modes ordered by
+        bin start, up to start <= stop_s, minus the one ordered by bin stop, up to
+        stop < start_s: two gathers per segment whatever the depth of the tree.
+        Returns (segments, P, P_baseline): P rows x segments, NaN where a segment has no
+        modes, and the mean of P over baseline_rows (one extra row, as P is linear in
+        |Phi|), None without baseline_rows.
+        '''
+        if n_time is None:
+            n_time = int(tree.stop.max()) if len(tree) else 0
+        if max_levels is None:
+            max_levels = int(tree.level.max()) if len(tree) else 0
+        segments = segment_grid(n_time, max_levels)
+
+        omega = np.log(tree.mu)*100/tree.mode_steps()
+        f = abs(omega.imag/2*np.pi)
+        modes = np.flatnonzero((f >= 0) & (f < 80))
+        starts = np.repeat(tree.start, tree.n)[modes]
+        by_start = np.argsort(starts, kind='stable')
+        modes, starts = modes[by_start], starts[by_start]
+        stops = np.repeat(tree.stop, tree.n)[modes]
+        by_stop = np.argsort(stops, kind='stable')
+
+        power = np.abs(tree.Phi[:, modes] if rows is None else tree.Phi[rows][:, modes])
+        if baseline_rows is not None:
+            power = np.vstack([power, np.mean(np.abs(tree.Phi[baseline_rows][:, modes]), axis=0)])
+        prefix_start = np.zeros((power.shape[0], len(modes) + 1))
+        prefix_stop = np.zeros((power.shape[0], len(modes) + 1))
+        np.cumsum(power, axis=1, out=prefix_start[:, 1:])
+        np.cumsum(power[:, by_stop], axis=1, out=prefix_stop[:, 1:])
+
+        upto = np.searchsorted(starts, segments[:, 2], side='right')
+        before = np.searchsorted(stops[by_stop], segments[:, 1], side='left')
+        counts = upto - before
+        P = np.take(prefix_start, upto, axis=1)
+        P -= np.take(prefix_stop, before, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            P /= np.where(counts > 0, counts, np.nan)
+        if baseline_rows is None:
+            return segments, P, None
+        return segments, P[:-1], P[-1]
+
+    def segment_zscores(self, tree, baseline_indx, n_baseline_indx, std_baselines=None, n_time=None, max_levels=None):
+        '''
+        compute_zscore for every segment of every level in one pass over the tree: z-scores
+        of the n_baseline rows against the mean of the baseline rows, scaled by
+        std_baselines, or by the spread of the n_baseline rows when it is None.
+        Returns (segments, Z, std_curr): Z is len(n_baseline_indx) x segments, std_curr
+        per segment (what for_baseline=True returns for the whole timeline).
+        '''
+        segments, P, baseline_mean = self.segment_power(tree, n_baseline_indx, baseline_indx, n_time, max_levels)
+        std_curr = np.sqrt(np.mean(np.power(P - baseline_mean, 2), axis=0))
+        std = std_curr if std_baselines is None else std_baselines
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return segments, (P - baseline_mean) / std, std_curr
+
     def get_splt(self, tstep = 1000, max_levels = 12, ):
         
         lll = max_levels
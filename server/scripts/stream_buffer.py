@@ -0,0 +1,425 @@
+"""Append-only, chunked storage for streamed rows with O(batch) upserts"""
+import numpy as np
+import pandas as pd
+
+from scripts.compact import EPOCHS_ATTR, compact_frame, row_epochs
+from scripts.tensor import MetricTensor
+
+KEY_COLS = ['timestamp', 'nodeId']
+CHUNK_ROWS = 65536
+
+class _Chunk():
+    __slots__ = ('serial', 'timestamp', 'epoch', 'node', 'values', 'size')
+
+    def __init__(self, serial, n_rows, n_metrics):
+        self.serial = serial
+        self.timestamp = np.empty(n_rows, dtype=object)
+        self.epoch = np.empty(n_rows, dtype=np.int64)
+        self.node = np.empty(n_rows, dtype=np.int32)
+        self.values = np.zeros((n_rows, n_metrics), dtype=np.float64)
+        self.size = 0
+
+def _isin_sorted(sorted_values, values):
+    """Which of values occur in the sorted array sorted_values"""
+    at = np.searchsorted(sorted_values, values)
+    return (at < len(sorted_values)) & (sorted_values[np.minimum(at, max(len(sorted_values) - 1, 0))] == values)
+
+def _resized(arr, n, capacity):
+    """The first n rows of arr copied into an array with room for capacity rows"""
+    out = np.empty((capacity,) + arr.shape[1:], dtype=arr.dtype)
+    out[:n] = arr[:n]
+    return out
+
+class StreamBuffer():
+    """
+    Rows keyed by (nodeId, timestamp) stored in preallocated chunks of CHUNK_ROWS.
+    Each timestamp maps to a slot array indexed by node code holding the global row
+    position (or -1), so an upsert only touches the rows of the incoming batch.
+    Retention drops whole chunks that fall outside the time window (retention, any
+    pandas Timedelta string) or beyond max_rows. With compact=True, frame() returns
+    the compact form (see scripts/compact.py) built from the stored codes and epochs.
+    frame() and tensor() are cached and, after upserts that only append rows or
+    overwrite values, extended with the new rows instead of rebuilt.
+    """
+
+    def __init__(self, metrics, chunk_rows=CHUNK_ROWS, retention=None, max_rows=None, compact=False, float32=False):
+        self.metrics = list(metrics)
+        self.metric_index = {m: i for i, m in enumerate(self.metrics)}
+        self.chunk_rows = chunk_rows
+        self.retention = None if retention is None else pd.Timedelta(retention).value
+        self.max_rows = max_rows
+        self.compact = compact
+        self.float32 = float32
+        self.node_ids = []
+        self.node_codes = {}
+        self._slots = {}        # epoch -> int64 array of row positions by node code
+        self._chunks = []
+        self._next_serial = 0
+        self._num_rows = 0
+        self._max_epoch = None
+        self._frame = None
+        self._frame_end = 0     # row positions [_frame_base, _frame_end) are in _frame
+        self._frame_base = 0
+        self._frame_dirty = []  # overwritten positions below _frame_end
+        self._frame_extendable = False
+        self._frame_cols = None  # time (codes or strings), node codes and values, with spare rows
+        self._frame_rows = 0
+        self._tensor = None
+        self._tensor_end = 0
+        self._tensor_dirty = []
+        self.evictions = 0      # chunks dropped so far, lets consumers notice the history shrank
+        self.revision = 0       # upserts so far
+        self._write_epochs = [] # earliest epoch written by each upsert
+
+    @classmethod
+    def from_frame(cls, df, **kwargs):
+        buffer = cls([c for c in df.columns if c not in KEY_COLS], **kwargs)
+        buffer.upsert(df)
+        return buffer
+
+    def __len__(self):
+        return self._num_rows
+
+    def _node_codes(self, node_ids):
+        for n in pd.unique(node_ids):
+            if n not in self.node_codes:
+                self.node_codes[n] = len(self.node_ids)
+                self.node_ids.append(n)
+        return pd.Series(node_ids).map(self.node_codes).to_numpy(dtype=np.int32)
+
+    def _slot_array(self, epoch):
+        slots = self._slots.get(epoch)
+        if slots is None or len(slots) < len(self.node_ids):
+            grown = np.full(max(len(self.node_ids), 2 * (0 if slots is None else len(slots))), -1, dtype=np.int64)
+            if slots is not None:
+                grown[:len(slots)] = slots
+            slots = self._slots[epoch] = grown
+        return slots
+
+    def _add_metrics(self, cols):
+        # rare: a batch brings a metric the buffer has not seen yet
+        for col in cols:
+            self.metric_index[col] = len(self.metrics)
+            self.metrics.append(col)
+        for chunk in self._chunks:
+            chunk.values = np.hstack([chunk.values, np.zeros((len(chunk.values), len(cols)))])
+        self._frame = self._tensor = None
+
+    def _allocate(self, n):
+        """Reserves n new row positions at the tail"""
+        positions = []
+        while n > 0:
+            if not self._chunks or self._chunks[-1].size == self.chunk_rows:
+                self._chunks.append(_Chunk(self._next_serial, self.chunk_rows, len(self.metrics)))
+                self._next_serial += 1
+            tail = self._chunks[-1]
+            take = min(n, self.chunk_rows - tail.size)
+            start = tail.serial * self.chunk_rows + tail.size
+            positions.append(np.arange(start, start + take, dtype=np.int64))
+            tail.size += take
+            n -= take
+        return np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+
+    def upsert(self, batch):
+        """Inserts new (nodeId, timestamp) rows and overwrites existing ones"""
+        if batch.empty:
+            return
+        batch = batch.drop_duplicates(subset=KEY_COLS, keep='last')
+        new_cols = [c for c in batch.columns if c not in KEY_COLS and c not in self.metric_index]
+        if new_cols:
+            self._add_metrics(new_cols)
+
+        codes = self._node_codes(batch['nodeId'].to_numpy(dtype=object))
+        epochs = row_epochs(batch)
+        timestamps = batch['timestamp'].to_numpy(dtype=object)
+        # only the batch's metrics are written; the others keep their stored values (0.0 for new rows)
+        cols = [c for c in batch.columns if c not in KEY_COLS]
+        present = [self.metric_index[c] for c in cols]
+        values = np.empty((len(batch), len(cols)), dtype=np.float64)
+        for i, col in enumerate(cols):
+            values[:, i] = pd.to_numeric(batch[col], errors='coerce').fillna(0.0).to_numpy()
+
+        # resolve row positions one timestamp at a time
+        positions = np.empty(len(batch), dtype=np.int64)
+        overwritten = []
+        order = np.argsort(epochs, kind='stable')
+        bounds = np.flatnonzero(np.diff(epochs[order])) + 1
+        for group in np.split(order, bounds):
+            slots = self._slot_array(epochs[group[0]])
+            pos = slots[codes[group]]
+            new = pos < 0
+            if new.any():
+                pos[new] = self._allocate(int(new.sum()))
+                slots[codes[group[new]]] = pos[new]
+            if not new.all():
+                overwritten.append(pos[~new])
+            positions[group] = pos
+
+        first_serial = self._chunks[0].serial
+        chunk_ids = positions // self.chunk_rows - first_serial
+        rows = positions % self.chunk_rows
+        for c in np.unique(chunk_ids):
+            chunk = self._chunks[c]
+            sel = chunk_ids == c
+            chunk.timestamp[rows[sel]] = timestamps[sel]
+            chunk.epoch[rows[sel]] = epochs[sel]
+            chunk.node[rows[sel]] = codes[sel]
+            chunk.values[rows[sel][:, None], present] = values[sel]
+
+        self._num_rows = sum(chunk.size for chunk in self._chunks)
+        batch_max = int(epochs.max())
+        self._max_epoch = batch_max if self._max_epoch is None else max(self._max_epoch, batch_max)
+        if overwritten:
+            overwritten = np.concatenate(overwritten)
+            if self._frame is not None:
+                self._frame_dirty.append(overwritten[overwritten < self._frame_end])
+            if self._tensor is not None:
+                self._tensor_dirty.append(overwritten[overwritten < self._tensor_end])
+        self._write_epochs.append(int(epochs.min()))
+        self.revision += 1
+        self.evict()
+
+    def earliest_write(self, since):
+        """Earliest epoch written by the upserts after revision `since`, None if there were none"""
+        writes = self._write_epochs[since:]
+        return min(writes) if writes else None
+
+    def _drop_chunk(self):
+        chunk = self._chunks.pop(0)
+        positions = chunk.serial * self.chunk_rows + np.arange(chunk.size)
+        epochs, nodes = chunk.epoch[:chunk.size], chunk.node[:chunk.size]
+        order = np.argsort(epochs, kind='stable')
+        bounds = np.flatnonzero(np.diff(epochs[order])) + 1
+        for group in np.split(order, bounds):
+            epoch = epochs[group[0]]
+            slots = self._slots.get(epoch)
+            if slots is None:
+                continue
+            # slots still pointing into the chunk; later rows of the same key live elsewhere
+            live = slots[nodes[group]] == positions[group]
+            slots[nodes[group[live]]] = -1
+            if (slots < 0).all():
+                del self._slots[epoch]
+        self._num_rows -= chunk.size
+        self.evictions += 1
+
+    def evict(self):
+        """Drops the oldest chunks outside the retention window / row budget"""
+        evicted = False
+        while len(self._chunks) > 1:
+            head = self._chunks[0]
+            expired = self.retention is not None and head.epoch[:head.size].max() < self._max_epoch - self.retention
+            over_budget = self.max_rows is not None and self._num_rows - head.size >= self.max_rows
+            if not (expired or over_budget):
+                break
+            self._drop_chunk()
+            evicted = True
+        if evicted:
+            self._frame = self._tensor = None
+        return evicted
+
+    def _end(self):
+        return 0 if not self._chunks else self._chunks[-1].serial * self.chunk_rows + self._chunks[-1].size
+
+    def _rows(self, start, stop):
+        """(node codes, timestamps, epochs, values) of row positions [start, stop)"""
+        parts = []
+        for chunk in self._chunks:
+            base = chunk.serial * self.chunk_rows
+            lo, hi = max(start - base, 0), min(stop - base, chunk.size)
+            if lo < hi:
+                parts.append((chunk.node[lo:hi], chunk.timestamp[lo:hi], chunk.epoch[lo:hi], chunk.values[lo:hi]))
+        if not parts:
+            return (np.empty(0, dtype=np.int32), np.empty(0, dtype=object), np.empty(0, dtype=np.int64),
+                    np.empty((0, len(self.metrics))))
+        return tuple(np.concatenate(p) for p in zip(*parts))
+
+    def _rows_at(self, positions):
+        """(node codes, epochs, values) of arbitrary row positions"""
+        chunk_ids = positions // self.chunk_rows - self._chunks[0].serial
+        rows = positions % self.chunk_rows
+        nodes = np.empty(len(positions), dtype=np.int32)
+        epochs = np.empty(len(positions), dtype=np.int64)
+        values = np.empty((len(positions), len(self.metrics)))
+        for c in np.unique(chunk_ids):
+            sel = chunk_ids == c
+            chunk = self._chunks[c]
+            nodes[sel], epochs[sel], values[sel] = chunk.node[rows[sel]], chunk.epoch[rows[sel]], chunk.values[rows[sel]]
+        return nodes, epochs, values
+
+    def _take_dirty(self, pending):
+        dirty = np.unique(np.concatenate(pending)) if pending else np.empty(0, dtype=np.int64)
+        pending.clear()
+        return dirty
+
+    def frame(self):
+        """Materializes the buffer as a long-format DataFrame (cached, extended by later upserts)"""
+        if self._frame is not None and (self._frame_end < self._end() or self._frame_dirty):
+            self._frame = self._extend_frame()
+        if self._frame is None:
+            self._frame = self._build_frame()
+        return self._frame
+
+    def _build_frame(self):
+        self._frame_dirty.clear()
+        self._frame_base = self._chunks[0].serial * self.chunk_rows if self._chunks else 0
+        self._frame_end = self._end()
+        self._frame_extendable = False
+        node_codes, timestamps, epochs, values = self._rows(self._frame_base, self._frame_end)
+        if not len(node_codes):
+            return pd.DataFrame(columns=KEY_COLS + self.metrics)
+        if self.compact:
+            # codes and epochs are already stored, so no string factorizing or parsing here
+            time_codes, epochs = pd.factorize(epochs, sort=True)
+            _, first = np.unique(time_codes, return_index=True)
+            categories = pd.Index(timestamps[first])
+            if not categories.is_unique:
+                # several spellings of the same instant: fall back to parsing, and to full rebuilds
+                node_ids = np.asarray(self.node_ids, dtype=object)
+                df = pd.DataFrame(values.astype(np.float32) if self.float32 else values, columns=self.metrics)
+                df.insert(0, 'nodeId', node_ids[node_codes])
+                df.insert(0, 'timestamp', timestamps)
+                return compact_frame(df, float32=self.float32)
+            self._frame_categories, self._frame_epochs = categories, epochs
+            keys = (time_codes, node_codes)
+        else:
+            keys = (timestamps, node_codes)
+
+        # row-major columns with spare rows, so appended rows are written in place
+        n = len(node_codes)
+        capacity = max(2 * n, self.chunk_rows)
+        values = values.astype(np.float32) if self.float32 else values
+        self._frame_cols = [_resized(a, n, capacity) for a in keys + (values,)]
+        self._frame_rows = n
+        self._frame_extendable = True
+        return self._frame_view()
+
+    def _frame_view(self):
+        n = self._frame_rows
+        time_col, node_col, values = (col[:n] for col in self._frame_cols)
+        df = pd.DataFrame(values, columns=self.metrics, copy=False)
+        node_ids = pd.Index(self.node_ids, dtype=object)
+        if not self.compact:
+            df.insert(0, 'nodeId', node_ids.to_numpy()[node_col])
+            df.insert(0, 'timestamp', time_col)
+        else:
+            df.insert(0, 'nodeId', pd.Categorical.from_codes(node_col, categories=node_ids, validate=False))
+            df.insert(0, 'timestamp', pd.Categorical.from_codes(time_col, categories=self._frame_categories,
+                                                                validate=False))
+            df.attrs[EPOCHS_ATTR] = self._frame_epochs
+        return df
+
+    def _extend_frame(self):
+        """The cached frame with the rows appended since and the overwritten values; None to rebuild"""
+        if not self._frame_extendable:
+            return None
+        end = self._end()
+        node_codes, timestamps, epochs, values = self._rows(self._frame_end, end)
+        if self.compact:
+            # new timestamps may only extend the time-ordered categories at the end
+            new_epochs, first = np.unique(epochs, return_index=True)
+            known = _isin_sorted(self._frame_epochs, new_epochs)
+            fresh = new_epochs[~known]
+            if len(fresh) and fresh[0] <= self._frame_epochs[-1]:
+                return None
+            categories = self._frame_categories.append(pd.Index(timestamps[first[~known]]))
+            if not categories.is_unique:
+                return None
+            self._frame_categories = categories
+            self._frame_epochs = np.concatenate([self._frame_epochs, fresh])
+            keys = (np.searchsorted(self._frame_epochs, epochs), node_codes)
+        else:
+            keys = (timestamps, node_codes)
+
+        n, added = self._frame_rows, len(node_codes)
+        dirty = self._take_dirty(self._frame_dirty)
+        if n + added > len(self._frame_cols[0]) or len(dirty):
+            # earlier frames keep their rows: grow, or copy before overwriting values
+            capacity = max(len(self._frame_cols[0]), 2 * (n + added))
+            self._frame_cols = [_resized(col, n, capacity) for col in self._frame_cols]
+        for col, a in zip(self._frame_cols, keys + (values,)):
+            col[n:n + added] = a
+        if len(dirty):
+            self._frame_cols[2][dirty - self._frame_base] = self._rows_at(dirty)[2]
+        self._frame_rows = n + added
+        self._frame_end = end
+        return self._frame_view()
+
+    def tensor(self):
+        """MetricTensor.from_frame(frame()) without the frame (cached, extended by later upserts)"""
+        if self._tensor is not None and (self._tensor_end < self._end() or self._tensor_dirty):
+            self._tensor = self._extend_tensor()
+        if self._tensor is None:
+            self._tensor = self._build_tensor()
+        return self._tensor
+
+    def _tensor_dtype(self):
+        return np.float32 if self.float32 and self.metrics else np.float64
+
+    def _build_tensor(self):
+        self._tensor_dirty.clear()
+        self._tensor_end = self._end()
+        node_codes, timestamps, epochs, values = self._rows(0, self._tensor_end)
+        # nodes and timestamps in sorted order, as MetricTensor.from_frame factorizes them
+        node_ids = np.asarray(self.node_ids, dtype=object)
+        used = np.zeros(len(node_ids), dtype=bool)
+        used[node_codes] = True
+        nodes = np.flatnonzero(used)
+        nodes = nodes[np.argsort(node_ids[nodes], kind='stable')]
+        self._tensor_nodes = node_ids[nodes]
+        self._node_rows = np.full(len(node_ids), -1, dtype=np.int64)
+        self._node_rows[nodes] = np.arange(len(nodes))
+        uniq, first, time_codes = np.unique(epochs, return_index=True, return_inverse=True)
+
+        # spare room along the time axis so appended timestamps are written in place
+        capacity = max(2 * len(uniq), 16)
+        self._tensor_data = np.full((len(self.metrics), len(nodes), capacity), np.nan, dtype=self._tensor_dtype())
+        self._tensor_epochs = np.empty(capacity, dtype=np.int64)
+        self._tensor_epochs[:len(uniq)] = uniq
+        self._tensor_timestamps = np.empty(capacity, dtype=object)
+        self._tensor_timestamps[:len(uniq)] = timestamps[first]
+        self._n_times = len(uniq)
+        self._tensor_data[:, self._node_rows[node_codes], time_codes] = values.T
+        self._tensor_missing = np.isnan(self._tensor_data[:, :, :self._n_times]).any(axis=(1, 2))
+        return self._tensor_view()
+
+    def _tensor_view(self):
+        n = self._n_times
+        return MetricTensor(self._tensor_data[:, :, :n], self._tensor_nodes, self._tensor_timestamps[:n], self.metrics,
+                            epochs=self._tensor_epochs[:n], missing=self._tensor_missing.copy())
+
+    def _extend_tensor(self):
+        """Writes the appended rows and overwritten values into the tensor; None to rebuild"""
+        end = self._end()
+        node_codes, timestamps, epochs, values = self._rows(self._tensor_end, end)
+        if (node_codes >= len(self._node_rows)).any() or (self._node_rows[node_codes] < 0).any():
+            return None
+        n = self._n_times
+        new_epochs, first = np.unique(epochs, return_index=True)
+        known = _isin_sorted(self._tensor_epochs[:n], new_epochs)
+        fresh = new_epochs[~known]
+        if len(fresh) and n and fresh[0] <= self._tensor_epochs[n - 1]:
+            return None
+        dirty = self._take_dirty(self._tensor_dirty)
+
+        data = self._tensor_data
+        if n + len(fresh) > data.shape[2] or len(dirty) or known.any():
+            # cells of earlier views change (or the time axis is full): continue on a copy
+            capacity = max(data.shape[2], 2 * (n + len(fresh)))
+            grown = np.full(data.shape[:2] + (capacity,), np.nan, dtype=data.dtype)
+            grown[:, :, :n] = data[:, :, :n]
+            self._tensor_epochs = _resized(self._tensor_epochs, n, capacity)
+            self._tensor_timestamps = _resized(self._tensor_timestamps, n, capacity)
+            self._tensor_data = data = grown
+        self._tensor_epochs[n:n + len(fresh)] = fresh
+        self._tensor_timestamps[n:n + len(fresh)] = timestamps[first[~known]]
+        self._n_times = n + len(fresh)
+
+        time_codes = np.searchsorted(self._tensor_epochs[:self._n_times], epochs)
+        data[:, self._node_rows[node_codes], time_codes] = values.T
+        if len(dirty):
+            codes, epochs, values = self._rows_at(dirty)
+            data[:, self._node_rows[codes], np.searchsorted(self._tensor_epochs[:self._n_times], epochs)] = values.T
+        self._tensor_missing |= np.isnan(data[:, :, n:self._n_times]).any(axis=(1, 2))
+        self._tensor_end = end
+        return self._tensor_view()
@@ -0,0 +1,245 @@
+"""Pluggable sources that feed streamed batches into the server's ingest path"""
+from abc import ABC, abstractmethod
+import glob
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+
+import pandas as pd
+
+from scripts.dataset_store import normalize_columns
+from scripts.compact import to_epoch_ns
+
+class StreamSource(ABC):
+    """Yields long-format DataFrame batches (timestamp, nodeId, metrics...)"""
+
+    @abstractmethod
+    def batches(self, stop_event):
+        """Generator of batches; returns once the source is exhausted or stop_event is set"""
+
+    def close(self):
+        pass
+
+def read_batch_file(path):
+    return normalize_columns(pd.read_csv(path).fillna(0.0))
+
+class BatchFileSource(StreamSource):
+    """
+    Numbered files batch_000.csv, batch_001.csv, ... until the next one is missing.
+    next_idx already points past a batch when it is yielded.
+    """
+
+    def __init__(self, batch_dir, start_idx=0):
+        self.batch_dir = batch_dir
+        self.next_idx = start_idx
+
+    def batches(self, stop_event):
+        while not stop_event.is_set():
+            path = os.path.join(self.batch_dir, f"batch_{self.next_idx:03d}.csv")
+            if not os.path.exists(path):
+                return
+            batch = read_batch_file(path)
+            self.next_idx += 1
+            yield batch
+
+class DirectoryWatcherSource(StreamSource):
+    """
+    Polls a directory and yields every new (or rewritten) file matching pattern.
+    A file is only read once its size is unchanged between two polls, so files
+    still being written are not picked up half-way.
+    """
+
+    def __init__(self, directory, pattern='*.csv', poll_interval=1.0, include_existing=False):
+        self.directory = directory
+        self.pattern = pattern
+        self.poll_interval = float(poll_interval)
+        self.seen = {} if include_existing else self._scan()
+        self.pending = {}
+
+    def _scan(self):
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, self.pattern)):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files[path] = (st.st_mtime_ns, st.st_size)
+        return files
+
+    def batches(self, stop_event):
+        while not stop_event.is_set():
+            current = self._scan()
+            ready = []
+            for path, sig in current.items():
+                if self.seen.get(path) == sig:
+                    continue
+                if self.pending.get(path) == sig:
+                    ready.append(path)
+                else:
+                    self.pending[path] = sig
+            for path in sorted(ready, key=lambda p: current[p]):
+                self.seen[path] = self.pending.pop(path)
+                yield read_batch_file(path)
+            stop_event.wait(self.poll_interval)
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                self.server.records.put(json.loads(line))
+            except ValueError:
+                self.server.bad_lines += 1
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class SocketSource(StreamSource):
+    """
+    Line-protocol listener for telemetry agents on a TCP port or a Unix socket.
+    Each line is one JSON record: {"timestamp": ..., "nodeId": ..., "<metric>": value, ...}.
+    Records are flushed as a batch every flush_interval seconds or batch_rows records.
+    """
+
+    def __init__(self, host='127.0.0.1', port=5011, unix_path=None, batch_rows=10000, flush_interval=1.0):
+        self.batch_rows = int(batch_rows)
+        self.flush_interval = float(flush_interval)
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            server_cls = type('_UnixServer', (socketserver.ThreadingUnixStreamServer,), {'daemon_threads': True})
+            self.server = server_cls(unix_path, _LineHandler)
+        else:
+            self.server = _TCPServer((host, int(port)), _LineHandler)
+        self.unix_path = unix_path
+        self.server.records = queue.Queue()
+        self.server.bad_lines = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def batches(self, stop_event):
+        records = self.server.records
+        while not stop_event.is_set():
+            rows = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or stop_event.is_set():
+                    break
+                try:
+                    rows.append(records.get(timeout=min(timeout, 0.1)))
+                except queue.Empty:
+                    continue
+            if rows:
+                yield normalize_columns(pd.DataFrame.from_records(rows).fillna(0.0))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.remove(self.unix_path)
+
+class ReplaySource(StreamSource):
+    """
+    Plays back a historical CSV one timestamp group at a time. The gap between
+    consecutive timestamps is slept for gap / speed seconds; speed=0 replays as
+    fast as ingest allows (useful for measuring sustained ingest rate).
+    """
+
+    def __init__(self, path, speed=1.0, timestamps_per_batch=1):
+        self.path = path
+        self.speed = float(speed)
+        self.timestamps_per_batch = int(timestamps_per_batch)
+
+    def batches(self, stop_event):
+        df = read_batch_file(self.path)
+        epoch_codes, unique_epochs = pd.factorize(to_epoch_ns(df['timestamp']), sort=True)
+
+        prev_epoch = None
+        for g, batch in df.groupby(epoch_codes // self.timestamps_per_batch, sort=True):
+            if stop_event.is_set():
+                return
+            epoch = unique_epochs[g * self.timestamps_per_batch]
+            if self.speed > 0 and prev_epoch is not None:
+                stop_event.wait((epoch - prev_epoch) / 1e9 / self.speed)
+            prev_epoch = epoch
+            yield batch
+
+SOURCES = {
+    'batch': BatchFileSource,
+    'directory': DirectoryWatcherSource,
+    'socket': SocketSource,
+    'replay': ReplaySource,
+}
+
+def make_source(kind, **params):
+    if kind not in SOURCES:
+        raise ValueError(f"Invalid stream source: {kind}")
+    return SOURCES[kind](**params)
+
+class StreamRunner():
+    """Background thread pulling batches from a source into an ingest callback"""
+
+    def __init__(self, source, ingest):
+        self.source = source
+        self.ingest = ingest
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.batches = 0
+        self.rows = 0
+        self.ingest_secs = 0.0
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def _run(self):
+        self.started = time.monotonic()
+        try:
+            for batch in self.source.batches(self.stop_event):
+                t0 = time.monotonic()
+                self.ingest(batch)
+                self.ingest_secs += time.monotonic() - t0
+                self.batches += 1
+                self.rows += len(batch)
+        except Exception as e:
+            self.error = str(e)
+            print(f"Stream source stopped with error: {e}")
+        finally:
+            self.finished = time.monotonic()
+            self.source.close()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    @property
+    def running(self):
+        return self.thread.is_alive()
+
+    def stats(self):
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0.0
+        return {
+            "source": type(self.source).__name__,
+            "running": self.running,
+            "batches": self.batches,
+            "rows": self.rows,
+            "elapsed_secs": elapsed,
+            "ingest_secs": self.ingest_secs,
+            "rows_per_sec": self.rows / elapsed if elapsed > 0 else 0.0,
+            "ingest_rows_per_sec": self.rows / self.ingest_secs if self.ingest_secs > 0 else 0.0,
+            "error": self.error,
+        }
@@ -0,0 +1,162 @@
+"""Dense node x timestamp x metric tensor shared by DR1, mrDMD and baseline code"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from scripts.compact import timestamp_epochs, to_epoch_ns
+
+KEY_COLS = ['timestamp', 'nodeId']
+
+class MetricTensor():
+    """
+    Long-format frame (one row per timestamp x nodeId) pivoted once into a dense
+    float array. `values` has shape (nodes, timestamps, metrics) but is stored
+    metric-major, so `metric(col)` is a contiguous zero-copy (nodes x timestamps) view.
+    Missing cells are NaN until a fill policy is requested. Timestamps are also kept
+    as int64 epoch nanoseconds, parsed once (or taken from a compact frame).
+    """
+
+    def __init__(self, data, node_ids, timestamps, metrics, epochs=None, missing=None):
+        self._data = data                       # (metrics, nodes, timestamps)
+        self.node_ids = np.asarray(node_ids)
+        self.timestamps = np.asarray(timestamps)
+        self.metrics = list(metrics)
+        self.node_index = {n: i for i, n in enumerate(self.node_ids)}
+        self.time_index = {t: i for i, t in enumerate(self.timestamps)}
+        self.metric_index = {m: i for i, m in enumerate(self.metrics)}
+        if missing is None:
+            missing = np.isnan(data).any(axis=(1, 2)) if data.size else np.zeros(len(self.metrics), dtype=bool)
+        self.missing = missing
+        self._epochs = None if epochs is None else np.asarray(epochs, dtype=np.int64)
+        self._datetimes = None
+
+    @classmethod
+    def from_frame(cls, df, metrics=None, dtype=None):
+        """
+        Reads both the plain frame (object keys, float64) and the compact one
+        (categorical keys with epochs, possibly float32) without re-parsing strings.
+        dtype defaults to float32 when every metric column is float32.
+        """
+        if metrics is None:
+            metrics = [c for c in df.columns if c not in KEY_COLS]
+        if dtype is None:
+            dtype = np.float32 if metrics and all(df[c].dtype == np.float32 for c in metrics) else np.float64
+
+        node_codes, node_ids = _factorize(df['nodeId'])
+        epochs = timestamp_epochs(df)
+        if epochs is None:
+            time_codes, timestamps = pd.factorize(df['timestamp'], sort=True)
+        else:
+            # categories of a compact frame are already in time order
+            time_codes, used = _used_codes(df['timestamp'])
+            timestamps = df['timestamp'].cat.categories[used]
+            epochs = epochs[used]
+
+        data = np.full((len(metrics), len(node_ids), len(timestamps)), np.nan, dtype=dtype)
+        for m, col in enumerate(metrics):
+            # duplicated (node, timestamp) rows resolve to the last one
+            data[m, node_codes, time_codes] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=dtype)
+        return cls(data, node_ids, timestamps, metrics, epochs=epochs)
+
+    @property
+    def values(self):
+        return self._data.transpose(1, 2, 0)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def epochs(self):
+        """Timestamps as int64 epoch nanoseconds (UTC), parsed once per tensor"""
+        if self._epochs is None:
+            self._epochs = to_epoch_ns(self.timestamps)
+        return self._epochs
+
+    @property
+    def datetimes(self):
+        if self._datetimes is None:
+            self._datetimes = pd.to_datetime(self.epochs)
+        return self._datetimes
+
+    def metric(self, col, fill=None):
+        """
+        (nodes x timestamps) slice for one metric. Zero-copy unless the metric has
+        missing cells and a fill is requested:
+          'zero'  -> missing cells set to 0.0 (DR1)
+          'ffill' -> forward then backward fill down the node axis (mrDMD)
+        """
+        m = self.metric_index[col]
+        X = self._data[m]
+        if fill is None or not self.missing[m]:
+            return X
+        if fill == 'zero':
+            return np.nan_to_num(X, nan=0.0)
+        if fill == 'ffill':
+            return pd.DataFrame(X).ffill(axis='rows').bfill(axis='rows').to_numpy()
+        raise ValueError(f"Invalid fill policy: {fill}")
+
+    def frame(self, col, fill=None):
+        """metric() wrapped as a nodeId x timestamp DataFrame, same layout as df.pivot"""
+        return pd.DataFrame(self.metric(col, fill=fill), index=pd.Index(self.node_ids, name='nodeId'),
+                            columns=pd.Index(self.timestamps, name='timestamp'), copy=False)
+
+    def time_mask(self, start=None, end=None):
+        mask = np.ones(len(self.timestamps), dtype=bool)
+        if start is not None:
+            mask &= self.epochs >= to_epoch_ns([start])[0]
+        if end is not None:
+            mask &= self.epochs <= to_epoch_ns([end])[0]
+        return mask
+
+    def subset(self, node_ids=None, metrics=None):
+        """New tensor restricted to some nodes and/or metrics (unknown ones are skipped)"""
+        data = self._data
+        out_nodes, out_metrics = self.node_ids, self.metrics
+        if metrics is not None:
+            out_metrics = [m for m in metrics if m in self.metric_index]
+            data = data[[self.metric_index[m] for m in out_metrics]]
+        if node_ids is not None:
+            rows = np.sort([self.node_index[n] for n in node_ids if n in self.node_index])
+            out_nodes = self.node_ids[rows]
+            data = data[:, rows]
+        sub = MetricTensor(data, out_nodes, self.timestamps, out_metrics, epochs=self._epochs)
+        sub._datetimes = self._datetimes
+        return sub
+
+def _used_codes(series):
+    """Codes of a categorical remapped onto the categories that actually occur"""
+    codes = series.cat.codes.to_numpy()
+    used = np.zeros(len(series.cat.categories), dtype=bool)
+    used[codes] = True
+    remap = np.cumsum(used) - 1
+    return remap[codes], used
+
+def _factorize(series):
+    """Sorted codes/uniques; a categorical column reuses its dictionary"""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return pd.factorize(series, sort=True)
+    codes, used = _used_codes(series)
+    uniques = series.cat.categories[used]
+    if not uniques.is_monotonic_increasing:
+        order = np.argsort(uniques)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        codes, uniques = rank[codes], uniques[order]
+    return codes, uniques
+
+def node_digest(tensor):
+    """Hash of a tensor's node set, for cache keys of results computed on those nodes"""
+    return hashlib.sha1('\n'.join(map(str, tensor.node_ids)).encode()).hexdigest()
+
+_tensors = {}
+
+def get_tensor(df, version):
+    """Builds the tensor for a dataset version once and reuses it afterwards"""
+    tensor = _tensors.get(version)
+    if tensor is None:
+        _tensors.clear()
+        tensor = MetricTensor.from_frame(df)
+        _tensors[version] = tensor
+    return tensor
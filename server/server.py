@@ -1,64 +1,126 @@
 import json
 import os
+import threading
 from datetime import datetime
 
 import pandas as pd
-from flask import Flask, abort, jsonify
+from flask import Flask, abort, jsonify, request
 from flask_cors import CORS
 
 from timeit import default_timer as timer
 from concurrent.futures import ThreadPoolExecutor
 from scripts.pipeline import get_feat_contributions
 
-from mrdmd import get_mrdmd, get_mrdmd_with_new_base
-from scripts.pipeline import (get_dr_time, get_feat_contributions,
-                             recompute_clusters)
+from mrdmd import (evict_baseline, get_mrdmd, get_mrdmd_levels, get_mrdmd_with_new_base,
+                   list_baselines, online_stats, use_baseline)
+from scripts.baseline_discovery import TOP_N, get_baseline_candidates
+from scripts.baseline_registry import get_baseline_registry
+from scripts.pipeline import (cluster_sweep_scores, get_dr_time,
+                             get_feat_contributions, recompute_clusters)
+from scripts.cluster_tracker import ClusterTracker
+from scripts.compact import compact_frame
+from scripts.dataset_store import get_dataset_store, normalize_columns
+from scripts.decimate import decimate, window_frame
+from scripts.dr_cache import get_dr_cache
+from scripts.incremental_dr import IncrementalDR1
+from scripts.tensor import MetricTensor, get_tensor
+from scripts.stream_buffer import StreamBuffer
+from scripts.shared_pool import start_pool
+from scripts.stream_sources import StreamRunner, make_source
 
 app = Flask(__name__)
 CORS(app)
 
 data_dir = os.path.join(os.path.dirname(__file__), 'data')
 ts_data = pd.DataFrame()
+dataset_version = None
 headers = pd.DataFrame()
 filepath = './data/'
 file = 'ganglia_2024-02-21.csv'
 CACHE_DIR = './scripts/cache/'
-DR1_CACHE_NAME = CACHE_DIR + 'drTimeDataDR1.parquet'
-DR2_CACHE_NAME = CACHE_DIR + 'drTimeDataDR2.parquet'
 ZSC_B_CACHE_NAME = CACHE_DIR + 'mrDMDbaselineZscores.parquet'
 CLUSTER_CACHE_NAME  = CACHE_DIR + 'cluster_assignments.parquet'
-streaming_state = {"next_batch_idx": 0}
+COMPACT_MODE = True         # categorical nodeId/timestamp with epochs parsed once (see scripts/compact.py)
+COMPACT_FLOAT32 = False     # additionally store metrics as float32
+streaming_state = {"next_batch_idx": 0, "batches_ingested": 0}
+STREAM_RETENTION = None     # e.g. '6h': rows older than this (relative to the newest timestamp) are evicted
+STREAM_MAX_ROWS = None      # upper bound on rows kept while streaming
+stream_buffer = None
+stream_runner = None
+ingest_lock = threading.Lock()
+DR1_INCREMENTAL = True      # while streaming, DR1 is updated per batch instead of refit over the whole history
+MRDMD_ONLINE = False        # while streaming, /mrdmd from the online all-node trees (approximate, see README)
+dr1_model = IncrementalDR1()
+cluster_tracker = ClusterTracker()
 
 @app.route('/loadData', methods=['GET'])
 def get_timeseries_data(file):
-    # TODO: convert to parquet instead of global
-    global ts_data
+    global ts_data, dataset_version
     global filepath
-    ts_data = pd.read_csv(filepath+file).fillna(0.0)
-    # use below for env logs
-    if ('time_secs' in ts_data.columns):
-        ts_data['timestamp'] = ts_data['time_secs']
-        ts_data.drop(columns=['time_secs'], inplace=True)
-    if ('cname_processed' in ts_data.columns):
-        ts_data['nodeId'] = ts_data['cname_processed']
-        ts_data.drop(columns=['cname_id', 'cname_processed'], inplace=True)
+    # the CSV is converted once into memory-mapped Arrow files (see scripts/dataset_store.py)
+    store = get_dataset_store(filepath+file)
+    ts_data = store.load()
+    if COMPACT_MODE:
+        ts_data = compact_frame(ts_data, float32=COMPACT_FLOAT32)
+    dataset_version = store.version
+    return ts_data
+
+def get_ts_data():
+    """Full long-format frame: the stream buffer while streaming, otherwise the dataset store"""
+    global ts_data
+    with ingest_lock:
+        if stream_buffer is not None:
+            ts_data = stream_buffer.frame()
+    if ts_data is None or ts_data.empty:
+        ts_data = get_timeseries_data(file)
     return ts_data
 
+def is_loaded():
+    return stream_buffer is not None or not (ts_data is None or ts_data.empty)
+
+def load_columns(cols, file=file):
+    """
+    Returns timestamp, nodeId and the given metric columns. Reads only the needed
+    column groups from the store unless the full frame is already in memory.
+    """
+    metric_cols = [col for col in cols if col not in ['timestamp', 'nodeId']]
+    if not is_loaded():
+        data = get_dataset_store(filepath+file).load(metric_cols)
+        return compact_frame(data, float32=COMPACT_FLOAT32) if COMPACT_MODE else data
+    ts_data = get_ts_data()
+    return ts_data[['timestamp', 'nodeId'] + [col for col in metric_cols if col in ts_data.columns]]
+
 def clear_caches():
     # print('Clearing caches on startup.')
-    if os.path.exists(DR1_CACHE_NAME):
-        os.remove(DR1_CACHE_NAME)
-    if os.path.exists(DR2_CACHE_NAME):
-        os.remove(DR2_CACHE_NAME)
+    # DR results are keyed by dataset version and parameters (scripts/dr_cache.py) and survive restarts
     if os.path.exists(ZSC_B_CACHE_NAME):
         os.remove(ZSC_B_CACHE_NAME)
     # if os.path.exists(CLUSTER_CACHE_NAME):
     #     os.remove(CLUSTER_CACHE_NAME)
 
+def get_ts_tensor(nodes=None, cols=None):
+    """Node x timestamp x metric tensor of ts_data, built once per dataset version (extended per batch while streaming)"""
+    if not is_loaded():
+        return None
+    with ingest_lock:
+        tensor = stream_buffer.tensor() if stream_buffer is not None else None
+    if tensor is None:
+        tensor = get_tensor(get_ts_data(), dataset_version)
+    if nodes is None and cols is None:
+        return tensor
+    return tensor.subset(node_ids=nodes, metrics=cols)
+
 def reset_stream():
-    global ts_data, streaming_state
+    global ts_data, dataset_version, streaming_state, stream_buffer
+    if stream_runner is not None:
+        stream_runner.stop()
     streaming_state["next_batch_idx"] = 0
-    ts_data = get_timeseries_data(file)    
+    streaming_state["batches_ingested"] = 0
+    stream_buffer = None
+    dr1_model.needs_refit = True
+    # the full frame is loaded lazily; endpoints that need a few columns read them from the store
+    ts_data = pd.DataFrame()
+    dataset_version = get_dataset_store(filepath+file).version
 
 @app.route('/headers', methods=['GET'])
 def get_headers():
@@ -78,14 +140,18 @@ def get_headers():
 # PC across time points
 @app.route('/drTimeData/<n_neighbors>/<min_dist>/<num_clusters>', methods=['GET'])
 def get_dr_data_flask(n_neighbors, min_dist, num_clusters):
-    global ts_data
-
-    if ts_data is None or ts_data.empty:
-        ts_data = get_timeseries_data(file)
+    ts_data = get_ts_data()
 
     print("DR data shape:", ts_data.shape)
     
-    df = get_dr_time(ts_data, int(n_neighbors), float(min_dist), int(num_clusters), 1)
+    df = get_dr_time(ts_data, int(n_neighbors), float(min_dist), int(num_clusters), 0, tensor=get_ts_tensor(),
+                     version=dataset_version)
+    if stream_buffer is None:
+        # a new run: later streamed clusterings are tracked against this one
+        cluster_tracker.reset()
+        cluster_tracker.update(df['nodeId'], df['Cluster'], version=dataset_version)
+    else:
+        df['Cluster'] = cluster_tracker.update(df['nodeId'], df['Cluster'], version=dataset_version)
     df[['nodeId', 'Cluster']].to_parquet(CLUSTER_CACHE_NAME, index=False)
     fc_start = timer()
     agg_feat_contrib_mat, label_to_rows, label_to_rep_row, order_col, = get_feat_contributions(df)
@@ -106,37 +172,57 @@ def get_dr_data_flask(n_neighbors, min_dist, num_clusters):
 
 @app.route('/recomputeClusters/<numClusters>/<n_neighbors>/<min_dist>/<force_recompute>')
 def get_new_cluster_ids(numClusters, n_neighbors, min_dist, force_recompute=0):
-    global ts_data
-    recomputed = recompute_clusters(ts_data, int(numClusters), int(n_neighbors), float(min_dist), int(force_recompute))
-    if recomputed is None:
-        # DR2 is wiped on startup so recompute_clusters always pulls from fresh DR2 data.
-        # recompute_clusters() returns None if DR2 is not found in cache.
-        # This error state can happen if you query /recomputeClusters on server startup before /drTimeData,
-        # e.g. if the server restarted and # clusters is changed on the frontend without a page refresh.
-        abort(404, description="No cached DR2 was found.")
+    ts_data = get_ts_data()
+    recomputed = recompute_clusters(ts_data, int(numClusters), int(n_neighbors), float(min_dist), int(force_recompute),
+                                    tensor=get_ts_tensor(), version=dataset_version)
     return jsonify(recomputed)
 
+@app.route('/clusterSweep/<n_neighbors>/<min_dist>', methods=['GET'])
+def get_cluster_sweep(n_neighbors, min_dist):
+    """inertia and silhouette per k (2-20) of the background clustering sweep"""
+    ts_data = get_ts_data()
+    return jsonify(cluster_sweep_scores(ts_data, int(n_neighbors), float(min_dist), tensor=get_ts_tensor(),
+                                        version=dataset_version))
+
+@app.route('/clusterHistory', methods=['GET'])
+def get_cluster_history():
+    """
+    Tracked cluster ids per step (one step per /drTimeData or streamed batch).
+    Optional query parameter nodes (comma separated) restricts the per-node history.
+    """
+    nodes = request.args.get('nodes')
+    node_list = [n for n in nodes.split(',') if n] if nodes else None
+    node_ids, H = cluster_tracker.history(node_list)
+    return jsonify({
+        "steps": cluster_tracker.steps,
+        "events": cluster_tracker.events,
+        "history": {n: H[:, i].tolist() for i, n in enumerate(node_ids)},
+        "transitions": cluster_tracker.transitions(node_list)
+    })
+
 @app.route('/mrdmd/<nodes>/<selectedCols>/<recompute_base>/<new_base>/<bmin>/<bmax>/<sob>/<eob>', methods=['GET'])
 def get_mrdmd_results(nodes, selectedCols, recompute_base=0, new_base=0, bmin=None, bmax=None, sob=None, eob=None):
-    global ts_data
-
     colsList = list([col.replace('%', ' ') for col in selectedCols.split(',') if col.strip()] )
     nodeList = list(set(nodes.split(',')))
     cols = ['timestamp', 'nodeId'] + colsList
 
-    filtered_data = ts_data[ts_data['nodeId'].isin(nodeList)]
+    data = load_columns(cols)
+    filtered_data = data[data['nodeId'].isin(nodeList)]
 
     # print('mrdmd:', filtered_data[cols].shape)
     avail_cols = [col for col in cols if col in filtered_data.columns]
     print('mrdmd:', filtered_data[avail_cols].shape)
 
     if (filtered_data.shape[0] > 0):
+        tensor = get_ts_tensor(nodeList, avail_cols[2:])
         if (int(new_base) == 0):
-            zscores, baselines = get_mrdmd(filtered_data[avail_cols], int(recompute_base))
+            zscores, baselines = get_mrdmd(filtered_data[avail_cols], int(recompute_base), tensor=tensor,
+                                           full_df=data[avail_cols], version=dataset_version)
         else:
             start_time = pd.to_datetime(sob)
             end_time = pd.to_datetime(eob)
-            zscores, baselines = get_mrdmd_with_new_base(filtered_data[avail_cols], selectedCols, float(bmin), float(bmax), start_time, end_time)
+            zscores, baselines = get_mrdmd_with_new_base(filtered_data[avail_cols], selectedCols, float(bmin), float(bmax), start_time, end_time,
+                                                         tensor=tensor, full_df=data[avail_cols], version=dataset_version)
     else: 
         zscores = pd.DataFrame()
         baselines = pd.DataFrame()
@@ -147,42 +233,113 @@ def get_mrdmd_results(nodes, selectedCols, recompute_base=0, new_base=0, bmin=No
     }
     return jsonify(response)
 
-import numpy as np
-from scipy.optimize import linear_sum_assignment
+@app.route('/mrdmdLevels/<nodes>/<selectedCols>', methods=['GET'])
+def get_mrdmd_levels_results(nodes, selectedCols):
+    """
+    Node x time x level anomaly heatmap: per column, the z-score of every node for each
+    dyadic time segment at every mrDMD level. Optional query parameter levels (deepest level).
+    """
+    colsList = list([col.replace('%', ' ') for col in selectedCols.split(',') if col.strip()] )
+    nodeList = list(set(nodes.split(',')))
+    cols = ['timestamp', 'nodeId'] + colsList
+    max_levels = request.args.get('levels')
+
+    data = load_columns(cols)
+    filtered_data = data[data['nodeId'].isin(nodeList)]
+    avail_cols = [col for col in cols if col in filtered_data.columns]
+    if filtered_data.shape[0] == 0:
+        return jsonify({})
+
+    levels = get_mrdmd_levels(filtered_data[avail_cols], tensor=get_ts_tensor(nodeList, avail_cols[2:]),
+                              full_df=data[avail_cols], version=dataset_version,
+                              max_levels=None if max_levels is None else int(max_levels))
+    response = {}
+    for col, res in levels.items():
+        Z = res["zscores"]
+        response[col] = {
+            "nodes": res["nodes"],
+            "segments": [{"level": int(l), "b_start": str(s), "b_end": str(e)}
+                         for l, s, e in zip(res["levels"], res["b_start"], res["b_end"])],
+            "zscores": np.where(np.isfinite(Z), Z, None).tolist()
+        }
+    return jsonify(response)
 
-def align_clusters(old_df, new_df):
+@app.route('/baselineCandidates/<selectedCols>', methods=['GET'])
+def get_baseline_candidates_route(selectedCols):
     """
-    Renames new_df['Cluster'] labels to match old_df['Cluster'] labels
-    based on the highest node overlap.
+    Baseline value range and the longest windows where every node stays inside it, per column.
+    Optional query parameters: nodes (comma separated, default all) and top (windows per column).
     """
-    old_clusters = sorted(old_df['Cluster'].unique())
-    new_clusters = sorted(new_df['Cluster'].unique())
-    
-    cost_matrix = np.zeros((len(old_clusters), len(new_clusters)))
-    
-    for i, old_c in enumerate(old_clusters):
-        nodes_old = set(old_df[old_df['Cluster'] == old_c]['nodeId'])
-        for j, new_c in enumerate(new_clusters):
-            nodes_new = set(new_df[new_df['Cluster'] == new_c]['nodeId'])
-            # Cost is the number of nodes NOT in common
-            intersection = len(nodes_old.intersection(nodes_new))
-            cost_matrix[i, j] = -intersection
-
-    # Hungarian Algorithm to find best mapping
-    row_ind, col_ind = linear_sum_assignment(cost_matrix)
-    mapping = {new_clusters[col]: old_clusters[row] for row, col in zip(row_ind, col_ind)}
-    new_df['Cluster'] = new_df['Cluster'].map(mapping)
-    return new_df
+    colsList = list([col.replace('%', ' ') for col in selectedCols.split(',') if col.strip()] )
+    nodes = request.args.get('nodes')
+    node_list = [n for n in nodes.split(',') if n] if nodes else None
+    top_n = int(request.args.get('top', TOP_N))
+    tensor = get_ts_tensor(node_list, colsList)
+    if tensor is None or len(tensor.node_ids) == 0:
+        return jsonify({})
+    candidates = get_baseline_candidates(tensor, list(tensor.metrics), dataset_version, top_n)
+    return jsonify({col: {"v_min": c["v_min"], "v_max": c["v_max"],
+                          "windows": [{"b_start": str(w["b_start"]), "b_end": str(w["b_end"]), "length": w["length"]}
+                                      for w in c["windows"]]}
+                    for col, c in candidates.items()})
+
+@app.route('/baselines', methods=['GET'])
+def get_saved_baselines():
+    """
+    Saved mrDMD baselines, most recently used first. Optional query parameters: feature,
+    and version (default the loaded dataset's, 'all' for every version).
+    """
+    version = request.args.get('version', dataset_version)
+    entries = list_baselines(feature=request.args.get('feature'), version=None if version == 'all' else version)
+    for e in entries:
+        if e["z_score"] is not None and not np.isfinite(e["z_score"]):
+            e["z_score"] = None
+    return jsonify(entries)
+
+@app.route('/baselines/<key>/use', methods=['POST'])
+def use_saved_baseline(key):
+    """Switches the baseline of the entry's feature to a saved one, without recomputation"""
+    Z_b = use_baseline(key)
+    if Z_b is None:
+        abort(404, description=f"Unknown baseline {key}")
+    Z_b = Z_b.replace({np.nan: None, np.inf: None, -np.inf: None})
+    return jsonify({"baselines": Z_b.to_dict(orient='records')})
+
+@app.route('/baselines/<key>', methods=['DELETE'])
+def evict_saved_baseline(key):
+    if not evict_baseline(key):
+        abort(404, description=f"Unknown baseline {key}")
+    return jsonify({"status": "evicted", "key": key})
 
-def compute_dr_data(n_neighbors, min_dist, num_clusters):
-    global ts_data
-    df = get_dr_time(ts_data, int(n_neighbors), float(min_dist), int(num_clusters), 1)
+import numpy as np
 
-    if os.path.exists(CLUSTER_CACHE_NAME):
+def get_streaming_dr1(tensor, version):
+    """DR1 from the incremental model; refits over the whole history when it is stale or drifted"""
+    if dr1_model.needs_refit or not dr1_model.fitted:
+        refit_start = timer()
+        dr1_model.fit(tensor)
+        print(f'DR1 full refit in {timer() - refit_start}s')
+        with ingest_lock:
+            # batches ingested while fitting were not folded in
+            if version != dataset_version:
+                dr1_model.needs_refit = True
+    return dr1_model.frame()
+
+def compute_dr_data(n_neighbors, min_dist, num_clusters):
+    ts_data = get_ts_data()
+    version = dataset_version
+    tensor = get_ts_tensor()
+    streaming = stream_buffer is not None
+    dr1 = get_streaming_dr1(tensor, version) if DR1_INCREMENTAL and streaming else None
+    df = get_dr_time(ts_data, int(n_neighbors), float(min_dist), int(num_clusters), 0, tensor=tensor, dr1=dr1,
+                     incremental=streaming, version=version)
+
+    if len(cluster_tracker) == 0 and os.path.exists(CLUSTER_CACHE_NAME):
+        # continue from the assignments last shown by /drTimeData
         df_old = pd.read_parquet(CLUSTER_CACHE_NAME)
-        df_new = align_clusters(df_old, df)
-    else:
-        df_new = df
+        cluster_tracker.update(df_old['nodeId'], df_old['Cluster'], version='cached')
+    df_new = df
+    df_new['Cluster'] = cluster_tracker.update(df['nodeId'], df['Cluster'], version=version)
 
     fc_start = timer()
     agg_feat_contrib_mat, label_to_rows, label_to_rep_row, order_col = get_feat_contributions(df_new)
@@ -199,16 +356,18 @@ def compute_dr_data(n_neighbors, min_dist, num_clusters):
         },
     }
 
-def compute_mrdmd(nodes, selectedCols, recompute_base):
-    global ts_data
+def compute_mrdmd(nodes, selectedCols, recompute_base, online=False):
     colsList = [col.replace('%', ' ') for col in selectedCols.split(',') if col.strip()]
     nodeList = list(set(nodes.split(',')))
-    avail_cols = ['timestamp', 'nodeId'] + [c for c in colsList if c in ts_data.columns]
+    data = load_columns(['timestamp', 'nodeId'] + colsList)
+    avail_cols = ['timestamp', 'nodeId'] + [c for c in colsList if c in data.columns]
     
-    filtered_data = ts_data[ts_data['nodeId'].isin(nodeList)]
+    filtered_data = data[data['nodeId'].isin(nodeList)]
     
     if not filtered_data.empty:
-        zscores, baselines = get_mrdmd(filtered_data[avail_cols], int(recompute_base))
+        zscores, baselines = get_mrdmd(filtered_data[avail_cols], int(recompute_base), tensor=get_ts_tensor(nodeList, avail_cols[2:]),
+                                       full_df=data[avail_cols], version=dataset_version, online=online,
+                                       stream=stream_buffer if online else None)
     else:
         zscores, baselines = pd.DataFrame(), pd.DataFrame()
 
@@ -219,30 +378,64 @@ def compute_mrdmd(nodes, selectedCols, recompute_base):
 
 @app.route('/nodeData/<selectedCols>/<file>', methods=['GET'])
 def get_node_data(selectedCols, file):
-    global ts_data
-
-    if ts_data is None or ts_data.empty:
-        ts_data = get_timeseries_data(file)
-    
+    """
+    Optional query parameters: start/end (timestamps) restrict the time window,
+    points (per node and column) and method (lttb or minmax) decimate the series.
+    Without them every row of the selected columns is returned.
+    """
     colsList = list([col.replace('%', ' ') for col in selectedCols.split(',') if col.strip()] )
     cols = ['timestamp', 'nodeId'] + colsList
-    df = ts_data[cols].copy()
+    start, end = request.args.get('start'), request.args.get('end')
+    points = request.args.get('points', type=int)
+    method = request.args.get('method', 'lttb')
+
+    if start is None and end is None and points is None:
+        df = load_columns(cols, file).copy()
+        check_cols = [col for col in df.columns if col not in ['nodeId', 'timestamp']]
+        df['downtime'] = (df[check_cols] == 0).all(axis=1).astype(int)
+    else:
+        # windowed/decimated query: binary search on the tensor time axis, downtime only on returned rows.
+        # Before the full frame is loaded only the window of the selected store columns becomes a tensor.
+        try:
+            if is_loaded():
+                tensor = get_ts_tensor()
+            else:
+                tensor = MetricTensor.from_frame(window_frame(load_columns(cols, file), start, end))
+            df = decimate(tensor, colsList, start=start, end=end, points=points, method=method)
+        except ValueError as e:
+            abort(400, description=str(e))
     
+    columns = get_ts_data().columns if is_loaded() else get_dataset_store(filepath+file).metrics
     excluded = ['nodeId', 'timestamp', 'Retrans', 'PCA', 'UMAP', 't-SNE', 'Cluster']
-    all_features = [col for col in ts_data.columns if not any(exclude in col for exclude in excluded)]
-    
-    check_cols = [col for col in df.columns if col not in ['nodeId', 'timestamp']]
-    df['downtime'] = (df[check_cols] == 0).all(axis=1).astype(int)
+    all_features = [col for col in columns if not any(exclude in col for exclude in excluded)]
 
     return jsonify({
         "data": df.to_dict(orient='records'),
         "features": all_features
     })
 
+def ingest_batch(new_batch):
+    """Shared ingest path for /ingest_stream and the background stream sources"""
+    global dataset_version, stream_buffer
+    history = get_ts_data() if stream_buffer is None else None
+
+    with ingest_lock:
+        # upsert costs O(batch), retention bounds the history
+        if stream_buffer is None:
+            stream_buffer = StreamBuffer.from_frame(history, retention=STREAM_RETENTION, max_rows=STREAM_MAX_ROWS,
+                                                    compact=COMPACT_MODE, float32=COMPACT_FLOAT32)
+        evictions = stream_buffer.evictions
+        stream_buffer.upsert(new_batch)
+        streaming_state["batches_ingested"] += 1
+        if DR1_INCREMENTAL and dr1_model.fitted:
+            if stream_buffer.evictions != evictions:
+                dr1_model.needs_refit = True
+            else:
+                dr1_model.update(MetricTensor.from_frame(new_batch, dtype=np.float64))
+        dataset_version = f"{get_dataset_store(filepath+file).version}-b{streaming_state['batches_ingested']:05d}"
+
 @app.route('/ingest_stream/<selectedCols>/<nodeList>/<n_neighbors>/<min_dist>/<num_clusters>', methods=['POST'])
 def ingest_stream(selectedCols, nodeList, n_neighbors, min_dist, num_clusters):
-    global ts_data, streaming_state
-    
     batch_dir = os.path.join(filepath, 'batch')
     idx = streaming_state["next_batch_idx"]
     filename = f"batch_{idx:03d}.csv"
@@ -253,15 +446,11 @@ def ingest_stream(selectedCols, nodeList, n_neighbors, min_dist, num_clusters):
 
     try:
         # loading the new batch
-        new_batch = pd.read_csv(file_path).fillna(0.0)
-        if 'time_secs' in new_batch.columns:
-            new_batch['timestamp'] = new_batch['time_secs']
-        if 'cname_processed' in new_batch.columns:
-            new_batch['nodeId'] = new_batch['cname_processed']
+        new_batch = normalize_columns(pd.read_csv(file_path).fillna(0.0))
 
         # updating global data
-        ts_data = pd.concat([ts_data, new_batch], ignore_index=True)
-        ts_data = ts_data.drop_duplicates(subset=['timestamp', 'nodeId'], keep='last')
+        ingest_batch(new_batch)
+        ts_data = get_ts_data()
         print("Updated ts_data shape:", ts_data.shape)
 
         colsList = list([col.replace('%', ' ') for col in selectedCols.split(',') if col.strip()] )
@@ -273,7 +462,11 @@ def ingest_stream(selectedCols, nodeList, n_neighbors, min_dist, num_clusters):
         # recomputing pipeline
         with ThreadPoolExecutor(max_workers=2) as executor:
             future_dr = executor.submit(compute_dr_data, n_neighbors, min_dist, num_clusters)
-            future_mrdmd = executor.submit(compute_mrdmd, nodeList, selectedCols, 1)
+            if MRDMD_ONLINE:
+                # online trees only decompose the bins the new samples fall into (cached baselines)
+                future_mrdmd = executor.submit(compute_mrdmd, nodeList, selectedCols, 0, online=True)
+            else:
+                future_mrdmd = executor.submit(compute_mrdmd, nodeList, selectedCols, 1)
 
             dr_results = future_dr.result()
             mrdmd_results = future_mrdmd.result()
@@ -290,8 +483,65 @@ def ingest_stream(selectedCols, nodeList, n_neighbors, min_dist, num_clusters):
     except Exception as e:
         return jsonify({"error": str(e)}), 500     
 
+@app.route('/stream/start/<kind>', methods=['POST'])
+def start_stream_source(kind):
+    """
+    Starts a background source feeding ingest_batch. kind is one of batch, directory,
+    socket or replay (see scripts/stream_sources.py); the JSON body holds its parameters.
+    """
+    global stream_runner
+    if stream_runner is not None and stream_runner.running:
+        return jsonify({"error": "A stream source is already running."}), 409
+
+    params = request.get_json(silent=True) or {}
+    if kind == 'batch':
+        params.setdefault('batch_dir', os.path.join(filepath, 'batch'))
+        params.setdefault('start_idx', streaming_state["next_batch_idx"])
+    try:
+        source = make_source(kind, **params)
+    except (TypeError, ValueError, OSError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    ingest = ingest_batch
+    if kind == 'batch':
+        def ingest(batch):
+            # keeps /ingest_stream and later batch sources in step with the files ingested here
+            ingest_batch(batch)
+            streaming_state["next_batch_idx"] = source.next_idx
+
+    stream_runner = StreamRunner(source, ingest).start()
+    return jsonify({"status": "started", "source": kind})
+
+@app.route('/stream/stop', methods=['POST'])
+def stop_stream_source():
+    if stream_runner is None:
+        return jsonify({"status": "idle"})
+    stream_runner.stop()
+    return jsonify({"status": "stopped", "stats": stream_runner.stats()})
+
+@app.route('/refitDR1', methods=['POST'])
+def refit_dr1():
+    """Requests a full DR1 refit on the next DR computation"""
+    drift = dr1_model.drift() if dr1_model.fitted else None
+    dr1_model.needs_refit = True
+    return jsonify({"status": "scheduled", "drift": drift})
+
+@app.route('/stream/stats', methods=['GET'])
+def get_stream_stats():
+    stats = stream_runner.stats() if stream_runner is not None else {"running": False}
+    stats["buffered_rows"] = len(stream_buffer) if stream_buffer is not None else 0
+    stats["dataset_version"] = dataset_version
+    stats["mrdmd_online"] = online_stats()
+    stats["dr1_drift"] = dr1_model.drift() if dr1_model.fitted else None
+    stats["dr1_needs_refit"] = dr1_model.needs_refit
+    stats["dr_cache"] = get_dr_cache().stats()
+    stats["baseline_registry"] = get_baseline_registry().stats()
+    return jsonify(stats)
+
 if __name__ == '__main__':
-    ts_data = get_timeseries_data(file)
     clear_caches()
     reset_stream()
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # the serving process (not the reloader's watcher) boots its pool workers while idle
+        start_pool()
     app.run(debug=True, port=5010)
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""mrDMD z-scores through every svd backend and engine against the exact recursive path"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVER_DIR, os.path.join(SERVER_DIR, 'scripts', 'src')]
+
+from scripts import mrdmd_worker
+
+CONFIGS = [{"svd_backend": b, "engine": e} for b in ('exact', 'qr', 'randomized') for e in ('recursive', 'levels')]
+RTOL = 1e-7
+
+def make_metric(offset, n_nodes=40, n_t=600, seed=0):
+    """nodes x time: small oscillations and noise on top of a constant level"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_t)
+    amp = rng.uniform(0.5, 2, (n_nodes, 1))
+    phase = rng.uniform(0, 2 * np.pi, (n_nodes, 1))
+    return (offset + 1e-2 * amp * np.sin(2 * np.pi * t / 60 + phase) + 1e-3 * np.sin(2 * np.pi * t / 7)
+            + rng.normal(0, 1e-4, (n_nodes, n_t)))
+
+def zscores(M, base_mask, config):
+    std_baselines = mrdmd_worker.baseline_std(M, base_mask, config)
+    return np.asarray(std_baselines, dtype=float), np.asarray(mrdmd_worker.selection_zscores(M, base_mask, std_baselines, config))
+
+# offset data is where a Gram (X^T X) decomposition loses accuracy
+@pytest.mark.parametrize("offset", [0, 97, 1e4])
+def test_backends_match_exact(offset):
+    M = make_metric(offset)
+    base_mask = np.zeros(M.shape[1], dtype=bool)
+    base_mask[:200] = True
+    std_ref, z_ref = zscores(M, base_mask, CONFIGS[0])
+    assert np.isfinite(z_ref).all()
+    for config in CONFIGS[1:]:
+        std, z = zscores(M, base_mask, config)
+        np.testing.assert_allclose(std, std_ref, rtol=RTOL, err_msg=str(config))
+        np.testing.assert_allclose(z, z_ref, rtol=0, atol=RTOL * np.abs(z_ref).max(), err_msg=str(config))
@@ -0,0 +1,37 @@
+"""Level-0 segment of the mrDMD level z-scores against the z-scores /mrdmd returns for the same selection"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVER_DIR, os.path.join(SERVER_DIR, 'scripts', 'src')]
+
+from scripts import mrdmd_worker
+
+CONFIGS = [{"svd_backend": b, "engine": e} for b in ('exact', 'qr') for e in ('recursive', 'levels')]
+
+def make_metric(n_nodes=12, n_t=900, seed=0):
+    """nodes x time: per-node oscillations, a burst on a few nodes and noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_t)
+    M = 5 + rng.uniform(0.5, 2, (n_nodes, 1)) * np.sin(2 * np.pi * t / rng.uniform(40, 120, (n_nodes, 1)))
+    M[:3, 500:650] += 3 * np.sin(2 * np.pi * t[500:650] / 9)
+    return M + rng.normal(0, 0.1, M.shape)
+
+@pytest.mark.parametrize("config", CONFIGS, ids=lambda c: f"{c['svd_backend']}-{c['engine']}")
+def test_level0_matches_selection_zscores(config):
+    M = make_metric()
+    base_mask = np.zeros(M.shape[1], dtype=bool)
+    base_mask[:200] = True
+    std_baselines = mrdmd_worker.baseline_std(M, base_mask, config)[0]
+
+    z = mrdmd_worker.selection_zscores(M, base_mask, std_baselines, config)
+    segments, Z = mrdmd_worker.selection_level_zscores(M, base_mask, std_baselines, config)
+
+    assert tuple(segments[0]) == (0, 0, M.shape[1])
+    assert Z.shape == (M.shape[0], len(segments))
+    np.testing.assert_allclose(Z[:, 0], z, rtol=1e-12, atol=1e-12)
+    # deeper levels split the timeline into halves
+    assert (segments[:, 0] == 1).sum() == 2
@@ -0,0 +1,50 @@
+"""MRDMD_TREE_MODE: z-scores sliced from one all-node tree against the per-selection decomposition"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVER_DIR, os.path.join(SERVER_DIR, 'scripts', 'src')]
+
+from scripts import mrdmd_worker
+
+CONFIG = {"svd_backend": "qr", "engine": "levels"}
+N_NODES = 40
+# documented error of tree mode (see README): relative to the selection's largest |z|
+MAX_REL_DIFF = 0.85
+MIN_CORR = 0.9
+
+def make_metric(seed, n_t=900):
+    """nodes x time: per-node oscillations, a burst on a few nodes and noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_t)
+    M = 5 + rng.uniform(0.5, 2, (N_NODES, 1)) * np.sin(2 * np.pi * t / rng.uniform(40, 120, (N_NODES, 1)))
+    M[:5, 500:650] += 3 * np.sin(2 * np.pi * t[500:650] / 9)
+    return M + rng.normal(0, 0.1, M.shape)
+
+def tree_and_selection(seed, rows):
+    """(tree mode z-scores, per-selection z-scores) of the given node rows"""
+    M = make_metric(seed)
+    base_mask = np.zeros(M.shape[1], dtype=bool)
+    base_mask[:200] = True
+    std_baselines = mrdmd_worker.baseline_std(M, base_mask, CONFIG)[0]
+    power = mrdmd_worker.tree_row_power(mrdmd_worker.mode_tree(M, base_mask, CONFIG), M.shape[1])
+    # as mrdmd._slice_zscores: selected rows against the mean of their baseline rows
+    z_tree = (power[rows] - np.mean(power[N_NODES + rows])) / std_baselines
+    z_sel = mrdmd_worker.selection_zscores(M[rows], base_mask, std_baselines, CONFIG)
+    return z_tree, z_sel
+
+@pytest.mark.parametrize("seed", range(4))
+def test_tree_mode_exact_for_all_nodes(seed):
+    z_tree, z_sel = tree_and_selection(seed, np.arange(N_NODES))
+    np.testing.assert_allclose(z_tree, z_sel, rtol=1e-9, atol=1e-9)
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("size", [5, 12])
+def test_tree_mode_error_bounded_for_subsets(seed, size):
+    rows = np.sort(np.random.default_rng(seed + 10).choice(N_NODES, size, replace=False))
+    z_tree, z_sel = tree_and_selection(seed, rows)
+    assert np.abs(z_tree - z_sel).max() <= MAX_REL_DIFF * np.abs(z_sel).max()
+    assert np.corrcoef(z_tree, z_sel)[0, 1] >= MIN_CORR